@@ -0,0 +1,268 @@
+import argparse
+import csv
+import json
+import os
+from typing import Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from utils.logging_config import log_indent, logger
+from config.constants import TIMESTAMP_FORMAT, CHUNK_SIZE
+from src.extraction import convert_to_parquet
+from src.transformation.schema import decode_uuids
+
+CURRENCIES = ['USD', 'EUR', 'GBP', 'INR', 'AUD', 'CAD']
+PAYMENT_METHOD_TYPES = ['credit_card', 'debit_card', 'wallet']
+REASON_CODES = ['duplicate_charge', 'fraud', 'other', 'product_not_received']
+CHARGEBACK_COLUMNS = ['transaction_id', 'dispute_date', 'amount', 'reason_code', 'status', 'resolution_date']
+
+# The generated timestamps are spread over a year, the transactions and chargebacks follow their order
+START_DATE = pd.Timestamp('2023-01-01')
+DAY_SECONDS = 24 * 60 * 60
+
+def random_uuids(rng: np.random.Generator, size: int) -> pd.Series:
+    """
+    Generate random version 4 UUID strings.
+
+    :param rng: The random generator.
+    :type rng: np.random.Generator
+    :param size: The number of UUIDs.
+    :type size: int
+    :return: Series of the UUID strings.
+    :rtype: pd.Series
+    """
+
+    uuid_bytes = rng.integers(0, 256, size=(size, 16), dtype=np.uint8)
+    uuid_bytes[:, 6] = (uuid_bytes[:, 6] & 0x0f) | 0x40
+    uuid_bytes[:, 8] = (uuid_bytes[:, 8] & 0x3f) | 0x80
+
+    array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), size, [None, pa.py_buffer(uuid_bytes.tobytes())])
+
+    return decode_uuids(pd.Series(pd.arrays.ArrowExtensionArray(array)))
+
+def format_timestamps(seconds: np.ndarray) -> np.ndarray:
+    """
+    Format seconds since START_DATE as timestamp strings in the TIMESTAMP_FORMAT of the data sources.
+
+    :param seconds: The seconds since START_DATE.
+    :type seconds: np.ndarray
+    :return: The timestamp strings.
+    :rtype: np.ndarray
+    """
+
+    return (START_DATE + pd.to_timedelta(seconds, unit='s')).strftime(TIMESTAMP_FORMAT).to_numpy()
+
+def generate_chunk(seed: int, chunk_number: int, first_order: int, size: int, failure_ratio: float,
+                   pending_ratio: float, dispute_ratio: float) -> Dict[str, List[dict]]:
+    """
+    Generate a chunk of orders, with one transaction for each order and a chargeback for the disputed transactions.
+    Each chunk has its own random generator seeded by the seed and the chunk number,
+    so the same arguments and chunk size always generate the same data.
+
+    :param seed: The seed of the generated data.
+    :type seed: int
+    :param chunk_number: The number of the chunk.
+    :type chunk_number: int
+    :param first_order: The number of the first order of the chunk.
+    :type first_order: int
+    :param size: The number of orders in the chunk.
+    :type size: int
+    :param failure_ratio: The ratio of failed transactions.
+    :type failure_ratio: float
+    :param pending_ratio: The ratio of pending transactions.
+    :type pending_ratio: float
+    :param dispute_ratio: The ratio of transactions with a chargeback.
+    :type dispute_ratio: float
+    :return: Dictionary of the orders, transactions and chargebacks records.
+    :rtype: Dict[str, List[dict]]
+    """
+
+    rng = np.random.default_rng([seed, chunk_number])
+
+    # Items, the total amount is summed one item position at a time, the same way the validations sum it
+    items_count = rng.integers(1, 6, size)
+    total_items = int(items_count.sum())
+    item_orders = np.repeat(np.arange(size), items_count)
+    item_positions = np.arange(total_items) - np.repeat(np.cumsum(items_count) - items_count, items_count)
+    product_ids = rng.integers(1, 1001, total_items)
+    quantities = rng.integers(1, 6, total_items)
+    unit_prices = rng.integers(100, 50000, total_items) / 100
+
+    total_amounts = np.zeros(size)
+    for item_position in range(int(items_count.max()) if size else 0):
+        selected = item_positions == item_position
+        total_amounts[item_orders[selected]] += quantities[selected] * unit_prices[selected]
+    total_amounts = np.round(total_amounts, 6)
+
+    # Orders
+    order_seconds = rng.integers(0, 365 * DAY_SECONDS, size)
+    currencies = np.array(CURRENCIES)[rng.integers(0, len(CURRENCIES), size)]
+    customer_ids = random_uuids(rng, size).to_numpy()
+
+    # Transactions
+    draws = rng.random(size)
+    statuses = np.where(draws < failure_ratio, 'failed',
+                        np.where(draws < failure_ratio + pending_ratio, 'pending', 'completed'))
+    transaction_ids = random_uuids(rng, size).to_numpy()
+    transaction_seconds = order_seconds + rng.integers(0, 3 * DAY_SECONDS, size)
+    payment_method_types = np.array(PAYMENT_METHOD_TYPES)[rng.integers(0, len(PAYMENT_METHOD_TYPES), size)]
+    providers = rng.integers(1, 51, size)
+    # Every transaction gets an error code, the clean stage drops the rows with missing values
+    error_codes = rng.integers(100, 1000, size)
+
+    # Chargebacks, the open chargebacks get their expected resolution date as the model requires a date
+    disputed = np.flatnonzero(rng.random(size) < dispute_ratio)
+    dispute_seconds = transaction_seconds[disputed] + rng.integers(DAY_SECONDS, 60 * DAY_SECONDS, len(disputed))
+    resolution_seconds = dispute_seconds + rng.integers(0, 30 * DAY_SECONDS, len(disputed))
+    reason_codes = np.array(REASON_CODES)[rng.integers(0, len(REASON_CODES), len(disputed))]
+    chargeback_statuses = np.where(rng.random(len(disputed)) < 0.5, 'open', 'resolved')
+
+    order_timestamps = format_timestamps(order_seconds)
+    transaction_timestamps = format_timestamps(transaction_seconds)
+    dispute_dates = format_timestamps(dispute_seconds)
+    resolution_dates = format_timestamps(resolution_seconds)
+
+    item_starts = np.cumsum(items_count) - items_count
+    items = [{'product_id': f"product_{product_id}", 'quantity': int(quantity), 'unit_price': float(unit_price)}
+             for product_id, quantity, unit_price in zip(product_ids, quantities, unit_prices)]
+
+    orders = [{
+        'order_id': f"order_{first_order + position}",
+        'customer_id': customer_ids[position],
+        'timestamp': order_timestamps[position],
+        'total_amount': float(total_amounts[position]),
+        'currency': currencies[position],
+        'items': items[item_starts[position]:item_starts[position] + items_count[position]],
+        'payment_status': 'failed' if statuses[position] == 'failed' else 'paid'
+    } for position in range(size)]
+
+    transactions = [{
+        'transaction_id': transaction_ids[position],
+        'order_id': f"order_{first_order + position}",
+        'timestamp': transaction_timestamps[position],
+        'amount': float(total_amounts[position]),
+        'currency': currencies[position],
+        'status': statuses[position],
+        'payment_method': {'type': payment_method_types[position], 'provider': f"provider_{providers[position]}"},
+        'error_code': f"error_{error_codes[position]}"
+    } for position in range(size)]
+
+    chargebacks = [{
+        'transaction_id': transaction_ids[position],
+        'dispute_date': dispute_dates[number],
+        'amount': float(total_amounts[position]),
+        'reason_code': reason_codes[number],
+        'status': chargeback_statuses[number],
+        'resolution_date': resolution_dates[number]
+    } for number, position in enumerate(disputed)]
+
+    return {'orders': orders, 'transactions': transactions, 'chargebacks': chargebacks}
+
+def generate_chunks(rows: int, seed: int, failure_ratio: float, pending_ratio: float, dispute_ratio: float,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Dict[str, List[dict]]]:
+    """
+    Generate the datasets in chunks of orders.
+
+    :param rows: The number of orders and transactions.
+    :type rows: int
+    :param seed: The seed of the generated data.
+    :type seed: int
+    :param failure_ratio: The ratio of failed transactions.
+    :type failure_ratio: float
+    :param pending_ratio: The ratio of pending transactions.
+    :type pending_ratio: float
+    :param dispute_ratio: The ratio of transactions with a chargeback.
+    :type dispute_ratio: float
+    :param chunk_size: The number of orders in each chunk.
+    :type chunk_size: int
+    :return: Iterator of the records of each chunk.
+    :rtype: Iterator[Dict[str, List[dict]]]
+    """
+
+    for chunk_number, first_row in enumerate(range(0, rows, chunk_size)):
+        yield generate_chunk(seed, chunk_number, first_row + 1, min(chunk_size, rows - first_row),
+                             failure_ratio, pending_ratio, dispute_ratio)
+
+def generate_datasets(output_dir: str, rows: int, seed: int = 0, failure_ratio: float = 0.2,
+                      pending_ratio: float = 0.05, dispute_ratio: float = 0.02, file_format: str = 'json',
+                      chunk_size: int = CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Generate synthetic orders, transactions and chargebacks that pass the validations, in the formats of the
+    data sources. The records are written a chunk at a time, so the memory used does not grow with the rows.
+
+    :param output_dir: The directory of the generated files.
+    :type output_dir: str
+    :param rows: The number of orders and transactions.
+    :type rows: int
+    :param seed: The seed of the generated data.
+    :type seed: int
+    :param failure_ratio: The ratio of failed transactions.
+    :type failure_ratio: float
+    :param pending_ratio: The ratio of pending transactions.
+    :type pending_ratio: float
+    :param dispute_ratio: The ratio of transactions with a chargeback.
+    :type dispute_ratio: float
+    :param file_format: 'json' for JSON orders and transactions and a CSV of chargebacks, or 'parquet'.
+    :type file_format: str
+    :param chunk_size: The number of orders generated at a time.
+    :type chunk_size: int
+    :return: Dictionary of the dataset names to the generated file paths.
+    :rtype: Dict[str, str]
+    :raises Exception: If there is an error generating the datasets.
+    """
+
+    logger.info(f"Starting generating {rows} orders and transactions to {output_dir}")
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        file_paths = {'orders': os.path.join(output_dir, 'orders.json'),
+                      'transactions': os.path.join(output_dir, 'transactions.json'),
+                      'chargebacks': os.path.join(output_dir, 'chargebacks.csv')}
+
+        with open(file_paths['orders'], 'w') as orders_file, \
+                open(file_paths['transactions'], 'w') as transactions_file, \
+                open(file_paths['chargebacks'], 'w', newline='') as chargebacks_file:
+            chargebacks_writer = csv.DictWriter(chargebacks_file, fieldnames=CHARGEBACK_COLUMNS)
+            chargebacks_writer.writeheader()
+            separator = '[\n'
+
+            for chunk in generate_chunks(rows, seed, failure_ratio, pending_ratio, dispute_ratio, chunk_size):
+                orders_file.write(separator + ',\n'.join(json.dumps(order) for order in chunk['orders']))
+                transactions_file.write(separator + ',\n'.join(json.dumps(transaction)
+                                                               for transaction in chunk['transactions']))
+                chargebacks_writer.writerows(chunk['chargebacks'])
+                separator = ',\n'
+
+            orders_file.write('\n]\n' if separator == ',\n' else '[]\n')
+            transactions_file.write('\n]\n' if separator == ',\n' else '[]\n')
+
+        if file_format == 'parquet':
+            with log_indent():
+                for dataset, file_path in list(file_paths.items()):
+                    file_paths[dataset] = os.path.join(output_dir, f"{dataset}.parquet")
+                    convert_to_parquet(file_path, file_paths[dataset], dataset, chunk_size)
+                    os.remove(file_path)
+
+        logger.info(f"Successfully generated the datasets to {output_dir}")
+
+        return file_paths
+
+    except Exception as e:
+        logger.error(f"Error generating the datasets: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic orders, transactions and chargebacks")
+    parser.add_argument('--output-dir', required=True, help="The directory of the generated files")
+    parser.add_argument('--rows', type=int, default=10000, help="The number of orders and transactions")
+    parser.add_argument('--seed', type=int, default=0, help="The seed of the generated data")
+    parser.add_argument('--failure-ratio', type=float, default=0.2, help="The ratio of failed transactions")
+    parser.add_argument('--pending-ratio', type=float, default=0.05, help="The ratio of pending transactions")
+    parser.add_argument('--dispute-ratio', type=float, default=0.02, help="The ratio of transactions with a chargeback")
+    parser.add_argument('--format', choices=['json', 'parquet'], default='json', help="The format of the files")
+    args = parser.parse_args()
+
+    generate_datasets(args.output_dir, args.rows, args.seed, args.failure_ratio, args.pending_ratio,
+                      args.dispute_ratio, args.format)
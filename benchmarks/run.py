@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from tabulate import tabulate
+
+from utils.logging_config import log_indent, logger
+from benchmarks.generate import generate_datasets
+
+BENCHMARK_DATA_DIR = os.path.join('.benchmarks', 'data')
+BENCHMARK_RESULTS_FILE = os.path.join('benchmarks', 'results.jsonl')
+
+def git_revision() -> dict:
+    """
+    Get the commit the benchmark runs on and whether the working tree has uncommitted changes.
+
+    :return: Dictionary with the commit hash and the dirty indication, the commit is None outside of a git repository.
+    :rtype: dict
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                                text=True, check=True).stdout
+
+        return {'commit': commit.strip(), 'dirty': bool(status.strip())}
+
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+def benchmark_data(rows: int, seed: int, failure_ratio: float, pending_ratio: float, dispute_ratio: float,
+                   file_format: str, data_dir: str = BENCHMARK_DATA_DIR) -> dict:
+    """
+    Get the synthetic datasets of the benchmark arguments, generated only if they were not generated before.
+
+    :param rows: The number of orders and transactions.
+    :type rows: int
+    :param seed: The seed of the generated data.
+    :type seed: int
+    :param failure_ratio: The ratio of failed transactions.
+    :type failure_ratio: float
+    :param pending_ratio: The ratio of pending transactions.
+    :type pending_ratio: float
+    :param dispute_ratio: The ratio of transactions with a chargeback.
+    :type dispute_ratio: float
+    :param file_format: 'json' or 'parquet'.
+    :type file_format: str
+    :param data_dir: The directory of the generated datasets.
+    :type data_dir: str
+    :return: Dictionary of the dataset names to the file paths.
+    :rtype: dict
+    """
+
+    name = f"{rows}-seed{seed}-failed{failure_ratio}-pending{pending_ratio}-disputed{dispute_ratio}-{file_format}"
+    output_dir = os.path.join(data_dir, name)
+    marker_path = os.path.join(output_dir, 'datasets.json')
+
+    if os.path.exists(marker_path):
+        with open(marker_path) as marker_file:
+            return json.load(marker_file)
+
+    file_paths = generate_datasets(output_dir, rows, seed, failure_ratio, pending_ratio, dispute_ratio, file_format)
+
+    # The marker is written last, so an interrupted generation is generated again
+    with open(marker_path, 'w') as marker_file:
+        json.dump(file_paths, marker_file)
+
+    return file_paths
+
+def run_benchmark(file_paths: dict, pipeline_args: List[str], env: Optional[dict] = None) -> dict:
+    """
+    Run the pipeline main() on the datasets in a new process, with the stage cache off and the profiling on.
+
+    :param file_paths: Dictionary of the dataset names to the file paths.
+    :type file_paths: dict
+    :param pipeline_args: Additional arguments of the pipeline, e.g. --chunked.
+    :type pipeline_args: List[str]
+    :param env: Additional environment variables of the run, e.g. the engines.
+    :type env: Optional[dict]
+    :return: Dictionary with the run wall time and the profile report of the stages.
+    :rtype: dict
+    :raises RuntimeError: If the pipeline run fails.
+    """
+
+    profile_path = os.path.join(os.path.dirname(file_paths['orders']), 'profile.json')
+    run_env = {**os.environ, **(env or {}),
+               'ORDERS_FILE_PATH': file_paths['orders'],
+               'TRANSACTIONS_FILE_PATH': file_paths['transactions'],
+               'CHARGEBACKS_FILE_PATH': file_paths['chargebacks'],
+               'PROFILE_OUTPUT': profile_path,
+               'PROFILE_FORMAT': 'json'}
+
+    start_time = time.perf_counter()
+    process = subprocess.run([sys.executable, '-m', 'scripts.pipeline', '--no-cache', '--profile', *pipeline_args],
+                             env=run_env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall_seconds = time.perf_counter() - start_time
+
+    if process.returncode != 0:
+        logger.error(f"The pipeline run failed: {process.stderr[-2000:]}")
+        raise RuntimeError(f"The pipeline run failed with exit code {process.returncode}")
+
+    with open(profile_path) as profile_file:
+        profile = json.load(profile_file)
+
+    return {'wall_seconds': wall_seconds, 'main_seconds': profile['wall_seconds'], 'stages': profile['stages']}
+
+def benchmark_extraction(file_paths: dict, repeat: int = 3,
+                         executors: Tuple[str, ...] = ('serial', 'thread', 'process')) -> pd.DataFrame:
+    """
+    Measure the extraction of the datasets with each extraction executor, in a new process for each run.
+
+    :param file_paths: Dictionary of the dataset names to the file paths.
+    :type file_paths: dict
+    :param repeat: The number of runs of each executor.
+    :type repeat: int
+    :param executors: The extraction executors to measure.
+    :type executors: Tuple[str, ...]
+    :return: DataFrame of the median seconds of each executor and their speedup over the serial extraction.
+    :rtype: pd.DataFrame
+    :raises RuntimeError: If an extraction run fails.
+    """
+
+    code = ("import sys, time; from src.extraction import extract_all; start = time.perf_counter(); "
+            "extract_all(*sys.argv[1:4], executor=sys.argv[4]); print(time.perf_counter() - start)")
+    records = []
+
+    for executor in executors:
+        seconds = []
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-c', code, file_paths['orders'], file_paths['transactions'],
+                                      file_paths['chargebacks'], executor], capture_output=True, text=True)
+
+            if process.returncode != 0:
+                logger.error(f"The extraction run failed: {process.stderr[-2000:]}")
+                raise RuntimeError(f"The extraction run failed with exit code {process.returncode}")
+
+            seconds.append(float(process.stdout.strip().splitlines()[-1]))
+
+        records.append({'executor': executor, 'seconds': pd.Series(seconds).median()})
+
+    records = pd.DataFrame(records)
+    records['speedup'] = records.loc[records['executor'] == 'serial', 'seconds'].iloc[0] / records['seconds']
+
+    return records
+
+def store_result(result: dict, results_file: str = BENCHMARK_RESULTS_FILE) -> None:
+    """
+    Append a benchmark result to the results file, one JSON result per line.
+
+    :param result: The benchmark result.
+    :type result: dict
+    :param results_file: The path of the results file.
+    :type results_file: str
+    :return: None
+    :rtype: None
+    """
+
+    os.makedirs(os.path.dirname(results_file) or '.', exist_ok=True)
+
+    with open(results_file, 'a') as file:
+        file.write(json.dumps(result) + '\n')
+
+def compare_results(results_file: str = BENCHMARK_RESULTS_FILE, rows: Optional[int] = None,
+                    last: int = 5) -> pd.DataFrame:
+    """
+    Compare the median wall time of each stage across the last benchmarked commits.
+
+    :param results_file: The path of the results file.
+    :type results_file: str
+    :param rows: The benchmarked rows to compare, all the sizes if not given.
+    :type rows: Optional[int]
+    :param last: The number of the last benchmarked commits to compare.
+    :type last: int
+    :return: DataFrame of the median seconds of each stage, by the rows, the pipeline variant and the commit.
+    :rtype: pd.DataFrame
+    """
+
+    with open(results_file) as file:
+        results = [json.loads(line) for line in file if line.strip()]
+
+    records = []
+    for result in results:
+        if rows is not None and result['rows'] != rows:
+            continue
+
+        commit = (result['commit'] or 'unknown')[:10] + ('+' if result['dirty'] else '')
+        run = {'rows': result['rows'], 'variant': result['variant'], 'commit': commit, 'run_at': result['run_at']}
+        records.append({**run, 'stage': 'main', 'seconds': result['main_seconds']})
+        records += [{**run, 'stage': f"{stage['stage']}/{stage['function']}", 'seconds': stage['wall_seconds']}
+                    for stage in result['stages']]
+
+    if not records:
+        return pd.DataFrame()
+
+    records = pd.DataFrame(records)
+
+    # The commits in the order they were first benchmarked, the repeats of a commit are reduced to the median
+    commits = records.sort_values('run_at').drop_duplicates('commit')['commit'].tolist()[-last:]
+    records = records[records['commit'].isin(commits)]
+    comparison = records.pivot_table(index=['rows', 'variant', 'stage'], columns='commit', values='seconds',
+                                     aggfunc='median')
+
+    return comparison[[commit for commit in commits if commit in comparison.columns]]
+
+def print_comparison(results_file: str = BENCHMARK_RESULTS_FILE) -> None:
+    """
+    Print the comparison of the stage wall times across the last benchmarked commits.
+
+    :param results_file: The path of the results file.
+    :type results_file: str
+    :return: None
+    :rtype: None
+    """
+
+    comparison = compare_results(results_file).reset_index()
+    print(tabulate(comparison, headers='keys', tablefmt='grid', floatfmt='.3f', showindex=False))
+
+def main(rows: List[int], seed: int = 0, failure_ratio: float = 0.2, pending_ratio: float = 0.05,
+         dispute_ratio: float = 0.02, file_format: str = 'json', repeat: int = 3, chunked: bool = False,
+         results_file: str = BENCHMARK_RESULTS_FILE):
+    logger.info("Starting the pipeline benchmark")
+
+    try:
+        revision = git_revision()
+        variant = ' '.join(filter(None, [file_format, 'chunked' if chunked else 'in-memory',
+                                         os.getenv('VALIDATION_ENGINE'), os.getenv('METRICS_ENGINE'),
+                                         os.getenv('DATAFRAME_BACKEND')]))
+
+        for size in rows:
+            with log_indent():
+                file_paths = benchmark_data(size, seed, failure_ratio, pending_ratio, dispute_ratio, file_format)
+
+            for run_number in range(repeat):
+                logger.info(f"Starting run {run_number + 1} of {repeat} on {size} rows")
+                run = run_benchmark(file_paths, ['--chunked'] if chunked else [])
+
+                store_result({
+                    **revision,
+                    'run_at': time.time(),
+                    'rows': size,
+                    'variant': variant,
+                    'seed': seed,
+                    'failure_ratio': failure_ratio,
+                    'pending_ratio': pending_ratio,
+                    'dispute_ratio': dispute_ratio,
+                    'python': platform.python_version(),
+                    'pandas': pd.__version__,
+                    **run
+                }, results_file)
+                logger.info(f"Finished run {run_number + 1} in {run['main_seconds']:.2f} seconds")
+
+        logger.info(f"Successfully stored the benchmark results to {results_file}")
+
+        print_comparison(results_file)
+
+    except Exception as e:
+        logger.error(f"Error in the pipeline benchmark: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help="The numbers of orders and transactions to benchmark, e.g. 10000 1000000 10000000")
+    parser.add_argument('--seed', type=int, default=0, help="The seed of the generated data")
+    parser.add_argument('--failure-ratio', type=float, default=0.2, help="The ratio of failed transactions")
+    parser.add_argument('--pending-ratio', type=float, default=0.05, help="The ratio of pending transactions")
+    parser.add_argument('--dispute-ratio', type=float, default=0.02, help="The ratio of transactions with a chargeback")
+    parser.add_argument('--format', choices=['json', 'parquet'], default='json', help="The format of the data files")
+    parser.add_argument('--repeat', type=int, default=3, help="The number of runs of each size")
+    parser.add_argument('--chunked', action='store_true', help="Benchmark the chunked pipeline")
+    parser.add_argument('--results-file', default=BENCHMARK_RESULTS_FILE, help="The file the results are appended to")
+    parser.add_argument('--compare', action='store_true', help="Only print the comparison of the stored results")
+    parser.add_argument('--extraction', action='store_true',
+                        help="Only measure the extraction of the datasets with each extraction executor")
+    args = parser.parse_args()
+
+    if args.compare:
+        print_comparison(args.results_file)
+    elif args.extraction:
+        for size in args.rows:
+            size_file_paths = benchmark_data(size, args.seed, args.failure_ratio, args.pending_ratio,
+                                             args.dispute_ratio, args.format)
+            extraction = benchmark_extraction(size_file_paths, args.repeat)
+            print(f"{size} rows, {args.format}")
+            print(tabulate(extraction, headers='keys', tablefmt='grid', floatfmt='.3f', showindex=False))
+    else:
+        main(args.rows, args.seed, args.failure_ratio, args.pending_ratio, args.dispute_ratio, args.format,
+             args.repeat, args.chunked, args.results_file)
@@ -9,4 +9,106 @@ TRANSACTIONS_FILE_PATH = os.getenv('TRANSACTIONS_FILE_PATH', 'data/transactions.
 ORDERS_FILE_PATH = os.getenv('ORDERS_FILE_PATH', 'data/orders.json')
 CHARGEBACKS_FILE_PATH= os.getenv('CHARGEBACKS_FILE_PATH', 'data/chargebacks.csv') 
 
-PRECISION_LIMIT = int(os.getenv('PRECISION_LIMIT', 2))
\ No newline at end of file
+PRECISION_LIMIT = int(os.getenv('PRECISION_LIMIT', 2))
+
+# FX rates - the rate table of the currencies by date, and the currency the amounts of the metrics are reported in
+FX_RATES_FILE_PATH = os.getenv('FX_RATES_FILE_PATH', 'data/fx_rates.csv')
+REPORTING_CURRENCY = os.getenv('REPORTING_CURRENCY', 'USD')
+
+# Validation engine - 'columnar' for vectorized rules, 'pydantic' for the per row reference models
+VALIDATION_ENGINE = os.getenv('VALIDATION_ENGINE', 'columnar')
+
+# Metrics engine - 'fused' for a single aggregation pass, 'reference' for the per metric calculations
+METRICS_ENGINE = os.getenv('METRICS_ENGINE', 'fused')
+
+# DataFrame backend - 'pandas' for the reference stages, 'polars' to normalize, match and aggregate the validated data
+# in a multithreaded lazy query
+DATAFRAME_BACKEND = os.getenv('DATAFRAME_BACKEND', 'pandas')
+
+# Validation mode - 'fail_fast' raises on the first invalid row, 'collect' quarantines the invalid rows
+VALIDATION_MODE = os.getenv('VALIDATION_MODE', 'fail_fast')
+QUARANTINE_DIR = os.getenv('QUARANTINE_DIR', 'quarantine')
+QUARANTINE_FORMAT = os.getenv('QUARANTINE_FORMAT', 'csv')
+MAX_REJECTED_RATIO = float(os.getenv('MAX_REJECTED_RATIO', 0.001))
+
+# Streaming extraction - number of records in each extracted chunk and the size of each file read
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', 100000))
+JSON_READ_SIZE = int(os.getenv('JSON_READ_SIZE', 1 << 20))
+
+# Parallel validation - number of worker processes and minimal number of rows in each partition
+VALIDATION_WORKERS = int(os.getenv('VALIDATION_WORKERS', 1))
+VALIDATION_PARTITION_MIN_ROWS = int(os.getenv('VALIDATION_PARTITION_MIN_ROWS', 50000))
+
+# Extraction - 'serial' to read the data sources one after another, 'thread' or 'process' to read them concurrently,
+# by default the process pool on a machine with more than one CPU
+EXTRACTION_EXECUTOR = os.getenv('EXTRACTION_EXECUTOR', 'process' if (os.cpu_count() or 1) > 1 else 'serial')
+
+# Stage cache - directory of the cached stage outputs and their maximal total size, STAGE_CACHE=0 disables it
+STAGE_CACHE = os.getenv('STAGE_CACHE', '1') == '1'
+STAGE_CACHE_DIR = os.getenv('STAGE_CACHE_DIR', '.cache/stages')
+STAGE_CACHE_MAX_BYTES = int(os.getenv('STAGE_CACHE_MAX_BYTES', 1 << 30))
+# Stage cache format - 'arrow' stores the DataFrame outputs as memory-mapped Arrow IPC files, 'pickle' pickles them
+STAGE_CACHE_FORMAT = os.getenv('STAGE_CACHE_FORMAT', 'arrow')
+
+# Time series metrics - the granularity of the buckets ('hour', 'day' or 'week', the hourly buckets need the reference
+# metrics engine) and the lengths of the rolling windows in days
+TIME_SERIES_GRANULARITY = os.getenv('TIME_SERIES_GRANULARITY', 'day')
+ROLLING_WINDOWS = [int(days) for days in os.getenv('ROLLING_WINDOWS', '7,30').split(',') if days]
+
+# Breakdown metrics - the number of providers and error codes listed in their breakdowns, the minimal number of
+# transactions of a listed one, and the metric they are ranked by
+# ('failed_value', 'failure_rate', 'dispute_rate', 'value' or 'transactions')
+BREAKDOWN_TOP_K = int(os.getenv('BREAKDOWN_TOP_K', 10))
+BREAKDOWN_MIN_TRANSACTIONS = int(os.getenv('BREAKDOWN_MIN_TRANSACTIONS', 20))
+BREAKDOWN_RANK_BY = os.getenv('BREAKDOWN_RANK_BY', 'failed_value')
+
+# Approximate metrics - APPROXIMATE_METRICS=1 adds the metrics of the mergeable sketches of each payment method and day:
+# the HyperLogLog precision (2 ** precision registers), the relative accuracy of the amount quantiles,
+# the width and depth of the count-min sketches, and the number of top providers and error codes
+APPROXIMATE_METRICS = os.getenv('APPROXIMATE_METRICS', '0') == '1'
+SKETCH_HLL_PRECISION = int(os.getenv('SKETCH_HLL_PRECISION', 12))
+SKETCH_QUANTILE_ACCURACY = float(os.getenv('SKETCH_QUANTILE_ACCURACY', 0.01))
+SKETCH_COUNT_MIN_WIDTH = int(os.getenv('SKETCH_COUNT_MIN_WIDTH', 272))
+SKETCH_COUNT_MIN_DEPTH = int(os.getenv('SKETCH_COUNT_MIN_DEPTH', 5))
+SKETCH_TOP_K = int(os.getenv('SKETCH_TOP_K', 3))
+
+# Incremental metrics - directory of the persisted aggregate state the new batches are folded into, and the number of
+# key hash partitions of its ledger, orders and chargebacks tables, of which a batch reads and rewrites the ones it touches
+INCREMENTAL_STATE_DIR = os.getenv('INCREMENTAL_STATE_DIR', 'state')
+INCREMENTAL_STATE_PARTITIONS = int(os.getenv('INCREMENTAL_STATE_PARTITIONS', 64))
+
+# Compact schema - whether the normalize stage converts the columns to categoricals, 128-bit ids and downcast numbers
+COMPACT_SCHEMA = os.getenv('COMPACT_SCHEMA', '1') == '1'
+
+# Timestamp parsing - the format of the source timestamps and the number of parsed values memoized
+TIMESTAMP_FORMAT = os.getenv('TIMESTAMP_FORMAT', '%Y-%m-%d %H:%M:%S')
+DATE_CACHE_SIZE = int(os.getenv('DATE_CACHE_SIZE', 1 << 20))
+
+# Profiling - the report of the stage timings, rows and memory ('json' or 'prometheus'), PROFILE=1 enables it,
+# and the functions wrapped in a 'cprofile' or 'sampling' profiler (comma separated, 'all' for every stage)
+PROFILE = os.getenv('PROFILE', '0') == '1'
+PROFILE_OUTPUT = os.getenv('PROFILE_OUTPUT', 'profile/stages.json')
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'json')
+PROFILER = os.getenv('PROFILER', 'cprofile')
+PROFILE_STAGES = [stage for stage in os.getenv('PROFILE_STAGES', '').split(',') if stage]
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profile')
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+
+# Logging mode - 'sync' writes each record in the logging thread, 'queue' hands the records to a background writer
+# and passes at most LOG_RATE_LIMIT records of each logging call site every LOG_RATE_INTERVAL seconds
+LOG_MODE = os.getenv('LOG_MODE', 'sync')
+LOG_RATE_LIMIT = int(os.getenv('LOG_RATE_LIMIT', 10))
+LOG_RATE_INTERVAL = float(os.getenv('LOG_RATE_INTERVAL', 1.0))
+
+# Metrics output - the directory the metric files are written to ('' to only print the metrics), their format
+# ('parquet', 'jsonl' or 'csv'), and the rows of each table printed to the console (0 for all)
+OUTPUT_DIR = os.getenv('OUTPUT_DIR', '')
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', 'parquet')
+OUTPUT_MAX_ROWS = int(os.getenv('OUTPUT_MAX_ROWS', 50))
+
+# Pipeline service - the address of the metrics endpoint, a Unix socket path to serve on instead of the TCP port,
+# and the seconds between the checks of the data sources for changes
+SERVICE_HOST = os.getenv('SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.getenv('SERVICE_PORT', 8765))
+SERVICE_SOCKET = os.getenv('SERVICE_SOCKET', '')
+SERVICE_POLL_INTERVAL = float(os.getenv('SERVICE_POLL_INTERVAL', 1.0))
@@ -0,0 +1,34 @@
+import argparse
+import os
+
+from utils.logging_config import log_indent, logger
+from config.constants import ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH, CHUNK_SIZE
+
+from src.extraction import convert_to_parquet
+
+def main(output_dir: str = 'data', chunk_size: int = CHUNK_SIZE):
+    logger.info("Starting converting the data sources to Parquet")
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+
+        with log_indent():
+            for dataset, file_path in [('orders', ORDERS_FILE_PATH),
+                                       ('transactions', TRANSACTIONS_FILE_PATH),
+                                       ('chargebacks', CHARGEBACKS_FILE_PATH)]:
+                output_path = os.path.join(output_dir, f"{dataset}.parquet")
+                convert_to_parquet(file_path, output_path, dataset, chunk_size)
+
+        logger.info(f"Finished converting the data sources to {output_dir}")
+
+    except Exception as e:
+        logger.error(f"Error converting the data sources to Parquet: {e}")
+        raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the data sources to Parquet files")
+    parser.add_argument('--output-dir', default='data', help="The directory of the Parquet files")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="The number of records converted at a time")
+    args = parser.parse_args()
+
+    main(output_dir=args.output_dir, chunk_size=args.chunk_size)
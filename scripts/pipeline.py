@@ -1,63 +1,269 @@
-
+import argparse
 import time
+from contextlib import nullcontext
+from functools import lru_cache
+
+import pandas as pd
 
 from utils.logging_config import log_indent, logger
-from config.constants import ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH
+from utils.profiling import profile_session
+from config.constants import (ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH, CHUNK_SIZE,
+                              STAGE_CACHE, INCREMENTAL_STATE_DIR, METRICS_ENGINE, DATAFRAME_BACKEND, PROFILE,
+                              OUTPUT_DIR, OUTPUT_FORMAT, APPROXIMATE_METRICS)
 
 from src.transformation.analysis import calculate_business_metrics
-from src.extraction import extract_transactions, extract_chargebacks, extract_orders
-from src.transformation.clean import clean_orders, clean_transactions, clean_chargebacks
-from src.output import print_analysis
+from src.transformation.aggregates import (aggregate_transactions, calculate_fused_metrics, merge_aggregates,
+                                           metrics_from_aggregates, transaction_entries)
+from src.transformation.breakdowns import aggregate_breakdowns, calculate_breakdown_metrics, merge_breakdowns
+from src.transformation.polars_backend import calculate_polars_metrics
+from src.transformation.sketches import calculate_approximate_metrics, merge_sketches, sketch_transactions
+from src.transformation.timeseries import check_time_series_settings
+from src.cache import cached_stage, source_output
+from src.transformation.join_index import build_key_index
+from src.extraction import (extract_all, extract_orders, extract_transactions, extract_chargebacks,
+                            extract_orders_chunks, extract_transactions_chunks, extract_chargebacks_chunks)
+from src.transformation.incremental import fold_batch, load_state, orders_amount_lookup, save_state
+from src.transformation.clean import clean_orders, clean_transactions, clean_chargebacks, clean_chunks
+from src.output import print_analysis, write_metrics
 from src.transformation.validations.orders import validate_orders
 from src.transformation.validations.transactions import validate_transactions
-from src.transformation.validations.orders import validate_orders
 from src.transformation.validations.chargeback import validate_chargebacks
+from src.transformation.validations.quarantine import quarantine_session
 from src.transformation.normalize import (normalize_orders, normalize_transactions,
                                           normalize_chargebacks, match_dataframes)
 
-def main():
-    logger.info("Starting the data pipeline")
-    start_time = time.time()
+def run_pipeline(use_cache: bool = STAGE_CACHE, extract_together: bool = True) -> dict:
+    """
+    Run the pipeline stages on the whole datasets in memory.
+    The stage outputs are cached by the hash of the input files, the stage code and the configuration,
+    so only the stages whose inputs changed are run again.
 
-    try:
-        # Step 1: Extract Data
+    :param use_cache: Whether to load and store the stage outputs in the stage cache.
+    :type use_cache: bool
+    :param extract_together: Whether the data sources are extracted concurrently once any of them is needed,
+        or each one on its own only when a stage using it is not cached, e.g. when a single source changed.
+    :type extract_together: bool
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    # Step 1: Extract Data, only if a stage using it is not cached
+    def extract():
         logger.info("Starting extraction of the data from the data sources")
         with log_indent():
-            orders = extract_orders(ORDERS_FILE_PATH)
-            transactions = extract_transactions(TRANSACTIONS_FILE_PATH)
-            chargebacks = extract_chargebacks(CHARGEBACKS_FILE_PATH)
+            extracted = extract_all(ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH)
         logger.info("Finished extracting the data")
 
-        # Step 2: Clean Data
-        logger.info("Starting cleaning the data")
+        return extracted
+
+    if extract_together:
+        extracted = lru_cache(maxsize=None)(extract)
+        orders = source_output(ORDERS_FILE_PATH, lambda: extracted()[0])
+        transactions = source_output(TRANSACTIONS_FILE_PATH, lambda: extracted()[1])
+        chargebacks = source_output(CHARGEBACKS_FILE_PATH, lambda: extracted()[2])
+    else:
+        orders = source_output(ORDERS_FILE_PATH, lambda: extract_orders(ORDERS_FILE_PATH))
+        transactions = source_output(TRANSACTIONS_FILE_PATH, lambda: extract_transactions(TRANSACTIONS_FILE_PATH))
+        chargebacks = source_output(CHARGEBACKS_FILE_PATH, lambda: extract_chargebacks(CHARGEBACKS_FILE_PATH))
+
+    # Step 2: Clean Data
+    orders = cached_stage(clean_orders, orders, enabled=use_cache)
+    transactions = cached_stage(clean_transactions, transactions, enabled=use_cache)
+    chargebacks = cached_stage(clean_chargebacks, chargebacks, enabled=use_cache)
+
+    # Step 3: Validate Data, the order_id index of the orders is built once and shared by the following stages
+    orders = cached_stage(validate_orders, orders, enabled=use_cache)
+    orders_index = cached_stage(build_key_index, orders, key='order_id', enabled=False)
+    transactions = cached_stage(validate_transactions, transactions, orders, orders_index=orders_index,
+                                enabled=use_cache)
+    chargebacks = cached_stage(validate_chargebacks, chargebacks, enabled=use_cache)
+
+    # Steps 4 and 5 on the polars backend, the validated data is normalized, matched and aggregated in a lazy query
+    if DATAFRAME_BACKEND == 'polars':
+        logger.info("Starting the clean and validate stages")
+        with log_indent():
+            orders, transactions, chargebacks = orders.value(), transactions.value(), chargebacks.value()
+        logger.info("Finished the clean and validate stages")
+
+        if APPROXIMATE_METRICS:
+            logger.warning("The approximate metrics are not calculated on the polars backend")
+
+        return calculate_polars_metrics(orders, transactions, chargebacks)
+
+    # Step 4: Normalize Data, the normalized orders keep the row positions of the order_id index
+    orders = cached_stage(normalize_orders, orders, enabled=use_cache)
+    transactions = cached_stage(normalize_transactions, transactions, enabled=use_cache)
+    chargebacks = cached_stage(normalize_chargebacks, chargebacks, enabled=use_cache)
+    chargebacks_index = cached_stage(build_key_index, chargebacks, key='transaction_id', enabled=False)
+    merged = cached_stage(match_dataframes, orders, transactions, chargebacks, orders_index=orders_index,
+                          chargebacks_index=chargebacks_index, enabled=use_cache)
+
+    # The stages run on demand, only the ones whose output is not cached
+    logger.info("Starting the clean, validate and normalize stages")
+    with log_indent():
+        merged, transactions, chargebacks = merged.value(), transactions.value(), chargebacks.value()
+        chargebacks_index = chargebacks_index.value()
+    logger.info("Finished the clean, validate and normalize stages")
+
+    # Step 5: Get analysis metrics
+    if METRICS_ENGINE == 'reference':
+        metrics = calculate_business_metrics(merged, transactions, chargebacks, chargebacks_index)
+    else:
+        metrics = calculate_fused_metrics(transactions, chargebacks, chargebacks_index)
+
+    # The provider and error code breakdowns of both engines
+    breakdowns = aggregate_breakdowns(transaction_entries(transactions, chargebacks_index))
+    metrics.update(calculate_breakdown_metrics(breakdowns))
+
+    # The opt-in approximate metrics from the sketches of the transactions
+    if APPROXIMATE_METRICS:
+        sketches = sketch_transactions(transactions, merged['order_customer_id'])
+        metrics['approximate_metrics'] = calculate_approximate_metrics(sketches)
+
+    return metrics
+
+def run_chunked_pipeline(chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Run the pipeline stages on bounded-size chunks of the datasets.
+    The orders and chargebacks are kept only as lookups of the order amounts and the disputed transaction ids,
+    and the transactions are streamed through the stages into mergeable metric and breakdown aggregates,
+    and into mergeable sketches of the approximate metrics when they are enabled.
+
+    :param chunk_size: The number of records in each chunk.
+    :type chunk_size: int
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    with quarantine_session():
+        # Step 1: Build the orders lookup of the total amount, and the customer of the approximate metrics, of each order
+        logger.info("Starting streaming the orders")
         with log_indent():
-            orders = clean_orders(orders)
-            transactions = clean_transactions(transactions)
-            chargebacks = clean_chargebacks(chargebacks)
-        logger.info("Finished cleaning the data")
+            orders_amount, orders_customer = [], []
+            for orders in clean_chunks(extract_orders_chunks(ORDERS_FILE_PATH, chunk_size), clean_orders, 'order_id'):
+                orders = validate_orders(orders).set_index('order_id')
+                orders_amount.append(orders['total_amount'])
+                if APPROXIMATE_METRICS:
+                    orders_customer.append(orders['customer_id'])
+            orders_amount = pd.concat(orders_amount)
+            orders_customer = pd.concat(orders_customer) if APPROXIMATE_METRICS else None
+        logger.info(f"Finished streaming {len(orders_amount)} orders")
 
-        # Step 3: Validate Data
-        logger.info("Starting data validation")
+        # Step 2: Build the chargebacks lookup of the disputed transaction ids
+        logger.info("Starting streaming the chargebacks")
         with log_indent():
-            orders = validate_orders(orders)
-            transactions = validate_transactions(transactions, orders[["order_id", "total_amount"]])
-            chargebacks = validate_chargebacks(chargebacks)
-        logger.info("Finished data validation")
+            chargeback_ids = []
+            for chargebacks in clean_chunks(extract_chargebacks_chunks(CHARGEBACKS_FILE_PATH, chunk_size),
+                                            clean_chargebacks, 'transaction_id'):
+                chargebacks = validate_chargebacks(chargebacks)
+                chargeback_ids.append(chargebacks['transaction_id'])
+            chargeback_ids = pd.Index(pd.concat(chargeback_ids))
+        logger.info(f"Finished streaming {len(chargeback_ids)} chargebacks")
 
-        # Step 4: Normalize Data
-        logger.info("Starting data normalizing")
+        # Step 3: Stream the transactions through the stages into the metric aggregates
+        logger.info("Starting streaming the transactions")
         with log_indent():
-            orders = normalize_orders(orders)
-            transactions = normalize_transactions(transactions)
-            chargebacks = normalize_chargebacks(chargebacks) 
-            merged = match_dataframes(orders, transactions, chargebacks)
-        logger.info("Finished data normalizing")
+            aggregates, breakdowns, sketches = None, None, None
+            for transactions in clean_chunks(extract_transactions_chunks(TRANSACTIONS_FILE_PATH, chunk_size),
+                                             clean_transactions, 'transaction_id'):
+                transactions = validate_transactions(transactions, orders_amount)
+                if transactions.empty:
+                    continue
+
+                transactions = normalize_transactions(transactions, compact=False)
+                chunk_aggregates = aggregate_transactions(transactions, chargeback_ids)
+                aggregates = chunk_aggregates if aggregates is None else merge_aggregates([aggregates, chunk_aggregates])
+
+                chunk_breakdowns = aggregate_breakdowns(transaction_entries(transactions, chargeback_ids))
+                breakdowns = chunk_breakdowns if breakdowns is None else merge_breakdowns([breakdowns, chunk_breakdowns])
+
+                if APPROXIMATE_METRICS:
+                    customer_ids = orders_customer.reindex(transactions['order_id']).reset_index(drop=True)
+                    chunk_sketches = sketch_transactions(transactions.reset_index(drop=True), customer_ids)
+                    sketches = chunk_sketches if sketches is None else merge_sketches([sketches, chunk_sketches])
+        logger.info("Finished streaming the transactions")
+
+        if aggregates is None:
+            logger.error("No valid transactions found")
+            raise ValueError("No valid transactions found")
+
+    # Step 4: Get analysis metrics
+    metrics = metrics_from_aggregates(aggregates)
+    metrics.update(calculate_breakdown_metrics(breakdowns))
+    if APPROXIMATE_METRICS:
+        metrics['approximate_metrics'] = calculate_approximate_metrics(sketches)
+
+    return metrics
+
+def run_incremental_pipeline(state_dir: str = INCREMENTAL_STATE_DIR) -> dict:
+    """
+    Fold the records of the data sources, a batch of new or changed records, into the persisted
+    incremental state and calculate the metrics of the whole history from the state aggregates.
+
+    :param state_dir: The directory of the incremental state.
+    :type state_dir: str
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    # Step 1: Extract the batch
+    logger.info("Starting extraction of the batch from the data sources")
+    with log_indent():
+        orders, transactions, chargebacks = extract_all(ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH,
+                                                        CHARGEBACKS_FILE_PATH)
+    logger.info("Finished extracting the batch")
+
+    # Step 2: Clean, validate and normalize the batch, the transactions are matched to the orders of the whole history.
+    # Only the state partitions of the ids of the batch are loaded
+    logger.info("Starting preparing the batch")
+    with log_indent():
+        orders = validate_orders(clean_orders(orders))
+        transactions = clean_transactions(transactions)
+        chargebacks = clean_chargebacks(chargebacks)
 
-        # Step 5: Get analysis metrics
-        metrics = calculate_business_metrics(merged, transactions, chargebacks)
+        state = load_state(state_dir,
+                           transaction_ids=pd.concat([transactions['transaction_id'], chargebacks['transaction_id']]),
+                           order_ids=pd.concat([orders['order_id'], transactions['order_id']]))
 
-        # Step 6: Output for analysis
+        transactions = validate_transactions(transactions, orders_amount_lookup(state, orders))
+        chargebacks = validate_chargebacks(chargebacks)
+        transactions = normalize_transactions(transactions, compact=False)
+    logger.info("Finished preparing the batch")
+
+    # Step 3: Fold the batch into the state
+    state = fold_batch(state, orders, transactions, chargebacks)
+    save_state(state, state_dir)
+
+    # Step 4: Get analysis metrics
+    metrics = metrics_from_aggregates(state['aggregates'])
+    metrics.update(calculate_breakdown_metrics(state['breakdowns']))
+
+    return metrics
+
+def main(chunked: bool = False, chunk_size: int = CHUNK_SIZE, use_cache: bool = STAGE_CACHE,
+         incremental: bool = False, profile: bool = PROFILE, output_dir: str = OUTPUT_DIR,
+         output_format: str = OUTPUT_FORMAT):
+    logger.info("Starting the data pipeline")
+    start_time = time.time()
+
+    try:
+        # Only the in-memory reference engine calculates the metrics from the transactions instead of the aggregates
+        check_time_series_settings(aggregated=incremental or chunked or METRICS_ENGINE != 'reference'
+                                   or DATAFRAME_BACKEND == 'polars')
+
+        # The profiled stages are recorded and their report written when the run ends
+        with profile_session() if profile else nullcontext():
+            if incremental:
+                metrics = run_incremental_pipeline()
+            elif chunked:
+                metrics = run_chunked_pipeline(chunk_size)
+            else:
+                metrics = run_pipeline(use_cache)
+
+        # Output for analysis, and the metric files for the downstream systems
         print_analysis(metrics)
+        if output_dir:
+            write_metrics(metrics, output_dir, output_format)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
@@ -69,4 +275,20 @@ def main():
         raise
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Run the data pipeline")
+    parser.add_argument('--chunked', action='store_true',
+                        help="Stream the transactions through the stages in bounded-memory chunks")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="The number of records in each chunk")
+    parser.add_argument('--no-cache', action='store_true', help="Run all the stages without the stage cache")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Fold the data sources as a batch of new or changed records into the persisted metrics state")
+    parser.add_argument('--profile', action='store_true',
+                        help="Record the time, memory and rows of each stage to the PROFILE_OUTPUT report")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Write each metric to a file in the directory")
+    parser.add_argument('--output-format', choices=['parquet', 'jsonl', 'csv'], default=OUTPUT_FORMAT,
+                        help="The format of the metric files")
+    args = parser.parse_args()
+
+    main(chunked=args.chunked, chunk_size=args.chunk_size, use_cache=STAGE_CACHE and not args.no_cache,
+         incremental=args.incremental, profile=PROFILE or args.profile, output_dir=args.output_dir,
+         output_format=args.output_format)
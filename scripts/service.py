@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from utils.logging_config import log_indent, logger
+from config.constants import (ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH, STAGE_CACHE,
+                              SERVICE_HOST, SERVICE_PORT, SERVICE_SOCKET, SERVICE_POLL_INTERVAL, METRICS_ENGINE,
+                              DATAFRAME_BACKEND)
+
+from src.cache import warm_session
+from src.transformation.timeseries import check_time_series_settings
+from scripts.pipeline import run_pipeline
+
+# The latest metrics and run status served by the endpoint, replaced as a whole after each run
+service_status = {'metrics': None, 'updated_at': None, 'runs': 0, 'error': None}
+
+def file_signature(file_path: str) -> Optional[Tuple[int, int]]:
+    """
+    Get the modification time and size of a file, to detect changes without reading it.
+
+    :param file_path: The path to the file.
+    :type file_path: str
+    :return: The modification time in nanoseconds and the size, None if the file doesn't exist.
+    :rtype: Optional[Tuple[int, int]]
+    """
+
+    try:
+        stat = os.stat(file_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    except FileNotFoundError:
+        return None
+
+def metrics_to_json(metrics: dict) -> bytes:
+    """
+    Serialize the metrics dictionary, each DataFrame as a list of records.
+
+    :param metrics: Dictionary with key business metrics.
+    :type metrics: dict
+    :return: The JSON encoded metrics.
+    :rtype: bytes
+    """
+
+    serializable = {name: value.to_dict(orient='records') if isinstance(value, pd.DataFrame) else value
+                    for name, value in metrics.items()}
+
+    return json.dumps(serializable, default=str).encode()
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # Serve the latest metrics on /metrics and the run status on /health
+    def do_GET(self):
+        status = service_status
+
+        if self.path == '/metrics' and status['metrics'] is not None:
+            self.send_body(200, status['metrics'])
+        elif self.path == '/metrics':
+            self.send_body(503, json.dumps({'error': status['error'] or "No metrics calculated yet"}).encode())
+        elif self.path == '/health':
+            health = {key: value for key, value in status.items() if key != 'metrics'}
+            self.send_body(200, json.dumps(health).encode())
+        else:
+            self.send_body(404, json.dumps({'error': f"Unknown path {self.path}"}).encode())
+
+    def send_body(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Log the requests at debug level instead of writing them to stderr
+    def log_message(self, format, *args):
+        logger.debug(f"Service request: {format % args}")
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    # HTTP server on a Unix socket, the requests have no client address
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('', 0)
+
+def serve_metrics(host: str = SERVICE_HOST, port: int = SERVICE_PORT,
+                  socket_path: str = SERVICE_SOCKET) -> socketserver.BaseServer:
+    """
+    Start serving the metrics endpoint in a background thread.
+
+    :param host: The host of the TCP endpoint.
+    :type host: str
+    :param port: The port of the TCP endpoint.
+    :type port: int
+    :param socket_path: The path of a Unix socket to serve on instead of the TCP endpoint.
+    :type socket_path: str
+    :return: The started server.
+    :rtype: socketserver.BaseServer
+    """
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, MetricsRequestHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        address = f"http://{host}:{server.server_address[1]}"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving the metrics on {address}/metrics")
+
+    return server
+
+def refresh_metrics(use_cache: bool) -> None:
+    """
+    Run the pipeline, reusing the warm outputs of the stages whose inputs didn't change,
+    and publish the metrics. A failed run keeps the previous metrics published, with the error.
+    After the first run only the changed data sources are extracted.
+
+    :param use_cache: Whether to load and store the stage outputs in the stage cache.
+    :type use_cache: bool
+    :return: None
+    :rtype: None
+    """
+
+    global service_status
+
+    start_time = time.time()
+
+    try:
+        with log_indent():
+            metrics = run_pipeline(use_cache, extract_together=service_status['runs'] == 0)
+
+        service_status = {'metrics': metrics_to_json(metrics), 'updated_at': time.time(),
+                          'runs': service_status['runs'] + 1, 'error': None}
+
+        logger.info(f"Refreshed the metrics in {time.time() - start_time:.2f} seconds")
+
+    except Exception as e:
+        service_status = {**service_status, 'error': str(e)}
+        logger.error(f"Error refreshing the metrics, serving the previous metrics: {e}")
+
+def main(use_cache: bool = STAGE_CACHE, poll_interval: float = SERVICE_POLL_INTERVAL):
+    logger.info("Starting the pipeline service")
+
+    file_paths = [ORDERS_FILE_PATH, TRANSACTIONS_FILE_PATH, CHARGEBACKS_FILE_PATH]
+    check_time_series_settings(aggregated=METRICS_ENGINE != 'reference' or DATAFRAME_BACKEND == 'polars')
+    server = serve_metrics()
+
+    try:
+        with warm_session():
+            last_run_signatures = None
+            previous_signatures = [file_signature(file_path) for file_path in file_paths]
+
+            while True:
+                signatures = [file_signature(file_path) for file_path in file_paths]
+
+                # A changed source is processed once it stopped changing for a poll interval, so a file
+                # in the middle of being written is not read
+                if signatures != last_run_signatures and signatures == previous_signatures:
+                    logger.info("Starting refreshing the metrics of the changed data sources")
+                    refresh_metrics(use_cache)
+                    last_run_signatures = signatures
+
+                previous_signatures = signatures
+                time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        logger.info("Stopping the pipeline service")
+
+    finally:
+        server.shutdown()
+        server.server_close()
+        if SERVICE_SOCKET and os.path.exists(SERVICE_SOCKET):
+            os.remove(SERVICE_SOCKET)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline as a service refreshing the metrics "
+                                                 "when the data sources change")
+    parser.add_argument('--no-cache', action='store_true', help="Keep the stage outputs only in memory")
+    parser.add_argument('--poll-interval', type=float, default=SERVICE_POLL_INTERVAL,
+                        help="The seconds between the checks of the data sources for changes")
+    args = parser.parse_args()
+
+    main(use_cache=STAGE_CACHE and not args.no_cache, poll_interval=args.poll_interval)
@@ -0,0 +1,457 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import re
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+import pandas as pd
+import pyarrow as pa
+from utils.logging_config import logger
+import config.constants
+from config.constants import STAGE_CACHE, STAGE_CACHE_DIR, STAGE_CACHE_MAX_BYTES, STAGE_CACHE_FORMAT
+
+# The packages whose source code is part of the code version of a stage
+PROJECT_PACKAGES = ('src', 'config', 'utils')
+
+# The file extensions of the pickled entries and of the DataFrame entries stored as Arrow IPC files
+ENTRY_EXTENSIONS = ('pkl', 'arrow')
+
+# The schema metadata key of the index and the column kinds of a DataFrame stored as an Arrow IPC file
+FRAME_METADATA_KEY = b'stage_frame'
+
+# The settings that don't change the stage outputs - the cache, profiling, logging, service, output and sketch settings
+UNVERSIONED_CONSTANTS = ('STAGE_CACHE', 'PROFILE', 'LOG_', 'SERVICE_', 'OUTPUT_', 'APPROXIMATE_', 'SKETCH_')
+
+# The latest key and output of each stage slot kept in memory, while a warm session is open
+warm_entries = None
+
+class StageOutput(NamedTuple):
+    # The cache key of the output and a function loading or computing it on the first call
+    key: str
+    value: Callable[[], Any]
+
+@contextmanager
+def warm_session(entries: Optional[dict] = None):
+    """
+    Open a warm session, in which the latest output of each stage is kept in memory and reused by the
+    following runs while its key is unchanged. Passing the entries of a previous session continues it.
+
+    :param entries: The warm entries of a previous session, a new session if not given.
+    :type entries: Optional[dict]
+    """
+
+    global warm_entries
+
+    original_entries = warm_entries
+    warm_entries = {} if entries is None else entries
+
+    try:
+        yield warm_entries
+
+    finally:
+        warm_entries = original_entries
+
+def file_hash(file_path: str) -> str:
+    """
+    Hash the content of a file.
+
+    :param file_path: The path to the file.
+    :type file_path: str
+    :return: The hex digest of the file content.
+    :rtype: str
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(file_path, 'rb') as file:
+        while block := file.read(1 << 20):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def project_modules(module_name: str) -> Tuple[str, ...]:
+    """
+    Get a module and all the project modules it uses, directly or indirectly.
+
+    :param module_name: The name of the module.
+    :type module_name: str
+    :return: The sorted names of the modules.
+    :rtype: Tuple[str, ...]
+    """
+
+    seen_modules = set()
+    pending_modules = [module_name]
+
+    while pending_modules:
+        name = pending_modules.pop()
+        if name in seen_modules:
+            continue
+
+        seen_modules.add(name)
+
+        for value in vars(sys.modules[name]).values():
+            used_module = value if inspect.ismodule(value) else inspect.getmodule(value)
+
+            if used_module is not None and used_module.__name__.split('.')[0] in PROJECT_PACKAGES:
+                pending_modules.append(used_module.__name__)
+
+    return tuple(sorted(seen_modules))
+
+def module_source(module_name: str) -> str:
+    """
+    Get the source code of a module, namespace packages have no source code of their own.
+
+    :param module_name: The name of the module.
+    :type module_name: str
+    :return: The source code, empty for a namespace package.
+    :rtype: str
+    """
+
+    module = sys.modules[module_name]
+
+    return inspect.getsource(module) if getattr(module, '__file__', None) is not None else ''
+
+@lru_cache(maxsize=None)
+def code_version(module_name: str) -> str:
+    """
+    Hash the source code of a module and of all the project modules it uses, directly or indirectly.
+
+    :param module_name: The name of the module.
+    :type module_name: str
+    :return: The hex digest of the source code.
+    :rtype: str
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+
+    for name in project_modules(module_name):
+        digest.update(name.encode())
+        digest.update(module_source(name).encode())
+
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def used_constants(module_name: str) -> Tuple[str, ...]:
+    """
+    Get the constants of config.constants that a module and the project modules it uses refer to,
+    leaving out the settings that don't change the stage outputs.
+
+    :param module_name: The name of the module.
+    :type module_name: str
+    :return: The sorted constant names.
+    :rtype: Tuple[str, ...]
+    """
+
+    # The data source paths are keyed by their content
+    names = {name for name in vars(config.constants) if name.isupper() and not name.endswith('_FILE_PATH')
+             and not name.startswith(UNVERSIONED_CONSTANTS)}
+
+    used = set()
+    for name in project_modules(module_name):
+        used.update(names.intersection(re.findall(r'\b[A-Z][A-Z0-9_]*\b', module_source(name))))
+
+    return tuple(sorted(used))
+
+def constants_version(module_name: str) -> str:
+    """
+    Hash the configuration values of config.constants that the outputs of a stage module depend on,
+    so changing an analysis setting doesn't invalidate the clean, validate and normalize outputs.
+
+    :param module_name: The name of the stage module.
+    :type module_name: str
+    :return: The hex digest of the configuration values.
+    :rtype: str
+    """
+
+    values = [(name, repr(getattr(config.constants, name))) for name in used_constants(module_name)]
+
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).hexdigest()
+
+def stage_key(stage: Callable, input_keys: list, **kwargs) -> str:
+    """
+    Get the cache key of a stage output - the hash of the stage, its code version, its inputs and the configuration.
+
+    :param stage: The stage function.
+    :type stage: Callable
+    :param input_keys: The cache keys of the stage inputs.
+    :type input_keys: list
+    :param kwargs: The keyword arguments of the stage.
+    :return: The cache key.
+    :rtype: str
+    """
+
+    parts = [stage.__module__, stage.__qualname__, code_version(stage.__module__), constants_version(stage.__module__),
+             *input_keys, repr(sorted(kwargs.items()))]
+
+    return hashlib.blake2b('\n'.join(parts).encode(), digest_size=16).hexdigest()
+
+def entry_path(key: str, cache_dir: str = STAGE_CACHE_DIR, extension: str = 'pkl') -> str:
+    """
+    Get the path of the cache entry of a key.
+
+    :param key: The cache key.
+    :type key: str
+    :param cache_dir: The directory of the stage cache.
+    :type cache_dir: str
+    :param extension: The file extension of the entry - 'pkl' or 'arrow'.
+    :type extension: str
+    :return: The path of the cache entry.
+    :rtype: str
+    """
+
+    return os.path.join(cache_dir, f"{key}.{extension}")
+
+def frame_to_arrow(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a DataFrame to an Arrow table, recording how each column is loaded back in the schema metadata.
+
+    :param df: The DataFrame.
+    :type df: pd.DataFrame
+    :return: The Arrow table.
+    :rtype: pa.Table
+    :raises pa.ArrowException: If a column can't be converted, e.g. an object column of mixed types.
+    """
+
+    # Arrow columns are loaded as Arrow backed columns, the pyarrow strings as strings, the object columns
+    # as python objects and the numeric, boolean, datetime and categorical columns as numpy backed columns
+    kinds = {}
+    for column, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.ArrowDtype):
+            kinds[column] = 'arrow'
+        elif dtype == object:
+            kinds[column] = 'object'
+        elif isinstance(dtype, pd.StringDtype) and dtype.storage == 'pyarrow':
+            kinds[column] = 'string'
+        else:
+            kinds[column] = 'pandas'
+
+    if isinstance(df.index, pd.RangeIndex):
+        index = [df.index.start, df.index.stop, df.index.step]
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    else:
+        index = None
+        table = pa.Table.from_pandas(df, preserve_index=False).append_column('__index__', pa.array(df.index))
+
+    metadata = {'columns': list(df.columns), 'kinds': list(kinds.values()), 'index': index}
+
+    return table.replace_schema_metadata({FRAME_METADATA_KEY: json.dumps(metadata).encode()})
+
+def arrow_to_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert an Arrow table stored by frame_to_arrow back to the DataFrame. The Arrow backed and string columns
+    and the numeric columns without missing values are views of the table buffers, the other columns are copied.
+
+    :param table: The Arrow table.
+    :type table: pa.Table
+    :return: The DataFrame.
+    :rtype: pd.DataFrame
+    """
+
+    metadata = json.loads(table.schema.metadata[FRAME_METADATA_KEY])
+    columns = {}
+
+    for position, (column, kind) in enumerate(zip(metadata['columns'], metadata['kinds'])):
+        values = table.column(position)
+        if kind == 'arrow':
+            columns[column] = pd.arrays.ArrowExtensionArray(values)
+        elif kind == 'string':
+            columns[column] = pd.arrays.ArrowStringArray(values)
+        elif kind == 'object' and pa.types.is_nested(values.type):
+            # Nested values, e.g. the order items, are loaded as python lists and dictionaries, not numpy arrays
+            columns[column] = pd.array(values.to_pylist(), dtype=object)
+        else:
+            columns[column] = values.to_pandas().array
+
+    if metadata['index'] is None:
+        index = pd.Index(table.column('__index__').to_numpy())
+    else:
+        index = pd.RangeIndex(*metadata['index'])
+
+    df = pd.DataFrame(columns, index=index, copy=False)
+    df.columns = metadata['columns']
+
+    return df
+
+def load_entry(key: str, cache_dir: str = STAGE_CACHE_DIR) -> Any:
+    """
+    Load a cached stage output, marking it as recently used.
+    A DataFrame stored as an Arrow IPC file is memory-mapped, so concurrent pipeline processes loading it
+    share the same physical pages.
+
+    :param key: The cache key.
+    :type key: str
+    :param cache_dir: The directory of the stage cache.
+    :type cache_dir: str
+    :return: The cached output.
+    :rtype: Any
+    :raises FileNotFoundError: If the key is not cached.
+    """
+
+    file_path = entry_path(key, cache_dir, 'arrow')
+
+    if os.path.exists(file_path):
+        # The loaded columns keep the memory map open for as long as they are referenced
+        value = arrow_to_frame(pa.ipc.open_file(pa.memory_map(file_path, 'r')).read_all())
+    else:
+        file_path = entry_path(key, cache_dir)
+        with open(file_path, 'rb') as file:
+            value = pickle.load(file)
+
+    # The modification time orders the entries for the LRU eviction
+    os.utime(file_path)
+
+    return value
+
+def store_entry(key: str, value: Any, cache_dir: str = STAGE_CACHE_DIR,
+                max_bytes: int = STAGE_CACHE_MAX_BYTES, file_format: str = STAGE_CACHE_FORMAT) -> None:
+    """
+    Store a stage output in the cache and evict the least recently used entries above the size limit.
+
+    :param key: The cache key.
+    :type key: str
+    :param value: The stage output.
+    :type value: Any
+    :param cache_dir: The directory of the stage cache.
+    :type cache_dir: str
+    :param max_bytes: The maximal total size of the cache entries.
+    :type max_bytes: int
+    :param file_format: 'arrow' to store DataFrames as uncompressed Arrow IPC files, 'pickle' to pickle them.
+        Other outputs are always pickled.
+    :type file_format: str
+    :return: None
+    :rtype: None
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    table = None
+    if file_format == 'arrow' and isinstance(value, pd.DataFrame):
+        try:
+            table = frame_to_arrow(value)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logger.warning(f"Pickling the stage output, it can't be stored as an Arrow file: {e}")
+
+    file_path = entry_path(key, cache_dir, 'pkl' if table is None else 'arrow')
+
+    # Written to a temporary file first, so a concurrent run never loads a partial entry
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    if table is None:
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        with pa.OSFile(temporary_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary_path, file_path)
+
+    evict_entries(cache_dir, max_bytes)
+
+def evict_entries(cache_dir: str = STAGE_CACHE_DIR, max_bytes: int = STAGE_CACHE_MAX_BYTES) -> None:
+    """
+    Delete the least recently used cache entries until the total size is within the limit.
+
+    :param cache_dir: The directory of the stage cache.
+    :type cache_dir: str
+    :param max_bytes: The maximal total size of the cache entries.
+    :type max_bytes: int
+    :return: None
+    :rtype: None
+    """
+
+    entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(ENTRY_EXTENSIONS)]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total_bytes = sum(entry.stat().st_size for entry in entries)
+
+    for entry in entries:
+        if total_bytes <= max_bytes:
+            break
+
+        total_bytes -= entry.stat().st_size
+        os.remove(entry.path)
+        logger.info(f"Evicted {entry.name} from the stage cache")
+
+def source_output(file_path: str, extract: Callable[[], Any]) -> StageOutput:
+    """
+    Get the output of a data source, keyed by the hash of its file content.
+
+    :param file_path: The path to the data source file.
+    :type file_path: str
+    :param extract: Function extracting the data source, called only if a stage using it is not cached.
+    :type extract: Callable[[], Any]
+    :return: The keyed data source output.
+    :rtype: StageOutput
+    """
+
+    return StageOutput(file_hash(file_path), lru_cache(maxsize=None)(extract))
+
+def cached_stage(stage: Callable, *inputs: StageOutput, enabled: bool = STAGE_CACHE,
+                 cache_dir: str = STAGE_CACHE_DIR, **kwargs) -> StageOutput:
+    """
+    Get the output of a stage, loaded from the stage cache if it was computed before on the same inputs,
+    code version and configuration. The stage and its inputs are computed only when the output is needed
+    and not cached.
+
+    :param stage: The stage function.
+    :type stage: Callable
+    :param inputs: The outputs the stage is applied on.
+    :type inputs: StageOutput
+    :param enabled: Whether the stage cache is used.
+    :type enabled: bool
+    :param cache_dir: The directory of the stage cache.
+    :type cache_dir: str
+    :param kwargs: The keyword arguments of the stage, either values or outputs of other stages.
+    :return: The keyed stage output.
+    :rtype: StageOutput
+    """
+
+    # Keyword arguments can be outputs of other stages as well
+    output_kwargs = {name: value for name, value in kwargs.items() if isinstance(value, StageOutput)}
+    kwargs = {name: value for name, value in kwargs.items() if name not in output_kwargs}
+
+    input_keys = [stage_input.key for stage_input in inputs]
+    input_keys += [f"{name}={value.key}" for name, value in sorted(output_kwargs.items())]
+    key = stage_key(stage, input_keys, **kwargs)
+
+    # The same stage applied with other arguments (e.g. the index of another key) is another slot
+    slot = f"{stage.__module__}.{stage.__qualname__}{sorted(kwargs.items())!r}"
+
+    def load_or_compute():
+        if enabled:
+            try:
+                value = load_entry(key, cache_dir)
+                logger.info(f"Loaded the {stage.__name__} output from the stage cache")
+
+                return value
+
+            except FileNotFoundError:
+                pass
+
+        value = stage(*[stage_input.value() for stage_input in inputs],
+                      **{name: output.value() for name, output in output_kwargs.items()}, **kwargs)
+
+        if enabled:
+            store_entry(key, value, cache_dir)
+
+        return value
+
+    def compute():
+        if warm_entries is None:
+            return load_or_compute()
+
+        # Within a warm session the output is reused from memory, and replaces the stale output of its slot
+        warm_key, value = warm_entries.get(slot, (None, None))
+        if warm_key == key:
+            logger.info(f"Reused the warm {stage.__name__} output")
+
+            return value
+
+        value = load_or_compute()
+        warm_entries[slot] = (key, value)
+
+        return value
+
+    return StageOutput(key, lru_cache(maxsize=None)(compute))
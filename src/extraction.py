@@ -1,12 +1,211 @@
+import numpy as np
 import pandas as pd
 import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+import pyarrow as pa
+import pyarrow.parquet as pq
 from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import CHUNK_SIZE, JSON_READ_SIZE, EXTRACTION_EXECUTOR
+
+# Arrow schemas of the Parquet versions of the data sources, keeping the nested fields as struct and list columns
+PARQUET_SCHEMAS = {
+    'orders': pa.schema([
+        ('order_id', pa.string()),
+        ('customer_id', pa.string()),
+        ('timestamp', pa.string()),
+        ('total_amount', pa.float64()),
+        ('currency', pa.string()),
+        ('items', pa.list_(pa.struct([('product_id', pa.string()),
+                                      ('quantity', pa.int64()),
+                                      ('unit_price', pa.float64())]))),
+        ('payment_status', pa.string())
+    ]),
+    'transactions': pa.schema([
+        ('transaction_id', pa.string()),
+        ('order_id', pa.string()),
+        ('timestamp', pa.string()),
+        ('amount', pa.float64()),
+        ('currency', pa.string()),
+        ('status', pa.string()),
+        ('payment_method', pa.struct([('type', pa.string()), ('provider', pa.string())])),
+        ('error_code', pa.string())
+    ]),
+    'chargebacks': pa.schema([
+        ('transaction_id', pa.string()),
+        ('dispute_date', pa.string()),
+        ('amount', pa.float64()),
+        ('reason_code', pa.string()),
+        ('status', pa.string()),
+        ('resolution_date', pa.string())
+    ])
+}
+
+class MalformedField:
+    """
+    The value of a struct field that a malformed nested value (e.g. a string, or a dictionary missing the field)
+    doesn't hold. It keeps the original nested value, so the row survives the clean stage and the validations
+    reject it like the model does.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f"MalformedField({self.value!r})"
+
+def struct_fields(dataset: str) -> Dict[str, List[str]]:
+    """
+    Get the nested fields of each struct column of a dataset.
+
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :return: Dictionary of struct column to its field names.
+    :rtype: Dict[str, List[str]]
+    """
+
+    return {field.name: [nested_field.name for nested_field in field.type]
+            for field in PARQUET_SCHEMAS[dataset] if pa.types.is_struct(field.type)}
+
+def flatten_struct_column(df: pd.DataFrame, column: str, fields: List[str]) -> pd.DataFrame:
+    """
+    Expand a column of nested dictionaries to a dotted column per field (e.g. payment_method.type),
+    in place of the nested column. A missing value gets missing fields, the fields a present value doesn't hold
+    (e.g. a string instead of a dictionary) get a MalformedField.
+
+    :param df: The DataFrame with the nested column.
+    :type df: pd.DataFrame
+    :param column: The nested column.
+    :type column: str
+    :param fields: The fields to expand.
+    :type fields: List[str]
+    :return: The DataFrame with the flattened columns.
+    :rtype: pd.DataFrame
+    """
+
+    values = df[column].tolist()
+    records = values if all(type(value) is dict for value in values) else [
+        value if isinstance(value, dict) else {} for value in values]
+
+    expanded = pd.DataFrame.from_records(records, columns=fields, index=df.index)
+    expanded = expanded.astype(object).where(expanded.notna(), None)
+
+    malformed_rows, malformed_fields = np.nonzero(expanded.isna().to_numpy() & df[column].notna().to_numpy()[:, None])
+    for row, field in zip(malformed_rows, malformed_fields):
+        expanded.iat[row, field] = MalformedField(values[row])
+
+    expanded.columns = [f"{column}.{field}" for field in fields]
+
+    position = df.columns.get_loc(column)
+
+    return pd.concat([df.iloc[:, :position], expanded, df.iloc[:, position + 1:]], axis=1)
+
+def flatten_nested_columns(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    """
+    Flatten the struct columns of a dataset that were extracted as nested dictionaries.
+
+    :param df: The extracted DataFrame.
+    :type df: pd.DataFrame
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :return: The DataFrame with the struct columns flattened.
+    :rtype: pd.DataFrame
+    """
+
+    for column, fields in struct_fields(dataset).items():
+        if column in df.columns:
+            df = flatten_struct_column(df, column, fields)
+
+    return df
+
+def extract_parquet(file_path: str) -> pd.DataFrame:
+    """
+    Extract a data source from a Parquet file.
+    Struct columns are flattened to dotted columns (e.g. payment_method.type) and list columns are kept as lists.
+
+    :param file_path: The path to the Parquet file.
+    :type file_path: str
+    :return: A pandas DataFrame containing the extracted data.
+    :rtype: pd.DataFrame
+    """
+
+    return arrow_to_pandas(pq.read_table(file_path).flatten())
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert a flattened Arrow table to a DataFrame, with the list columns as python lists as in the JSON sources.
+
+    :param table: The Arrow table.
+    :type table: pa.Table
+    :return: The converted DataFrame.
+    :rtype: pd.DataFrame
+    """
+
+    list_columns = [field.name for field in table.schema if pa.types.is_list(field.type)]
+    df = table.drop(list_columns).to_pandas()
+
+    # Lists are converted to python lists instead of numpy arrays. Converting the numpy arrays of the column
+    # is a few times faster than to_pylist, and the integers with missing values stay integers
+    for name in list_columns:
+        arrays = table.column(name).to_pandas(integer_object_nulls=True)
+        df.insert(table.column_names.index(name), name,
+                  [array.tolist() if array is not None else None for array in arrays])
+
+    return df
+
+def extract_to_ipc(extract: Callable[[str], pd.DataFrame], file_path: str) -> Union[pa.Buffer, pd.DataFrame]:
+    """
+    Extract a data source in a worker process, as an Arrow IPC stream buffer that is sent back to the parent process
+    as raw bytes instead of a pickled DataFrame of python objects.
+
+    :param extract: The extraction function of the data source.
+    :type extract: Callable[[str], pd.DataFrame]
+    :param file_path: The path to the data source.
+    :type file_path: str
+    :return: The IPC buffer of the extracted data, or the DataFrame itself if its columns have mixed types
+        that have no Arrow type, as invalid rows might.
+    :rtype: Union[pa.Buffer, pd.DataFrame]
+    """
+
+    df = extract(file_path)
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return df
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue()
+
+def read_ipc(extracted: Union[pa.Buffer, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Read the data source extracted by a worker process.
+
+    :param extracted: The IPC buffer or the DataFrame returned by extract_to_ipc.
+    :type extracted: Union[pa.Buffer, pd.DataFrame]
+    :return: The extracted DataFrame.
+    :rtype: pd.DataFrame
+    """
+
+    if isinstance(extracted, pd.DataFrame):
+        return extracted
+
+    return arrow_to_pandas(pa.ipc.open_stream(extracted).read_all())
 
 def extract_transactions(file_path: str) -> pd.DataFrame:
     """
-    Extract the transactions data from a JSON file
+    Extract the transactions data from a JSON or Parquet file,
+    with the payment method flattened to the payment_method.type and payment_method.provider columns.
 
-    :param file_path: The path to the transactions JSON file.
+    :param file_path: The path to the transactions JSON or Parquet file.
     :type file_path: str
     :return: A pandas DataFrame containing the extracted transaction data.
     :rtype: pd.DataFrame
@@ -15,10 +214,13 @@ def extract_transactions(file_path: str) -> pd.DataFrame:
     """
     try:
         logger.info(f"Starting extraction of transactions from {file_path}...")
-        with open(file_path, 'r') as file:
-            transactions_data = json.load(file)
+        if file_path.endswith('.parquet'):
+            transactions_df = extract_parquet(file_path)
+        else:
+            with open(file_path, 'r') as file:
+                transactions_data = json.load(file)
 
-        transactions_df = pd.DataFrame(transactions_data)
+            transactions_df = flatten_nested_columns(pd.DataFrame(transactions_data), 'transactions')
         
         if transactions_df.empty:
             logger.error(f"No data found in {file_path}.")
@@ -33,9 +235,9 @@ def extract_transactions(file_path: str) -> pd.DataFrame:
 
 def extract_chargebacks(file_path: str) -> pd.DataFrame:
     """
-    Extract the chargebacks data from a CSV file
+    Extract the chargebacks data from a CSV or Parquet file
 
-    :param file_path: The path to the chargebacks CSV file.
+    :param file_path: The path to the chargebacks CSV or Parquet file.
     :type file_path: str
     :return: A pandas DataFrame containing the extracted chargeback data.
     :rtype: pd.DataFrame
@@ -44,7 +246,10 @@ def extract_chargebacks(file_path: str) -> pd.DataFrame:
     """
     try:
         logger.info(f"Starting extraction of chargebacks from {file_path}...")
-        chargebacks_df = pd.read_csv(file_path)
+        if file_path.endswith('.parquet'):
+            chargebacks_df = extract_parquet(file_path)
+        else:
+            chargebacks_df = pd.read_csv(file_path)
         
         if chargebacks_df.empty:
             logger.error(f"No data found in {file_path}.")
@@ -59,9 +264,9 @@ def extract_chargebacks(file_path: str) -> pd.DataFrame:
 
 def extract_orders(file_path: str) -> pd.DataFrame:
     """
-    Extract the orders data from a JSON file
+    Extract the orders data from a JSON or Parquet file
 
-    :param file_path: The path to the orders JSON file.
+    :param file_path: The path to the orders JSON or Parquet file.
     :type file_path: str
     :return: A pandas DataFrame containing the extracted order data.
     :rtype: pd.DataFrame
@@ -71,10 +276,13 @@ def extract_orders(file_path: str) -> pd.DataFrame:
     
     try:
         logger.info(f"Starting extraction of orders from {file_path}...")
-        with open(file_path, 'r') as file:
-            orders_data = json.load(file)
+        if file_path.endswith('.parquet'):
+            orders_df = extract_parquet(file_path)
+        else:
+            with open(file_path, 'r') as file:
+                orders_data = json.load(file)
 
-        orders_df = pd.json_normalize(orders_data)
+            orders_df = flatten_nested_columns(pd.DataFrame(orders_data), 'orders')
         
         if orders_df.empty:
             logger.error(f"No data found in {file_path}.")
@@ -86,3 +294,310 @@ def extract_orders(file_path: str) -> pd.DataFrame:
     except Exception as e:
         logger.error(f"Error extracting orders from {file_path}: {e}")
         raise
+
+@profiled('extract')
+def extract_all(orders_file_path: str, transactions_file_path: str, chargebacks_file_path: str,
+                executor: str = EXTRACTION_EXECUTOR) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Extract the orders, transactions and chargebacks data, one after another or concurrently.
+
+    :param orders_file_path: The path to the orders JSON file.
+    :type orders_file_path: str
+    :param transactions_file_path: The path to the transactions JSON file.
+    :type transactions_file_path: str
+    :param chargebacks_file_path: The path to the chargebacks CSV file.
+    :type chargebacks_file_path: str
+    :param executor: 'serial' to read the sources one after another, 'thread' to read them in a thread pool,
+        which only overlaps the Parquet reads that release the GIL, or 'process' to parse them in a process pool
+        that sends them back as Arrow IPC buffers.
+    :type executor: str
+    :return: The orders, transactions and chargebacks DataFrames.
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]
+    :raises ValueError: If the executor is not supported, or the extracted data of a source is None or empty.
+    :raises Exception: If there is an error during data extraction, the error of the first source in the order above.
+    """
+
+    sources = [(extract_orders, orders_file_path),
+               (extract_transactions, transactions_file_path),
+               (extract_chargebacks, chargebacks_file_path)]
+
+    if executor == 'serial':
+        return tuple(extract(file_path) for extract, file_path in sources)
+
+    if executor == 'process':
+        with ProcessPoolExecutor(max_workers=len(sources)) as pool:
+            futures = [pool.submit(extract_to_ipc, extract, file_path) for extract, file_path in sources]
+            wait(futures)
+
+        return tuple(read_ipc(future.result()) for future in futures)
+
+    if executor != 'thread':
+        raise ValueError(f"Unsupported extraction executor: {executor}")
+
+    # The threads run in a copy of the calling context, so they log with its indentation
+    with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        futures = [pool.submit(copy_context().run, extract, file_path) for extract, file_path in sources]
+        wait(futures)
+
+    # Raise the error of the first failing source, as the serial extraction does
+    return tuple(future.result() for future in futures)
+
+def stream_json_array(file_path: str, read_size: int = JSON_READ_SIZE) -> Iterator[Any]:
+    """
+    Incrementally parse a JSON array file, yielding one element at a time without loading the whole file.
+
+    :param file_path: The path to the JSON file.
+    :type file_path: str
+    :param read_size: The number of characters read from the file at a time.
+    :type read_size: int
+    :return: Iterator over the elements of the array.
+    :rtype: Iterator[Any]
+    :raises ValueError: If the file does not contain a JSON array.
+    """
+
+    decoder = json.JSONDecoder()
+
+    with open(file_path, 'r') as file:
+        buffer = ''
+        end_of_file = False
+
+        # Skip the whitespaces before the opening bracket of the array
+        while not buffer.strip() and not end_of_file:
+            more = file.read(read_size)
+            end_of_file = len(more) < read_size
+            buffer = buffer.lstrip() + more
+
+        position = len(buffer) - len(buffer.lstrip())
+
+        if buffer[position:position + 1] != '[':
+            raise ValueError(f"{file_path} does not contain a JSON array")
+
+        position += 1
+
+        while True:
+            # Skip the whitespaces and separators between the elements
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] == ','):
+                position += 1
+
+            if position < len(buffer) and buffer[position] == ']':
+                return
+
+            try:
+                element, element_end = decoder.raw_decode(buffer, position)
+
+                # An element at the end of the buffer might continue in the next read, as might a number cut
+                # before its fraction or exponent (e.g. 3 of 3.5e2)
+                complete = element_end < len(buffer) and not (isinstance(element, (int, float)) and
+                                                              buffer[element_end] in '.eE')
+                if complete or end_of_file:
+                    position = element_end
+                    yield element
+                    continue
+
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+
+            # Drop the consumed elements and read more of the file
+            more = file.read(read_size)
+            end_of_file = len(more) < read_size
+            buffer = buffer[position:] + more
+            position = 0
+
+def extract_json_chunks(file_path: str, dataset: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the records of a JSON array file as fixed-size DataFrame chunks, with the nested fields flattened.
+
+    :param file_path: The path to the JSON file.
+    :type file_path: str
+    :param dataset: The name of the dataset for logging.
+    :type dataset: str
+    :param chunk_size: The number of records in each chunk.
+    :type chunk_size: int
+    :return: Iterator over the DataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    :raises ValueError: If the file does not contain any record.
+    :raises Exception: If there is an error during data extraction.
+    """
+
+    try:
+        logger.info(f"Starting streaming extraction of {dataset} from {file_path}...")
+        records = stream_json_array(file_path)
+        total_records = 0
+        total_chunks = 0
+
+        while True:
+            chunk_records = list(islice(records, chunk_size))
+
+            if not chunk_records:
+                break
+
+            total_records += len(chunk_records)
+            total_chunks += 1
+            yield flatten_nested_columns(pd.DataFrame(chunk_records), dataset)
+
+        if total_records == 0:
+            logger.error(f"No data found in {file_path}.")
+            raise ValueError(f"No data found in {file_path}")
+
+        logger.info(f"Successfully extracted {total_records} {dataset} in {total_chunks} chunks.")
+
+    except Exception as e:
+        logger.error(f"Error extracting {dataset} from {file_path}: {e}")
+        raise
+
+def extract_parquet_chunks(file_path: str, dataset: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the record batches of a Parquet file as DataFrame chunks, with the nested fields flattened.
+
+    :param file_path: The path to the Parquet file.
+    :type file_path: str
+    :param dataset: The name of the dataset for logging.
+    :type dataset: str
+    :param chunk_size: The number of records in each chunk.
+    :type chunk_size: int
+    :return: Iterator over the DataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    :raises ValueError: If the file does not contain any record.
+    :raises Exception: If there is an error during data extraction.
+    """
+
+    try:
+        logger.info(f"Starting streaming extraction of {dataset} from {file_path}...")
+        total_records = 0
+        total_chunks = 0
+
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size):
+            total_records += batch.num_rows
+            total_chunks += 1
+            yield arrow_to_pandas(pa.Table.from_batches([batch]).flatten())
+
+        if total_records == 0:
+            logger.error(f"No data found in {file_path}.")
+            raise ValueError(f"No data found in {file_path}")
+
+        logger.info(f"Successfully extracted {total_records} {dataset} in {total_chunks} chunks.")
+
+    except Exception as e:
+        logger.error(f"Error extracting {dataset} from {file_path}: {e}")
+        raise
+
+def extract_orders_chunks(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the orders data from a JSON or Parquet file as fixed-size DataFrame chunks.
+
+    :param file_path: The path to the orders JSON or Parquet file.
+    :type file_path: str
+    :param chunk_size: The number of orders in each chunk.
+    :type chunk_size: int
+    :return: Iterator over the orders DataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    """
+
+    if file_path.endswith('.parquet'):
+        return extract_parquet_chunks(file_path, 'orders', chunk_size)
+
+    return extract_json_chunks(file_path, 'orders', chunk_size)
+
+def extract_transactions_chunks(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the transactions data from a JSON or Parquet file as fixed-size DataFrame chunks,
+    with the payment method flattened to the payment_method.type and payment_method.provider columns.
+
+    :param file_path: The path to the transactions JSON or Parquet file.
+    :type file_path: str
+    :param chunk_size: The number of transactions in each chunk.
+    :type chunk_size: int
+    :return: Iterator over the transactions DataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    """
+
+    if file_path.endswith('.parquet'):
+        return extract_parquet_chunks(file_path, 'transactions', chunk_size)
+
+    return extract_json_chunks(file_path, 'transactions', chunk_size)
+
+def extract_chargebacks_chunks(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    Stream the chargebacks data from a CSV or Parquet file as fixed-size DataFrame chunks.
+
+    :param file_path: The path to the chargebacks CSV or Parquet file.
+    :type file_path: str
+    :param chunk_size: The number of chargebacks in each chunk.
+    :type chunk_size: int
+    :return: Iterator over the chargebacks DataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    :raises ValueError: If the file does not contain any chargeback.
+    :raises Exception: If there is an error during data extraction.
+    """
+
+    if file_path.endswith('.parquet'):
+        yield from extract_parquet_chunks(file_path, 'chargebacks', chunk_size)
+        return
+
+    try:
+        logger.info(f"Starting streaming extraction of chargebacks from {file_path}...")
+        total_records = 0
+        total_chunks = 0
+
+        with pd.read_csv(file_path, chunksize=chunk_size) as reader:
+            for chunk in reader:
+                total_records += len(chunk)
+                total_chunks += 1
+                yield chunk
+
+        if total_records == 0:
+            logger.error(f"No data found in {file_path}.")
+            raise ValueError(f"No data found in {file_path}")
+
+        logger.info(f"Successfully extracted {total_records} chargebacks in {total_chunks} chunks.")
+
+    except Exception as e:
+        logger.error(f"Error extracting chargebacks from {file_path}: {e}")
+        raise
+
+def convert_to_parquet(file_path: str, output_path: str, dataset: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Convert a JSON or CSV data source to a Parquet file, streaming it in chunks.
+
+    :param file_path: The path to the JSON or CSV file.
+    :type file_path: str
+    :param output_path: The path of the Parquet file to write.
+    :type output_path: str
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :param chunk_size: The number of records converted at a time.
+    :type chunk_size: int
+    :return: The number of converted records.
+    :rtype: int
+    :raises Exception: If there is an error during the conversion.
+    """
+
+    try:
+        logger.info(f"Starting converting {dataset} from {file_path} to {output_path}...")
+        schema = PARQUET_SCHEMAS[dataset]
+        total_records = 0
+
+        with pq.ParquetWriter(output_path, schema) as writer:
+            if file_path.endswith('.csv'):
+                string_columns = {field.name: str for field in schema if pa.types.is_string(field.type)}
+
+                with pd.read_csv(file_path, chunksize=chunk_size, dtype=string_columns) as reader:
+                    for chunk in reader:
+                        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                        total_records += len(chunk)
+
+            else:
+                records = stream_json_array(file_path)
+
+                while chunk_records := list(islice(records, chunk_size)):
+                    writer.write_table(pa.Table.from_pylist(chunk_records, schema=schema))
+                    total_records += len(chunk_records)
+
+        logger.info(f"Successfully converted {total_records} {dataset} to {output_path}.")
+
+        return total_records
+
+    except Exception as e:
+        logger.error(f"Error converting {dataset} from {file_path}: {e}")
+        raise
@@ -1,7 +1,50 @@
+import json
+import os
+import textwrap
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tabulate import tabulate
 from utils.logging_config import logger
+from config.constants import OUTPUT_FORMAT, OUTPUT_MAX_ROWS
 
-def print_analysis(metrics: dict) -> None:
+def wrap_cell(value):
+    """
+    Format a list or dictionary cell as text wrapped to a fixed width for printing, other cells are kept.
+
+    :param value: The cell value.
+    :return: The wrapped text of a list or dictionary, otherwise the value.
+    """
+
+    if isinstance(value, (list, dict)):
+        return "\n".join(textwrap.wrap(str(value), width=40))
+
+    return value
+
+def format_table(df: pd.DataFrame, max_rows: int = OUTPUT_MAX_ROWS) -> str:
+    """
+    Render a metric DataFrame as a grid table for the console, only the first max_rows rows of a large table.
+
+    :param df: The metric DataFrame.
+    :type df: pd.DataFrame
+    :param max_rows: The maximal number of rendered rows, 0 to render all of them.
+    :type max_rows: int
+    :return: The rendered table.
+    :rtype: str
+    """
+
+    shown = df.head(max_rows) if max_rows else df
+    shown = shown.assign(**{column: shown[column].map(wrap_cell)
+                            for column in shown.columns if shown[column].dtype == object})
+
+    table = tabulate(shown, headers='keys', tablefmt='grid', showindex=False)
+
+    if len(shown) < len(df):
+        table += f"\n... {len(df) - len(shown)} more rows"
+
+    return table
+
+def print_analysis(metrics: dict, max_rows: int = OUTPUT_MAX_ROWS) -> None:
     """
     Print the analysis of various transaction metrics.
 
@@ -12,7 +55,13 @@ def print_analysis(metrics: dict) -> None:
         - 'failed_transaction_analysis': DataFrame with failed transaction analysis.
         - 'payment_method_performance': DataFrame with payment method performance.
         - 'payment_success_rate': Float representing the payment success rate.
+        - 'rolling_metrics': DataFrame with the time series metrics and their rolling windows.
+        - 'provider_breakdown': DataFrame with the failure and dispute metrics of the top providers.
+        - 'error_code_breakdown': DataFrame with the failure and dispute metrics of the top error codes.
+        - 'approximate_metrics': Optional DataFrame with the sketch based metrics of each payment method.
     :type metrics: dict
+    :param max_rows: The maximal number of printed rows of each table, 0 to print all of them.
+    :type max_rows: int
     :return: None
     :rtype: None
     """
@@ -21,21 +70,98 @@ def print_analysis(metrics: dict) -> None:
 
     try:
         print("Daily Transaction Metrics:")
-        print(tabulate(metrics['daily_transactions'], headers='keys', tablefmt='grid', showindex=False))
+        print(format_table(metrics['daily_transactions'], max_rows))
 
         print("\nChargeback Rate by Payment Method:")
-        print(tabulate(metrics['chargeback_rate'], headers='keys', tablefmt='grid', showindex=False))
+        print(format_table(metrics['chargeback_rate'], max_rows))
 
         print("\nFailed Transaction Analysis:")
-        print(tabulate(metrics['failed_transaction_analysis'], headers='keys', tablefmt='grid', showindex=False))
+        print(format_table(metrics['failed_transaction_analysis'], max_rows))
 
         print("\nPayment method performance:")
-        print(tabulate(metrics['payment_method_performance'], headers='keys', tablefmt='grid', showindex=False))
+        print(format_table(metrics['payment_method_performance'], max_rows))
 
         print(f"\nPayment Success Rate: {metrics['payment_success_rate']}")
 
+        print("\nRolling Metrics:")
+        print(format_table(metrics['rolling_metrics'], max_rows))
+
+        print("\nProvider Breakdown:")
+        print(format_table(metrics['provider_breakdown'], max_rows))
+
+        print("\nError Code Breakdown:")
+        print(format_table(metrics['error_code_breakdown'], max_rows))
+
+        if 'approximate_metrics' in metrics:
+            print("\nApproximate Metrics:")
+            print(format_table(metrics['approximate_metrics'], max_rows))
+
         logger.info(f"Successfully printed the pipeline analysis")
 
     except Exception as e:
         logger.error(f"Error printing the pipeline analysis: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def write_frame(df: pd.DataFrame, file_path: str, file_format: str = OUTPUT_FORMAT) -> None:
+    """
+    Write a metric DataFrame to a Parquet, JSON Lines or CSV file, replacing the previous file atomically.
+    The list and dictionary cells are nested columns in Parquet and JSON Lines, and JSON text in CSV.
+
+    :param df: The metric DataFrame.
+    :type df: pd.DataFrame
+    :param file_path: The path of the file.
+    :type file_path: str
+    :param file_format: 'parquet', 'jsonl' or 'csv'.
+    :type file_format: str
+    :return: None
+    :rtype: None
+    :raises ValueError: If the format is not supported.
+    """
+
+    tmp_path = f"{file_path}.tmp"
+
+    if file_format == 'parquet':
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    elif file_format == 'jsonl':
+        df.to_json(tmp_path, orient='records', lines=True, date_format='iso')
+    elif file_format == 'csv':
+        nested = {column: df[column].map(lambda value: json.dumps(value) if isinstance(value, (list, dict)) else value)
+                  for column in df.columns if df[column].dtype == object}
+        df.assign(**nested).to_csv(tmp_path, index=False)
+    else:
+        raise ValueError(f"Unsupported output format: {file_format}")
+
+    os.replace(tmp_path, file_path)
+
+def write_metrics(metrics: dict, output_dir: str, file_format: str = OUTPUT_FORMAT) -> None:
+    """
+    Write each metric DataFrame to its own file in the output directory, and the scalar metrics
+    together as the single row of the summary file.
+
+    :param metrics: Dictionary with key business metrics.
+    :type metrics: dict
+    :param output_dir: The directory of the metric files.
+    :type output_dir: str
+    :param file_format: 'parquet', 'jsonl' or 'csv'.
+    :type file_format: str
+    :return: None
+    :rtype: None
+    """
+
+    logger.info(f"Starting writing the metrics to {output_dir}")
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+
+        frames = {name: value for name, value in metrics.items() if isinstance(value, pd.DataFrame)}
+        frames['summary'] = pd.DataFrame([{name: value for name, value in metrics.items()
+                                           if not isinstance(value, pd.DataFrame)}])
+
+        for name, frame in frames.items():
+            write_frame(frame, os.path.join(output_dir, f"{name}.{file_format}"), file_format)
+
+        logger.info(f"Successfully wrote {len(frames)} metric files to {output_dir}")
+
+    except Exception as e:
+        logger.error(f"Error writing the metrics: {e}")
+        raise
@@ -0,0 +1,225 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, Optional, Union
+from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import PRECISION_LIMIT, TIME_SERIES_GRANULARITY
+from src.transformation.join_index import KeyIndex, build_key_index, contains_keys
+from src.transformation.timeseries import AMOUNT_SCALE, calculate_time_series
+from src.transformation.fx import FxRates, convert_amounts, load_fx_rates
+from src.transformation.analysis import (add_chargeback_rate, add_performance_rates, format_success_rate,
+                                         summarize_failed_transactions)
+
+AGGREGATE_KEYS = ['day', 'payment_method.type', 'currency', 'status', 'disputed']
+AGGREGATE_VALUES = ['count', 'amount']
+
+def transaction_entries(transactions: pd.DataFrame, chargeback_ids: Union[pd.Index, KeyIndex]) -> pd.DataFrame:
+    """
+    Get the aggregate keys and values of each normalized transaction, with its provider and error code.
+
+    :param transactions: The DataFrame containing normalized transaction data.
+    :type transactions: pd.DataFrame
+    :param chargeback_ids: The transaction ids of the chargebacks, or the transaction_id index of the chargebacks.
+    :type chargeback_ids: Union[pd.Index, KeyIndex]
+    :return: DataFrame with the transaction id, the aggregate keys, the count, the amount,
+        the provider and the error code of each transaction.
+    :rtype: pd.DataFrame
+    """
+
+    if isinstance(chargeback_ids, KeyIndex):
+        disputed = contains_keys(chargeback_ids, transactions['transaction_id'])
+    else:
+        disputed = transactions['transaction_id'].isin(chargeback_ids).to_numpy()
+
+    entries = pd.DataFrame({
+        'transaction_id': transactions['transaction_id'].to_numpy(),
+        'day': transactions['timestamp'].dt.floor('D').to_numpy(),
+        'payment_method.type': transactions['payment_method.type'].to_numpy(),
+        'currency': transactions['currency'].to_numpy(),
+        'status': transactions['status'].to_numpy(),
+        'disputed': disputed
+    })
+    entries['count'] = 1
+    entries['amount'] = np.round(transactions['amount'].to_numpy() * AMOUNT_SCALE).astype(np.int64)
+    entries['payment_method.provider'] = transactions['payment_method.provider'].to_numpy(dtype=object)
+    entries['error_code'] = transactions['error_code'].to_numpy(dtype=object, na_value=None)
+
+    return entries
+
+def aggregate_entries(entries: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate transaction entries to the counts and amounts of each key combination.
+
+    :param entries: DataFrame with the aggregate keys and values of each transaction.
+    :type entries: pd.DataFrame
+    :return: DataFrame with the count and amount of each key combination.
+    :rtype: pd.DataFrame
+    """
+
+    return entries.groupby(AGGREGATE_KEYS, dropna=False, sort=False)[AGGREGATE_VALUES].sum().reset_index()
+
+@profiled('analysis')
+def aggregate_transactions(transactions: pd.DataFrame, chargeback_ids: Union[pd.Index, KeyIndex]) -> pd.DataFrame:
+    """
+    Aggregate normalized transactions to mergeable partial counts and amounts
+    by day, payment method type, currency, status and dispute indication.
+    The key columns are factorized to integer codes and all the groups are summed in a single bincount pass.
+
+    :param transactions: The DataFrame containing normalized transaction data.
+    :type transactions: pd.DataFrame
+    :param chargeback_ids: The transaction ids of the chargebacks, or the transaction_id index of the chargebacks.
+    :type chargeback_ids: Union[pd.Index, KeyIndex]
+    :return: DataFrame with the count and amount of each key combination.
+    :rtype: pd.DataFrame
+    """
+
+    entries = transaction_entries(transactions, chargeback_ids)
+
+    # Combine the codes of the key columns to a single code, missing values get their own code
+    combined_codes = np.zeros(len(entries), dtype=np.int64)
+    for key in AGGREGATE_KEYS:
+        codes, uniques = pd.factorize(entries[key], use_na_sentinel=True)
+        combined_codes = combined_codes * (len(uniques) + 1) + (codes + 1)
+
+    group_ids, groups = pd.factorize(combined_codes)
+
+    # The amounts are whole minor units, summed exactly as floats up to 2 ** 53
+    counts = np.bincount(group_ids, minlength=len(groups))
+    amounts = np.bincount(group_ids, weights=entries['amount'].to_numpy(), minlength=len(groups))
+
+    # The keys of each group are taken from its first transaction
+    first_rows = np.empty(len(groups), dtype=np.int64)
+    first_rows[group_ids[::-1]] = np.arange(len(entries) - 1, -1, -1)
+
+    aggregates = entries[AGGREGATE_KEYS].iloc[first_rows].reset_index(drop=True)
+    aggregates['count'] = counts.astype(np.int64)
+    aggregates['amount'] = np.round(amounts).astype(np.int64)
+
+    return aggregates
+
+@profiled('analysis')
+def calculate_fused_metrics(transactions: pd.DataFrame, chargebacks: pd.DataFrame,
+                            chargebacks_index: Optional[KeyIndex] = None) -> dict:
+    """
+    Calculate the key business metrics of calculate_business_metrics from a single aggregation pass
+    over the transactions, in the same shape.
+
+    :param transactions: The DataFrame containing normalized transaction data.
+    :type transactions: pd.DataFrame
+    :param chargebacks: The DataFrame containing chargeback data.
+    :type chargebacks: pd.DataFrame
+    :param chargebacks_index: The transaction_id index of the chargebacks, built if not given.
+    :type chargebacks_index: Optional[KeyIndex]
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    if chargebacks_index is None:
+        chargebacks_index = build_key_index(chargebacks, 'transaction_id')
+
+    return metrics_from_aggregates(aggregate_transactions(transactions, chargebacks_index))
+
+@profiled('analysis')
+def merge_aggregates(aggregates: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merge partial aggregates to a single aggregate.
+
+    :param aggregates: The partial aggregates to merge, retracted transactions have negative counts and amounts.
+    :type aggregates: Iterable[pd.DataFrame]
+    :return: The merged aggregate.
+    :rtype: pd.DataFrame
+    """
+
+    aggregates = aggregate_entries(pd.concat(aggregates, ignore_index=True))
+
+    # Key combinations whose transactions were all retracted are dropped
+    return aggregates[aggregates['count'] != 0].reset_index(drop=True)
+
+@profiled('analysis')
+def metrics_from_aggregates(aggregates: pd.DataFrame, fx_rates: Optional[FxRates] = None) -> dict:
+    """
+    Calculate the key business metrics from the transactions aggregate,
+    in the same shape calculate_business_metrics returns.
+
+    :param aggregates: The transactions aggregate.
+    :type aggregates: pd.DataFrame
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    logger.info("Starting calculating the business metrics from the aggregates")
+
+    try:
+        # The aggregates are daily, the hourly time series needs the transactions
+        if TIME_SERIES_GRANULARITY == 'hour':
+            raise ValueError("The hourly time series needs the reference metrics engine")
+
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
+        # The amounts of each day and currency are converted to the reporting currency together
+        aggregates = aggregates.assign(
+            completed=aggregates['count'].where(aggregates['status'] == 'completed', 0),
+            failed=aggregates['count'].where(aggregates['status'] == 'failed', 0),
+            disputed_count=aggregates['count'].where(aggregates['disputed'], 0),
+            reporting_amount=convert_amounts(fx_rates, aggregates['day'], aggregates['currency'],
+                                             aggregates['amount'].to_numpy())
+        )
+
+        # Daily metrics of the completed transactions
+        completed = aggregates[aggregates['status'] == 'completed']
+        daily_transactions = completed.groupby('day').agg(volume=('count', 'sum'), value=('reporting_amount', 'sum'))
+        daily_transactions = pd.DataFrame({
+            'day': daily_transactions.index.strftime('%d-%m-%Y'),
+            'volume': daily_transactions['volume'].to_numpy(),
+            'value': (daily_transactions['value'] / AMOUNT_SCALE).round(PRECISION_LIMIT).to_numpy()
+        })
+
+        payment_methods = aggregates.groupby('payment_method.type')
+
+        # Chargeback rates by payment method type
+        chargeback_stats = payment_methods.agg(total_transactions=('count', 'sum'),
+                                               total_chargebacks=('disputed_count', 'sum')).reset_index()
+        chargeback_stats = add_chargeback_rate(
+            chargeback_stats.rename(columns={'payment_method.type': 'transaction_payment_method.type'}))
+
+        # Failed transactions by payment method type and currency
+        failed = aggregates[aggregates['status'] == 'failed']
+        failed_transactions_grouped = failed.groupby(['payment_method.type', 'currency']).agg(
+            transaction_count=('count', 'sum'), amount=('amount', 'sum'),
+            reporting_amount=('reporting_amount', 'sum')).reset_index()
+        failed_transactions_grouped['value'] = failed_transactions_grouped.pop('amount') / AMOUNT_SCALE
+        failed_transactions_grouped['reporting_value'] = failed_transactions_grouped.pop('reporting_amount') / AMOUNT_SCALE
+
+        # Performance by payment method type
+        performance = payment_methods.agg(
+            total_transactions=('count', 'sum'),
+            completed_transactions=('completed', 'sum'),
+            failed_transactions=('failed', 'sum'),
+            disputed_transactions=('disputed_count', 'sum'),
+            total_amount=('reporting_amount', 'sum')
+        )
+        performance['total_amount'] = performance['total_amount'] / AMOUNT_SCALE
+        performance['average_amount'] = performance['total_amount'] / performance['total_transactions']
+
+        metrics = {
+            "daily_transactions": daily_transactions,
+            "chargeback_rate": chargeback_stats,
+            "failed_transaction_analysis": summarize_failed_transactions(failed_transactions_grouped),
+            "payment_method_performance": add_performance_rates(performance).reset_index(),
+            "payment_success_rate": format_success_rate(int(aggregates['completed'].sum()),
+                                                        int(aggregates['count'].sum())),
+            "rolling_metrics": calculate_time_series(aggregates['day'], aggregates['status'],
+                                                     aggregates['disputed'].to_numpy(), aggregates['count'].to_numpy(),
+                                                     aggregates['reporting_amount'].to_numpy())
+        }
+
+        logger.info("Successfully calculated the business metrics from the aggregates")
+
+        return metrics
+
+    except Exception as e:
+        logger.error(f"Error calculating the business metrics from the aggregates: {e}")
+        raise
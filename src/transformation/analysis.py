@@ -1,10 +1,98 @@
+import numpy as np
 import pandas as pd
-import textwrap
 from utils.logging_config import log_indent, logger
+from utils.profiling import profiled
 from config.constants import PRECISION_LIMIT
+from typing import Optional
+from src.transformation.join_index import KeyIndex, build_key_index, contains_keys
+from src.transformation.timeseries import AMOUNT_SCALE, bucket_keys, bucket_starts, calculate_time_series
+from src.transformation.fx import FxRates, convert_amounts, load_fx_rates
 
 precision_limit = PRECISION_LIMIT
 
+def format_success_rate(success_count: int, total_count: int) -> str:
+    """
+    Format the payment success rate of the completed transactions out of all the transactions.
+
+    :param success_count: The number of completed transactions.
+    :type success_count: int
+    :param total_count: The total number of transactions.
+    :type total_count: int
+    :return: The payment success rate as a percentage string.
+    :rtype: str
+    """
+
+    success_rate = (success_count * 100 / total_count) if total_count > 0 else 0.0
+
+    return f"{success_rate:.2f}%"
+
+def add_chargeback_rate(chargeback_stats: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the chargeback rate column to the chargeback counts of each payment method type.
+
+    :param chargeback_stats: DataFrame with the total_transactions and total_chargebacks columns.
+    :type chargeback_stats: pd.DataFrame
+    :return: The DataFrame with the chargeback_rate column.
+    :rtype: pd.DataFrame
+    """
+
+    chargeback_stats["chargeback_rate"] = ((
+        chargeback_stats["total_chargebacks"] / chargeback_stats["total_transactions"]
+    ) * 100).round(precision_limit)
+
+    return chargeback_stats
+
+def summarize_failed_transactions(failed_transactions_grouped: pd.DataFrame) -> pd.DataFrame:
+    """
+    Summarize the failed transactions of each payment method type and currency to a row per payment method type.
+
+    :param failed_transactions_grouped: DataFrame with the payment_method.type, currency, transaction_count, value
+        and reporting_value columns, the value in the currency and the reporting_value in the reporting currency.
+    :type failed_transactions_grouped: pd.DataFrame
+    :return: DataFrame with the failed transaction analysis, the amounts as a list of the value of each currency.
+    :rtype: pd.DataFrame
+    """
+
+    grouped = failed_transactions_grouped.groupby('payment_method.type', observed=True)
+
+    # Sum the failed transaction counts and the values in the reporting currency for each payment method type
+    final_result = grouped.agg(failed_transaction_count=('transaction_count', 'sum'),
+                               failed_value=('reporting_value', 'sum')).reset_index()
+    final_result['failed_value'] = final_result['failed_value'].round(precision_limit)
+
+    # Create an amounts column for each payment method type that contains all currency amounts separated.
+    # The rows are ordered by their group and the records of each group are slices of a single list
+    group_codes = grouped.ngroup().to_numpy()
+    in_group = group_codes >= 0
+    order = np.argsort(group_codes[in_group], kind='stable')
+    values = failed_transactions_grouped['value'].round(precision_limit).to_numpy()[in_group][order]
+    currencies = failed_transactions_grouped['currency'].to_numpy()[in_group][order]
+
+    records = [{'value': value, 'currency': currency} for value, currency in zip(values.tolist(), currencies.tolist())]
+    group_ends = np.cumsum(np.bincount(group_codes[in_group], minlength=len(final_result))).tolist()
+    final_result.insert(1, 'amounts', [records[start:end] for start, end in zip([0] + group_ends[:-1], group_ends)])
+
+    return final_result
+
+def add_performance_rates(performance: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the success, failure and dispute rates to the performance counts of each payment method type,
+    and round the amounts in the reporting currency.
+
+    :param performance: DataFrame with the total, completed, failed and disputed transaction counts and the amounts.
+    :type performance: pd.DataFrame
+    :return: The DataFrame with the rate columns.
+    :rtype: pd.DataFrame
+    """
+
+    performance['success_rate'] = (performance['completed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
+    performance['failure_rate'] = (performance['failed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
+    performance['dispute_rate'] = (performance['disputed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
+    performance[['total_amount', 'average_amount']] = performance[['total_amount', 'average_amount']].round(precision_limit)
+
+    return performance
+
+@profiled('analysis')
 def calculate_payment_success_rate(transactions: pd.DataFrame) -> float:
     """
     Calculate the payment success rate by dividing the number of completed transactions
@@ -22,22 +110,23 @@ def calculate_payment_success_rate(transactions: pd.DataFrame) -> float:
         success_count = len(transactions[transactions['status'] == 'completed'])
         total_count = len(transactions)
 
-        success_rate = (success_count * 100 / total_count) if total_count > 0 else 0.0
-        
         logger.info(f"Successfully calculated payment success rate")
 
-        return f"{success_rate:.2f}%"
+        return format_success_rate(success_count, total_count)
     
     except Exception as e:
         logger.error(f"Error calculating the payment success rate: {e}")
         raise
 
-def calculate_daily_metrics(transactions: pd.DataFrame) -> pd.DataFrame:
+@profiled('analysis')
+def calculate_daily_metrics(transactions: pd.DataFrame, fx_rates: Optional[FxRates] = None) -> pd.DataFrame:
     """
-    Calculate daily metrics including transaction volume and value.
+    Calculate daily metrics including transaction volume and value in the reporting currency.
 
     :param transactions: The DataFrame containing transaction data.
     :type transactions: pd.DataFrame
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
     :return: DataFrame with daily metrics.
     :rtype: pd.DataFrame
     """
@@ -45,17 +134,25 @@ def calculate_daily_metrics(transactions: pd.DataFrame) -> pd.DataFrame:
     logger.info(f"Starting calculating the daily metrics")
 
     try:
-        completed_transactions = transactions[transactions["status"] == "completed"]
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
+        completed_transactions = transactions[(transactions["status"] == "completed") & transactions['timestamp'].notna()]
+        completed_transactions = completed_transactions.assign(amount=convert_amounts(
+            fx_rates, completed_transactions['timestamp'], completed_transactions['currency'],
+            completed_transactions['amount'].to_numpy()))
 
-        daily_transactions = completed_transactions.groupby(completed_transactions['timestamp'].dt.strftime('%d-%m-%Y')).agg(
+        # Group on the integer day keys, in chronological order, and format only the day of each group
+        daily_transactions = completed_transactions.groupby(bucket_keys(completed_transactions['timestamp'], 'day')).agg(
             transaction_volume=("transaction_id", "count"),  
             transaction_value=("amount", "sum")
-        ).reset_index()
+        )
 
-        daily_transactions = daily_transactions.rename(columns={'timestamp': 'day', 
-                                                                'transaction_volume': 'volume',
-                                                                'transaction_value': 'value'})
-        daily_transactions = daily_transactions.sort_values(by='day')
+        daily_transactions = pd.DataFrame({
+            'day': bucket_starts(daily_transactions.index.to_numpy(), 'day').strftime('%d-%m-%Y'),
+            'volume': daily_transactions['transaction_volume'].to_numpy(),
+            'value': daily_transactions['transaction_value'].round(precision_limit).to_numpy()
+        })
 
         logger.info(f"Successfully calculated the daily metrics")
 
@@ -65,6 +162,7 @@ def calculate_daily_metrics(transactions: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error calculating the daily metrics: {e}")
         raise
 
+@profiled('analysis')
 def calculate_chargeback_rates(merged: pd.DataFrame) -> pd.DataFrame:
     """
     Calculate chargeback rates by payment method types.
@@ -82,15 +180,12 @@ def calculate_chargeback_rates(merged: pd.DataFrame) -> pd.DataFrame:
         merged["is_chargeback"] = merged["chargeback_dispute_date"].notnull()
 
         # Group by payment method and calculate metrics
-        chargeback_stats = merged.groupby("transaction_payment_method.type").agg(
+        chargeback_stats = merged.groupby("transaction_payment_method.type", observed=True).agg(
             total_transactions=("transaction_transaction_id", "count"),
             total_chargebacks=("is_chargeback", "sum")
         ).reset_index()
 
-        # Add chargeback rate column
-        chargeback_stats["chargeback_rate"] = ((
-            chargeback_stats["total_chargebacks"] / chargeback_stats["total_transactions"]
-        ) * 100).round(precision_limit)
+        chargeback_stats = add_chargeback_rate(chargeback_stats)
     
         logger.info(f"Successfully calculated the chargeback rates")
 
@@ -100,12 +195,15 @@ def calculate_chargeback_rates(merged: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error calculating the chargeback rates: {e}")
         raise
 
-def analyze_failed_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+@profiled('analysis')
+def analyze_failed_transactions(transactions: pd.DataFrame, fx_rates: Optional[FxRates] = None) -> pd.DataFrame:
     """
     Analyze failed transactions and return relevant metrics.
 
     :param transactions: The DataFrame containing transaction data.
     :type transactions: pd.DataFrame
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
     :return: DataFrame with failed transaction analysis.
     :rtype: pd.DataFrame
     """
@@ -113,29 +211,21 @@ def analyze_failed_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
     logger.info(f"Starting analyzing the failed transactions")
 
     try:
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
         failed_transactions = transactions[transactions['status'] == 'failed']
+        failed_transactions = failed_transactions.assign(reporting_amount=convert_amounts(
+            fx_rates, failed_transactions['timestamp'], failed_transactions['currency'],
+            failed_transactions['amount'].to_numpy()))
 
         # Group by payment method and currency and calculate the count of failed transactions and sum of amounts
-        failed_transactions_grouped = failed_transactions.groupby(['payment_method.type', 'currency']).agg(
+        failed_transactions_grouped = failed_transactions.groupby(['payment_method.type', 'currency'], observed=True).agg(
                                     transaction_count=('transaction_id', 'count'),
-                                    value=('amount', 'sum')).reset_index()
+                                    value=('amount', 'sum'),
+                                    reporting_value=('reporting_amount', 'sum')).reset_index()
                                 
-        failed_transactions_grouped['value'] = failed_transactions_grouped['value'].round(precision_limit)
-        
-        # Create an amounts column for each payment method type that contains all currency amounts separated
-        failed_currency_amounts = failed_transactions_grouped.groupby(['payment_method.type']).apply(
-            lambda group:  group[['value', 'currency']].to_dict(orient='records')).reset_index(name='amounts')
-
-        # Sum the failed transaction counts for each payment method type
-        failed_transactions_counts = failed_transactions_grouped.groupby('payment_method.type').agg(
-                                    transaction_count=('transaction_count', 'sum')).reset_index()
-
-        final_result = pd.merge(failed_currency_amounts, failed_transactions_counts, on='payment_method.type', how="left")
-        final_result.rename(columns={'transaction_count': 'failed_transaction_count'}, inplace=True)
-
-        # Format the amounts column as a string and wrap text to a fixed width for printing
-        final_result['amounts'] = final_result['amounts'].apply(lambda x: str(x))
-        final_result['amounts'] = final_result['amounts'].apply(lambda x: "\n".join(textwrap.wrap(x, width=40)))
+        final_result = summarize_failed_transactions(failed_transactions_grouped)
 
         # final_result = failed_transactions.groupby('payment_method.type').agg(
         #     failed_transaction_count=('transaction_id', 'count'),
@@ -150,7 +240,10 @@ def analyze_failed_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error analyzing the failed transactions: {e}")
         raise
 
-def calculate_payment_method_performance(transactions: pd.DataFrame, chargebacks: pd.DataFrame) -> pd.DataFrame:
+@profiled('analysis')
+def calculate_payment_method_performance(transactions: pd.DataFrame, chargebacks: pd.DataFrame,
+                                         chargebacks_index: Optional[KeyIndex] = None,
+                                         fx_rates: Optional[FxRates] = None) -> pd.DataFrame:
     """
     Calculate performance metrics for each payment method.
 
@@ -158,34 +251,47 @@ def calculate_payment_method_performance(transactions: pd.DataFrame, chargebacks
     :type transactions: pd.DataFrame
     :param chargebacks: The DataFrame containing chargeback data.
     :type chargebacks: pd.DataFrame
-    :return: DataFrame with payment method performance metrics.
+    :param chargebacks_index: The transaction_id index of the chargebacks, built if not given.
+    :type chargebacks_index: Optional[KeyIndex]
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
+    :return: DataFrame with payment method performance metrics, the amounts in the reporting currency.
     :rtype: pd.DataFrame
     """
 
     logger.info(f"Starting calculating the payment method performance")
 
     try:
-        # Add disputed indiction column
-        transactions['disputed'] = transactions['transaction_id'].isin(chargebacks['transaction_id'])
-
-        grouped_payment_methods = transactions.groupby(['payment_method.type'])
+        if chargebacks_index is None:
+            chargebacks_index = build_key_index(chargebacks, 'transaction_id')
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
+        # Disputed, completed and failed indicator columns and the amount in the reporting currency,
+        # in a frame of their own so the transactions are not modified
+        indicators = pd.DataFrame({
+            'payment_method.type': transactions['payment_method.type'],
+            'transaction_id': transactions['transaction_id'],
+            'disputed': contains_keys(chargebacks_index, transactions['transaction_id']),
+            'completed': transactions['status'] == 'completed',
+            'failed': transactions['status'] == 'failed',
+            'reporting_amount': convert_amounts(fx_rates, transactions['timestamp'], transactions['currency'],
+                                                transactions['amount'].to_numpy())
+        }, index=transactions.index)
+
+        grouped_payment_methods = indicators.groupby(['payment_method.type'], observed=True)
 
         # Calculate metrics
         performance = grouped_payment_methods.agg(
             total_transactions=('transaction_id', 'count'),
-            completed_transactions=('status', lambda status: (status == 'completed').sum()),
-            failed_transactions=('status', lambda status: (status == 'failed').sum()),
+            completed_transactions=('completed', 'sum'),
+            failed_transactions=('failed', 'sum'),
             disputed_transactions=('disputed', 'sum'),
-            total_amount=('amount', 'sum'),
-            average_amount=('amount', 'mean')
+            total_amount=('reporting_amount', 'sum'),
+            average_amount=('reporting_amount', 'mean')
         )
 
-        # Add derived metrics
-        performance['success_rate'] = (performance['completed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
-        performance['failure_rate'] = (performance['failed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
-        performance['dispute_rate'] = (performance['disputed_transactions'] / performance['total_transactions']).round(precision_limit) * 100
-
-        performance = performance.reset_index()
+        performance = add_performance_rates(performance).reset_index()
 
         logger.info(f"Successfully calculated the payment method performance")
 
@@ -195,7 +301,10 @@ def calculate_payment_method_performance(transactions: pd.DataFrame, chargebacks
         logger.error(f"Error calculating the payment method performance: {e}")
         raise
     
-def calculate_business_metrics(merged: pd.DataFrame, transactions: pd.DataFrame, chargebacks: pd.DataFrame) -> dict:
+@profiled('analysis')
+def calculate_business_metrics(merged: pd.DataFrame, transactions: pd.DataFrame, chargebacks: pd.DataFrame,
+                               chargebacks_index: Optional[KeyIndex] = None,
+                               fx_rates: Optional[FxRates] = None) -> dict:
     """
     Calculate key business metrics including daily transactions, chargeback rates, failed transaction analysis,
     payment method performance, and payment success rate.
@@ -206,6 +315,10 @@ def calculate_business_metrics(merged: pd.DataFrame, transactions: pd.DataFrame,
     :type transactions: pd.DataFrame
     :param chargebacks: The DataFrame containing chargeback data.
     :type chargebacks: pd.DataFrame
+    :param chargebacks_index: The transaction_id index of the chargebacks, built if not given.
+    :type chargebacks_index: Optional[KeyIndex]
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
     :return: Dictionary with key business metrics.
     :rtype: dict
     """
@@ -213,13 +326,24 @@ def calculate_business_metrics(merged: pd.DataFrame, transactions: pd.DataFrame,
     logger.info(f"Starting calculating the business metrics")
 
     try:
+        if chargebacks_index is None:
+            chargebacks_index = build_key_index(chargebacks, 'transaction_id')
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
         with log_indent():
             metrics = {
-                "daily_transactions": calculate_daily_metrics(transactions),
+                "daily_transactions": calculate_daily_metrics(transactions, fx_rates),
                 "chargeback_rate": calculate_chargeback_rates(merged),
-                "failed_transaction_analysis": analyze_failed_transactions(transactions),
-                "payment_method_performance": calculate_payment_method_performance(transactions, chargebacks),
-                "payment_success_rate": calculate_payment_success_rate(transactions)
+                "failed_transaction_analysis": analyze_failed_transactions(transactions, fx_rates),
+                "payment_method_performance": calculate_payment_method_performance(transactions, chargebacks,
+                                                                                   chargebacks_index, fx_rates),
+                "payment_success_rate": calculate_payment_success_rate(transactions),
+                "rolling_metrics": calculate_time_series(
+                    transactions['timestamp'], transactions['status'],
+                    contains_keys(chargebacks_index, transactions['transaction_id']), np.ones(len(transactions)),
+                    convert_amounts(fx_rates, transactions['timestamp'], transactions['currency'],
+                                    transactions['amount'].to_numpy()) * AMOUNT_SCALE)
             }
 
         logger.info(f"Successfully calculated the business metrics")
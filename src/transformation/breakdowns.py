@@ -0,0 +1,190 @@
+import heapq
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional
+from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import PRECISION_LIMIT, BREAKDOWN_TOP_K, BREAKDOWN_MIN_TRANSACTIONS, BREAKDOWN_RANK_BY
+from src.transformation.timeseries import AMOUNT_SCALE
+from src.transformation.fx import FxRates, convert_amounts, load_fx_rates
+
+# The transaction column of each breakdown dimension
+BREAKDOWN_DIMENSIONS = {'provider': 'payment_method.provider', 'error_code': 'error_code'}
+BREAKDOWN_VALUES = ['transactions', 'failed', 'disputed', 'amount', 'failed_amount']
+
+def reporting_amounts(entries: pd.DataFrame, fx_rates: Optional[FxRates] = None) -> np.ndarray:
+    """
+    Get the amount of each transaction entry in the minor unit of the reporting currency, rounded per transaction.
+    The amount recorded in the reporting_amount column of the incremental ledger when the entry was folded is kept,
+    so retracting the entry takes back exactly what was added, the other amounts are converted.
+
+    :param entries: The transaction entries, with the day, currency and amount columns.
+    :type entries: pd.DataFrame
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
+    :return: The reporting amounts, NaN for the entries without a day.
+    :rtype: np.ndarray
+    """
+
+    if 'reporting_amount' in entries.columns:
+        amounts = entries['reporting_amount'].to_numpy(dtype=float, na_value=np.nan)
+    else:
+        amounts = np.full(len(entries), np.nan)
+
+    unconverted = np.isnan(amounts)
+    if unconverted.any():
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
+        amounts[unconverted] = np.round(convert_amounts(fx_rates, entries['day'][unconverted],
+                                                        entries['currency'][unconverted],
+                                                        entries['amount'].to_numpy()[unconverted]))
+
+    return amounts
+
+@profiled('analysis')
+def aggregate_breakdowns(entries: pd.DataFrame, fx_rates: Optional[FxRates] = None) -> pd.DataFrame:
+    """
+    Aggregate transaction entries to mergeable partial counts and completed and failed amounts of each provider
+    and error code. The values of each dimension are factorized and their sums taken in a single bincount pass,
+    without sorting them.
+
+    :param entries: The transaction entries, with the aggregate keys and values, the provider and the error code.
+    :type entries: pd.DataFrame
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
+    :return: DataFrame with the dimension, the key and the counts and the completed and failed amounts of each
+        provider and error code. The amounts are integers in the minor unit of the reporting currency,
+        so merging partial sums is exact.
+    :rtype: pd.DataFrame
+    """
+
+    counts = entries['count'].to_numpy()
+    completed = (entries['status'] == 'completed').to_numpy()
+    failed = (entries['status'] == 'failed').to_numpy()
+    amounts = reporting_amounts(entries, fx_rates)
+
+    # The amounts without a day are not converted and not counted in the values
+    converted = ~np.isnan(amounts)
+
+    weights = {
+        'transactions': counts,
+        'failed': np.where(failed, counts, 0),
+        'disputed': np.where(entries['disputed'].to_numpy(dtype=bool), counts, 0),
+        'amount': np.where(completed & converted, amounts, 0),
+        'failed_amount': np.where(failed & converted, amounts, 0)
+    }
+
+    breakdowns = []
+    for dimension, column in BREAKDOWN_DIMENSIONS.items():
+        codes, keys = pd.factorize(entries[column], use_na_sentinel=True)
+        present = codes >= 0
+
+        breakdown = pd.DataFrame({'dimension': dimension, 'key': np.asarray(keys, dtype=object)})
+        for name, values in weights.items():
+            breakdown[name] = np.round(np.bincount(codes[present], weights=values[present],
+                                                   minlength=len(keys))).astype(np.int64)
+        breakdowns.append(breakdown)
+
+    return pd.concat(breakdowns, ignore_index=True)
+
+def merge_breakdowns(breakdowns: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Merge partial breakdown aggregates to a single aggregate.
+
+    :param breakdowns: The partial breakdown aggregates to merge, retracted transactions have negative counts
+        and amounts.
+    :type breakdowns: Iterable[pd.DataFrame]
+    :return: The merged breakdown aggregate.
+    :rtype: pd.DataFrame
+    """
+
+    breakdowns = pd.concat(breakdowns, ignore_index=True)
+    breakdowns = breakdowns.groupby(['dimension', 'key'], sort=False)[BREAKDOWN_VALUES].sum().reset_index()
+
+    # The keys whose transactions were all retracted by the incremental folds are dropped
+    return breakdowns[breakdowns['transactions'] != 0].reset_index(drop=True)
+
+def top_breakdown(breakdown: pd.DataFrame, dimension: str, top_k: int = BREAKDOWN_TOP_K,
+                  min_transactions: int = BREAKDOWN_MIN_TRANSACTIONS, rank_by: str = BREAKDOWN_RANK_BY) -> pd.DataFrame:
+    """
+    Calculate the failure rate, dispute rate, completed value and failed value (the value at risk) of the top_k keys
+    of a dimension with at least min_transactions transactions. The top keys are selected with a heap of top_k entries,
+    so only the selected keys are sorted and turned into rows.
+
+    :param breakdown: The breakdown aggregate of the dimension.
+    :type breakdown: pd.DataFrame
+    :param dimension: 'provider' or 'error_code', the name of the key column.
+    :type dimension: str
+    :param top_k: The number of keys listed.
+    :type top_k: int
+    :param min_transactions: The minimal number of transactions of a listed key.
+    :type min_transactions: int
+    :param rank_by: The metric the keys are ranked by - 'failure_rate', 'dispute_rate', 'value', 'failed_value'
+        or 'transactions'.
+        Ties are ranked by the number of transactions, then by the key.
+    :type rank_by: str
+    :return: DataFrame with the metrics of the top keys, from the highest ranked.
+    :rtype: pd.DataFrame
+    :raises ValueError: If the ranking metric is not supported.
+    """
+
+    transactions = breakdown['transactions'].to_numpy()
+    eligible = np.flatnonzero(transactions >= max(min_transactions, 1))
+
+    def rate(counts):
+        return np.round(counts[eligible] * 100 / transactions[eligible], PRECISION_LIMIT)
+
+    ranked = {
+        'failure_rate': rate(breakdown['failed'].to_numpy()),
+        'dispute_rate': rate(breakdown['disputed'].to_numpy()),
+        'value': breakdown['amount'].to_numpy()[eligible] / AMOUNT_SCALE,
+        'failed_value': breakdown['failed_amount'].to_numpy()[eligible] / AMOUNT_SCALE,
+        'transactions': transactions[eligible]
+    }
+    if rank_by not in ranked:
+        raise ValueError(f"Unsupported breakdown ranking metric: {rank_by}")
+
+    keys = breakdown['key'].to_numpy()[eligible]
+    rank_values, volumes = ranked[rank_by], ranked['transactions']
+    top = heapq.nsmallest(top_k, range(len(eligible)),
+                          key=lambda position: (-rank_values[position], -volumes[position], keys[position]))
+
+    rows = eligible[top]
+
+    return pd.DataFrame({
+        dimension: keys[top],
+        'transactions': transactions[rows],
+        'failed_transactions': breakdown['failed'].to_numpy()[rows],
+        'failure_rate': ranked['failure_rate'][top],
+        'disputed_transactions': breakdown['disputed'].to_numpy()[rows],
+        'dispute_rate': ranked['dispute_rate'][top],
+        'value': np.round(ranked['value'][top], PRECISION_LIMIT),
+        'failed_value': np.round(ranked['failed_value'][top], PRECISION_LIMIT)
+    })
+
+@profiled('analysis')
+def calculate_breakdown_metrics(breakdowns: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Calculate the failure and dispute breakdowns of the top providers and error codes.
+
+    :param breakdowns: The breakdown aggregate of the providers and error codes.
+    :type breakdowns: pd.DataFrame
+    :return: Dictionary with the provider and error code breakdowns.
+    :rtype: Dict[str, pd.DataFrame]
+    """
+
+    logger.info(f"Starting calculating the breakdowns of the top {BREAKDOWN_TOP_K} providers and error codes "
+                f"by {BREAKDOWN_RANK_BY}")
+
+    try:
+        metrics = {f"{dimension}_breakdown": top_breakdown(breakdowns[breakdowns['dimension'] == dimension], dimension)
+                   for dimension in BREAKDOWN_DIMENSIONS}
+
+        logger.info(f"Successfully calculated the provider and error code breakdowns")
+
+        return metrics
+
+    except Exception as e:
+        logger.error(f"Error calculating the provider and error code breakdowns: {e}")
+        raise
@@ -1,6 +1,10 @@
+import numpy as np
 import pandas as pd
+from typing import Callable, Iterable, Iterator
 from utils.logging_config import logger
+from utils.profiling import profiled
 
+@profiled('clean')
 def clean_orders(orders: pd.DataFrame) -> pd.DataFrame:
     """
     Clean the data in the orders dataFrame
@@ -28,6 +32,7 @@ def clean_orders(orders: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error cleaning orders data: {e}")
         raise
 
+@profiled('clean')
 def clean_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
     """
     Clean the data in the transactions dataFrame
@@ -55,6 +60,7 @@ def clean_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error cleaning transactions data: {e}")
         raise
 
+@profiled('clean')
 def clean_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
     """
     Clean the data in the chargebacks dataFrame
@@ -80,4 +86,35 @@ def clean_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
 
     except Exception as e:
         logger.error(f"Error cleaning chargebacks data: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def clean_chunks(chunks: Iterable[pd.DataFrame], clean: Callable[[pd.DataFrame], pd.DataFrame],
+                 key: str) -> Iterator[pd.DataFrame]:
+    """
+    Clean a stream of dataFrame chunks, removing the duplicates across the chunks as well.
+    The keys seen so far are kept as a sorted array of their 64-bit hashes, 8 bytes per key.
+
+    :param chunks: The dataFrame chunks to clean.
+    :type chunks: Iterable[pd.DataFrame]
+    :param clean: The clean function of the dataset.
+    :type clean: Callable[[pd.DataFrame], pd.DataFrame]
+    :param key: The column identifying a row.
+    :type key: str
+    :return: Iterator over the cleaned dataFrame chunks.
+    :rtype: Iterator[pd.DataFrame]
+    """
+
+    seen_hashes = np.empty(0, dtype=np.uint64)
+
+    for chunk in chunks:
+        chunk = clean(chunk)
+
+        # Keep the first occurrence of each key, like drop_duplicates does on a whole dataFrame
+        hashes = pd.util.hash_array(chunk[key].to_numpy())
+        positions = np.searchsorted(seen_hashes, hashes)
+        found = positions < len(seen_hashes)
+        duplicated = np.zeros(len(hashes), dtype=bool)
+        duplicated[found] = seen_hashes[positions[found]] == hashes[found]
+        seen_hashes = np.union1d(seen_hashes, hashes)
+
+        yield chunk[~duplicated]
@@ -0,0 +1,109 @@
+import numpy as np
+import pandas as pd
+from utils.logging_config import logger
+from config.constants import TIMESTAMP_FORMAT, DATE_CACHE_SIZE
+
+# Strings pandas parses to NaT without raising, so they are valid dates
+NULL_DATE_STRINGS = ['', 'NaT', 'nat', 'NAT', 'nan', 'NaN', 'NAN']
+
+# The parsed timestamp of each date string parsed so far, NaT for the strings that can't be parsed
+parsed_dates = {}
+
+def parse_new_dates(values: np.ndarray, timestamp_format: str = TIMESTAMP_FORMAT) -> pd.DatetimeIndex:
+    """
+    Parse distinct date strings, with the known format first and only the leftovers with the slower parsers.
+
+    :param values: The date strings.
+    :type values: np.ndarray
+    :param timestamp_format: The expected format of the date strings.
+    :type timestamp_format: str
+    :return: The parsed timestamps, NaT where a value can't be parsed.
+    :rtype: pd.DatetimeIndex
+    """
+
+    parsed = pd.to_datetime(values, errors='coerce', format=timestamp_format).to_numpy()
+
+    # Values in another format are parsed as ISO 8601 in C, the rest by the per value parser
+    for fallback_format in ['ISO8601', 'mixed']:
+        unparsed = np.isnat(parsed)
+        if not unparsed.any():
+            break
+
+        parsed[unparsed] = pd.to_datetime(values[unparsed], errors='coerce', format=fallback_format).to_numpy()
+
+    return pd.DatetimeIndex(parsed)
+
+def parse_dates(series: pd.Series, timestamp_format: str = TIMESTAMP_FORMAT) -> pd.Series:
+    """
+    Parse a column of date strings. Each distinct value is parsed once and memoized,
+    so repeated dates and columns parsed again by a later stage are only looked up.
+
+    :param series: The date strings, non string values are not parsed.
+    :type series: pd.Series
+    :param timestamp_format: The expected format of the date strings.
+    :type timestamp_format: str
+    :return: The parsed timestamps, NaT where a value is missing or can't be parsed.
+    :rtype: pd.Series
+    """
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+
+    codes, uniques = pd.factorize(series)
+    uniques = np.asarray(uniques, dtype=object)
+    strings = np.array([isinstance(value, str) for value in uniques], dtype=bool)
+
+    parsed_uniques = np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]')
+    cached = np.array([strings[position] and value in parsed_dates for position, value in enumerate(uniques)],
+                      dtype=bool)
+
+    if cached.any():
+        parsed_uniques[cached] = [parsed_dates[value] for value in uniques[cached]]
+
+    new_values = strings & ~cached
+    if new_values.any():
+        parsed_uniques[new_values] = parse_new_dates(uniques[new_values], timestamp_format).to_numpy()
+        cache_dates(uniques[new_values], parsed_uniques[new_values])
+
+    return pd.Series(pd.DatetimeIndex(parsed_uniques).take(codes, allow_fill=True, fill_value=pd.NaT),
+                     index=series.index, name=series.name)
+
+def parse_date(value: str) -> pd.Timestamp:
+    """
+    Parse a single date string the way the columns are parsed, memoized with the parsed columns.
+
+    :param value: The date string.
+    :type value: str
+    :return: The parsed timestamp, NaT for the strings pandas parses as a missing date.
+    :rtype: pd.Timestamp
+    :raises ValueError: If the value can't be parsed as a date.
+    """
+
+    parsed = parsed_dates.get(value)
+
+    if parsed is None:
+        parsed = parse_new_dates(np.array([value], dtype=object)).to_numpy()[0]
+        cache_dates(np.array([value], dtype=object), np.array([parsed]))
+
+    if np.isnat(parsed) and value not in NULL_DATE_STRINGS:
+        raise ValueError(f"Invalid timestamp format: {value}")
+
+    return pd.Timestamp(parsed)
+
+def cache_dates(values: np.ndarray, parsed: np.ndarray) -> None:
+    """
+    Memoize parsed date strings, the memo is cleared once it holds DATE_CACHE_SIZE values.
+
+    :param values: The date strings.
+    :type values: np.ndarray
+    :param parsed: Their parsed timestamps.
+    :type parsed: np.ndarray
+    :return: None
+    :rtype: None
+    """
+
+    if len(parsed_dates) + len(values) > DATE_CACHE_SIZE:
+        logger.info(f"Clearing the parsed dates cache of {len(parsed_dates)} values")
+        parsed_dates.clear()
+
+    parsed_dates.update(zip(values.tolist(), parsed))
@@ -0,0 +1,120 @@
+import os
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import NamedTuple
+from utils.logging_config import logger
+from config.constants import FX_RATES_FILE_PATH, REPORTING_CURRENCY
+from src.transformation.timeseries import bucket_keys, bucket_starts
+
+class FxRates(NamedTuple):
+    # The reporting currency rate of each currency on each day from the first day of the rate table,
+    # a row per day and a column per currency
+    first_day: int
+    currencies: pd.Index
+    rates: np.ndarray
+    reporting_currency: str
+
+@lru_cache(maxsize=8)
+def read_fx_rates(file_path: str, reporting_currency: str, modified_time: int) -> FxRates:
+    """
+    Read a rate table and memoize the rate of each currency on each day, in the reporting currency.
+    The days without a rate of a currency take its previous rate, or its first rate before it.
+
+    :param file_path: The path to the rate table, with the date, currency and rate columns.
+        The rates of a date quote all the currencies in the same base currency.
+    :type file_path: str
+    :param reporting_currency: The currency the amounts are converted to.
+    :type reporting_currency: str
+    :param modified_time: The modification time of the rate table, so a changed table is read again.
+    :type modified_time: int
+    :return: The rates of each day.
+    :rtype: FxRates
+    :raises ValueError: If the table has no rates of the reporting currency.
+    """
+
+    logger.info(f"Starting reading the FX rates from {file_path}")
+
+    try:
+        table = pd.read_csv(file_path, dtype={'currency': str, 'rate': float})
+        table['day'] = bucket_keys(pd.to_datetime(table['date'], format='%Y-%m-%d'), 'day')
+
+        rates = table.pivot_table(index='day', columns='currency', values='rate', aggfunc='last')
+
+        if reporting_currency not in rates.columns:
+            raise ValueError(f"No FX rates of the reporting currency {reporting_currency}")
+
+        # A row for each day between the first and the last rates, so a rate is looked up by its day position
+        days = np.arange(rates.index.min(), rates.index.max() + 1)
+        rates = rates.reindex(days).ffill().bfill()
+        rates = rates.div(rates[reporting_currency], axis=0)
+
+        logger.info(f"Successfully read the FX rates of {len(rates.columns)} currencies on {len(days)} days")
+
+        return FxRates(int(days[0]), rates.columns, rates.to_numpy(), reporting_currency)
+
+    except Exception as e:
+        logger.error(f"Error reading the FX rates: {e}")
+        raise
+
+def load_fx_rates(file_path: str = FX_RATES_FILE_PATH, reporting_currency: str = REPORTING_CURRENCY) -> FxRates:
+    """
+    Load the rate table, read only once until the file changes.
+
+    :param file_path: The path to the rate table.
+    :type file_path: str
+    :param reporting_currency: The currency the amounts are converted to.
+    :type reporting_currency: str
+    :return: The rates of each day.
+    :rtype: FxRates
+    """
+
+    return read_fx_rates(file_path, reporting_currency, os.stat(file_path).st_mtime_ns)
+
+def convert_amounts(fx_rates: FxRates, timestamps: pd.Series, currencies: pd.Series,
+                    amounts: np.ndarray) -> np.ndarray:
+    """
+    Convert amounts to the reporting currency at the rate of their day, in a single lookup of all the amounts.
+    The days before the first or after the last day of the rate table take its first or last rates, with a warning,
+    and the amounts without a timestamp are not converted.
+
+    :param fx_rates: The rates of each day.
+    :type fx_rates: FxRates
+    :param timestamps: The timestamp or the day of each amount.
+    :type timestamps: pd.Series
+    :param currencies: The currency of each amount.
+    :type currencies: pd.Series
+    :param amounts: The amounts.
+    :type amounts: np.ndarray
+    :return: The amounts in the reporting currency, NaN for the amounts without a timestamp.
+    :rtype: np.ndarray
+    :raises ValueError: If a currency has no rates.
+    """
+
+    missing_days = np.asarray(pd.isna(timestamps), dtype=bool)
+    day_positions = bucket_keys(timestamps, 'day') - fx_rates.first_day
+    outside_days = ~missing_days & ((day_positions < 0) | (day_positions >= len(fx_rates.rates)))
+
+    if outside_days.any():
+        outside_positions = day_positions[outside_days]
+        amount_days = bucket_starts(np.array([outside_positions.min(), outside_positions.max()]) + fx_rates.first_day)
+        table_days = bucket_starts(np.array([0, len(fx_rates.rates) - 1]) + fx_rates.first_day)
+        logger.warning(f"{int(outside_days.sum())} amounts from {amount_days[0]:%Y-%m-%d} to {amount_days[1]:%Y-%m-%d} "
+                       f"are outside of the FX rates from {table_days[0]:%Y-%m-%d} to {table_days[1]:%Y-%m-%d}, "
+                       f"they are converted at the nearest rates")
+
+    if missing_days.any():
+        logger.warning(f"{int(missing_days.sum())} amounts without a timestamp are not converted")
+
+    day_positions = np.clip(day_positions, 0, len(fx_rates.rates) - 1)
+    currency_positions = fx_rates.currencies.get_indexer(np.asarray(currencies, dtype=object))
+
+    if (currency_positions < 0).any():
+        missing = sorted(set(np.asarray(currencies, dtype=object)[currency_positions < 0]))
+        logger.error(f"No FX rates of the currencies {missing}")
+        raise ValueError(f"No FX rates of the currencies {missing}")
+
+    converted = np.asarray(amounts, dtype=float) * fx_rates.rates[day_positions, currency_positions]
+    converted[missing_days] = np.nan
+
+    return converted
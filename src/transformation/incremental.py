@@ -0,0 +1,319 @@
+import json
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Optional
+from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import INCREMENTAL_STATE_DIR, INCREMENTAL_STATE_PARTITIONS
+from src.transformation.aggregates import (AGGREGATE_VALUES, aggregate_entries,
+                                           merge_aggregates, transaction_entries)
+from src.transformation.breakdowns import BREAKDOWN_VALUES, aggregate_breakdowns, merge_breakdowns, reporting_amounts
+
+# The types of the aggregate keys and values
+AGGREGATE_TYPES = {'day': 'datetime64[ns]', 'payment_method.type': object, 'currency': object, 'status': object,
+                   'disputed': bool, 'count': 'int64', 'amount': 'int64'}
+
+# The persisted tables of the incremental state and the types of their columns
+STATE_TYPES = {
+    'aggregates': AGGREGATE_TYPES,
+    'breakdowns': {'dimension': object, 'key': object, **{name: 'int64' for name in BREAKDOWN_VALUES}},
+    'ledger': {'transaction_id': object, **AGGREGATE_TYPES, 'payment_method.provider': object, 'error_code': object,
+               'reporting_amount': float},
+    'orders': {'order_id': object, 'total_amount': float},
+    'chargebacks': {'transaction_id': object}
+}
+
+# The tables partitioned by a hash of their key, the other tables are small aggregates kept whole
+PARTITION_KEYS = {'ledger': 'transaction_id', 'orders': 'order_id', 'chargebacks': 'transaction_id'}
+
+# The file naming the current version directory of the state, and the file of the partition count of a version
+CURRENT_POINTER = 'CURRENT'
+MANIFEST_FILE = 'manifest.json'
+
+def empty_table(types: Dict[str, object]) -> pd.DataFrame:
+    """
+    Create an empty state table.
+
+    :param types: The types of the columns of the table.
+    :type types: Dict[str, object]
+    :return: The empty table.
+    :rtype: pd.DataFrame
+    """
+
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in types.items()})
+
+def key_partitions(keys: Iterable, partitions: int) -> np.ndarray:
+    """
+    Get the partition of each key, from a hash of the key that is the same in every run.
+
+    :param keys: The keys.
+    :type keys: Iterable
+    :param partitions: The number of partitions.
+    :type partitions: int
+    :return: The partition of each key.
+    :rtype: np.ndarray
+    """
+
+    hashes = pd.util.hash_array(np.asarray(keys, dtype=object))
+
+    return (hashes % np.uint64(partitions)).astype(np.int64)
+
+def current_version(state_dir: str) -> Optional[str]:
+    """
+    Get the directory of the current version of the state, the one the CURRENT pointer file names.
+
+    :param state_dir: The directory of the incremental state.
+    :type state_dir: str
+    :return: The directory of the current version, None if no version was saved yet.
+    :rtype: Optional[str]
+    """
+
+    pointer_path = os.path.join(state_dir, CURRENT_POINTER)
+
+    if not os.path.exists(pointer_path):
+        return None
+
+    with open(pointer_path) as pointer_file:
+        return os.path.join(state_dir, pointer_file.read().strip())
+
+def load_state(state_dir: str = INCREMENTAL_STATE_DIR, transaction_ids: Optional[Iterable] = None,
+               order_ids: Optional[Iterable] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Load the persisted incremental state, an empty state if nothing was folded yet.
+    The state holds the metric and breakdown aggregates, a ledger of the aggregate keys, the provider, the error code
+    and the reporting amount of each folded transaction, the total amounts of the folded orders
+    and the ids of the disputed transactions.
+    The ledger, orders and chargebacks tables are partitioned by a hash of their key, and only the partitions
+    of the given keys are loaded, so a batch reads the part of the history it can change.
+
+    :param state_dir: The directory of the incremental state.
+    :type state_dir: str
+    :param transaction_ids: The transaction ids of the batch, of its transactions and chargebacks, whose ledger
+        and chargebacks partitions are loaded. All the partitions are loaded if not given.
+    :type transaction_ids: Optional[Iterable]
+    :param order_ids: The order ids of the batch, of its orders and transactions, whose orders partitions are loaded.
+        All the partitions are loaded if not given.
+    :type order_ids: Optional[Iterable]
+    :return: Dictionary of the state tables.
+    :rtype: Dict[str, pd.DataFrame]
+    """
+
+    version_dir = current_version(state_dir)
+    state = {}
+
+    # A state saved before the tables were partitioned is loaded whole, and partitioned when it is saved
+    if version_dir is None and os.path.exists(os.path.join(state_dir, 'ledger.parquet')):
+        for name, types in STATE_TYPES.items():
+            file_path = os.path.join(state_dir, f"{name}.parquet")
+            # The columns added since the state was saved are missing values
+            state[name] = (pd.read_parquet(file_path).reindex(columns=list(types)) if os.path.exists(file_path)
+                           else empty_table(types))
+
+        # A state saved before the breakdowns were persisted gets them from its ledger once
+        if state['breakdowns'].empty and not state['ledger'].empty:
+            state['breakdowns'] = aggregate_breakdowns(state['ledger'])
+
+        logger.info(f"Loaded the unpartitioned incremental state of {len(state['ledger'])} transactions "
+                    f"from {state_dir}")
+
+        return state
+
+    partitions = INCREMENTAL_STATE_PARTITIONS
+    if version_dir is not None:
+        with open(os.path.join(version_dir, MANIFEST_FILE)) as manifest_file:
+            partitions = json.load(manifest_file)['partitions']
+
+    batch_keys = {'ledger': transaction_ids, 'orders': order_ids, 'chargebacks': transaction_ids}
+    loaded_partitions = 0
+
+    for name, types in STATE_TYPES.items():
+        if version_dir is None:
+            state[name] = empty_table(types)
+            continue
+
+        if name not in PARTITION_KEYS:
+            state[name] = pd.read_parquet(os.path.join(version_dir, f"{name}.parquet")).reindex(columns=list(types))
+            continue
+
+        if batch_keys[name] is None:
+            table_partitions = range(partitions)
+        else:
+            table_partitions = np.unique(key_partitions(batch_keys[name], partitions)).tolist()
+
+        file_paths = [os.path.join(version_dir, name, f"part-{partition:05d}.parquet")
+                      for partition in table_partitions]
+        tables = [pd.read_parquet(file_path) for file_path in file_paths if os.path.exists(file_path)]
+        loaded_partitions += len(tables)
+
+        # The columns added since the state was saved are missing values
+        state[name] = (pd.concat(tables, ignore_index=True).reindex(columns=list(types)) if tables
+                       else empty_table(types))
+
+    logger.info(f"Loaded {loaded_partitions} partitions of the incremental state with {len(state['ledger'])} "
+                f"transactions from {version_dir or state_dir}")
+
+    return state
+
+def save_state(state: Dict[str, pd.DataFrame], state_dir: str = INCREMENTAL_STATE_DIR) -> None:
+    """
+    Persist the incremental state as a new version directory, and switch to it in one step by atomically replacing
+    the CURRENT pointer file, so a failed save leaves the previous version in place.
+    The partitions with rows in the state are written, and the other partitions of the previous version are
+    hard-linked into the new version without reading them. Rows are never removed from the partitioned tables,
+    so a partition the state has no rows of is unchanged.
+
+    :param state: Dictionary of the state tables, the partitioned tables with the rows of the loaded partitions.
+    :type state: Dict[str, pd.DataFrame]
+    :param state_dir: The directory of the incremental state.
+    :type state_dir: str
+    :return: None
+    :rtype: None
+    """
+
+    os.makedirs(state_dir, exist_ok=True)
+    previous_dir = current_version(state_dir)
+
+    partitions = INCREMENTAL_STATE_PARTITIONS
+    if previous_dir is not None:
+        with open(os.path.join(previous_dir, MANIFEST_FILE)) as manifest_file:
+            partitions = json.load(manifest_file)['partitions']
+
+    # The new version follows every version directory, including the ones of failed saves
+    versions = [int(name[1:]) for name in os.listdir(state_dir) if re.fullmatch(r'v\d+', name)]
+    version = f"v{max(versions, default=0) + 1:08d}"
+    version_dir = os.path.join(state_dir, version)
+    written_partitions = 0
+
+    for name in STATE_TYPES:
+        if name not in PARTITION_KEYS:
+            os.makedirs(version_dir, exist_ok=True)
+            state[name].to_parquet(os.path.join(version_dir, f"{name}.parquet"), index=False)
+            continue
+
+        table_dir = os.path.join(version_dir, name)
+        os.makedirs(table_dir, exist_ok=True)
+        table = state[name]
+
+        for partition, rows in table.groupby(key_partitions(table[PARTITION_KEYS[name]], partitions), sort=False):
+            rows.to_parquet(os.path.join(table_dir, f"part-{partition:05d}.parquet"), index=False)
+            written_partitions += 1
+
+        if previous_dir is not None:
+            for file_name in os.listdir(os.path.join(previous_dir, name)):
+                previous_path, path = os.path.join(previous_dir, name, file_name), os.path.join(table_dir, file_name)
+
+                if not os.path.exists(path):
+                    try:
+                        os.link(previous_path, path)
+                    except OSError:
+                        # The file systems without hard links get a copy
+                        shutil.copyfile(previous_path, path)
+
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump({'partitions': partitions}, manifest_file)
+
+    # The new version becomes current at once, the previous one is kept for the readers still using it
+    pointer_path = os.path.join(state_dir, CURRENT_POINTER)
+    with open(f"{pointer_path}.tmp", 'w') as pointer_file:
+        pointer_file.write(version)
+        pointer_file.flush()
+        os.fsync(pointer_file.fileno())
+    os.replace(f"{pointer_path}.tmp", pointer_path)
+
+    kept = {version, os.path.basename(previous_dir) if previous_dir else None}
+    for name in os.listdir(state_dir):
+        if re.fullmatch(r'v\d+', name) and name not in kept:
+            shutil.rmtree(os.path.join(state_dir, name), ignore_errors=True)
+        elif name in {f"{table}.parquet" for table in STATE_TYPES}:
+            # The tables of a state saved before the tables were partitioned
+            os.remove(os.path.join(state_dir, name))
+
+    logger.info(f"Saved the incremental state of {len(state['ledger'])} changed or loaded transactions "
+                f"to {version_dir}, writing {written_partitions} partitions")
+
+def orders_amount_lookup(state: Dict[str, pd.DataFrame], orders: pd.DataFrame) -> pd.Series:
+    """
+    Get the total amount of each order of the state and of the new batch, the new batch overrides the state.
+
+    :param state: Dictionary of the state tables.
+    :type state: Dict[str, pd.DataFrame]
+    :param orders: The validated orders of the new batch.
+    :type orders: pd.DataFrame
+    :return: Series of the total amounts indexed by order id.
+    :rtype: pd.Series
+    """
+
+    orders_amount = pd.concat([state['orders'], orders[['order_id', 'total_amount']]], ignore_index=True)
+    orders_amount = orders_amount.drop_duplicates(subset=['order_id'], keep='last')
+
+    return orders_amount.set_index('order_id')['total_amount']
+
+@profiled('analysis')
+def fold_batch(state: Dict[str, pd.DataFrame], orders: pd.DataFrame, transactions: pd.DataFrame,
+               chargebacks: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Fold a batch of new or changed records into the incremental state.
+    A transaction sent again replaces its previous version, and a chargeback of an already folded transaction
+    moves it to the disputed aggregates, so the metric and breakdown aggregates always equal those of a full
+    recompute on the latest version of each record.
+
+    :param state: Dictionary of the state tables.
+    :type state: Dict[str, pd.DataFrame]
+    :param orders: The validated orders of the batch.
+    :type orders: pd.DataFrame
+    :param transactions: The validated and normalized transactions of the batch.
+    :type transactions: pd.DataFrame
+    :param chargebacks: The validated chargebacks of the batch.
+    :type chargebacks: pd.DataFrame
+    :return: The updated state.
+    :rtype: Dict[str, pd.DataFrame]
+    """
+
+    logger.info(f"Starting folding {len(transactions)} transactions and {len(chargebacks)} chargebacks "
+                f"into the incremental state")
+
+    try:
+        ledger = state['ledger']
+        chargeback_ids = pd.Index(pd.concat([state['chargebacks']['transaction_id'],
+                                             chargebacks['transaction_id']]).unique())
+
+        new_entries = transaction_entries(transactions, chargeback_ids)
+        new_entries['reporting_amount'] = reporting_amounts(new_entries)
+
+        # Folded transactions disputed by a late chargeback move to the disputed aggregates
+        late_disputed = (ledger['transaction_id'].isin(chargebacks['transaction_id'])
+                         & ~ledger['disputed']
+                         & ~ledger['transaction_id'].isin(new_entries['transaction_id']))
+        late_entries = ledger[late_disputed].assign(disputed=True)
+
+        # The previous versions of the changed transactions are retracted from the aggregates
+        replaced = ledger['transaction_id'].isin(new_entries['transaction_id']) | late_disputed
+        retracted = aggregate_entries(ledger[replaced])
+        retracted[AGGREGATE_VALUES] = -retracted[AGGREGATE_VALUES]
+        retracted_breakdowns = aggregate_breakdowns(ledger[replaced])
+        retracted_breakdowns[BREAKDOWN_VALUES] = -retracted_breakdowns[BREAKDOWN_VALUES]
+
+        updated_entries = pd.concat([new_entries, late_entries], ignore_index=True)
+        aggregates = merge_aggregates([state['aggregates'], retracted, aggregate_entries(updated_entries)])
+        breakdowns = merge_breakdowns([state['breakdowns'], retracted_breakdowns,
+                                       aggregate_breakdowns(updated_entries)])
+
+        state = {
+            'aggregates': aggregates,
+            'breakdowns': breakdowns,
+            'ledger': pd.concat([ledger[~replaced], updated_entries], ignore_index=True),
+            'orders': orders_amount_lookup(state, orders).reset_index(),
+            'chargebacks': pd.DataFrame({'transaction_id': chargeback_ids})
+        }
+
+        logger.info(f"Successfully folded {len(new_entries)} transactions and "
+                    f"{int(late_disputed.sum())} late chargebacks into the incremental state")
+
+        return state
+
+    except Exception as e:
+        logger.error(f"Error folding the batch into the incremental state: {e}")
+        raise
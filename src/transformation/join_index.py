@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from typing import NamedTuple
+from utils.logging_config import logger
+from utils.profiling import profiled
+from src.transformation.schema import encode_like
+
+class KeyIndex(NamedTuple):
+    # The unique keys of a DataFrame column, whose hash table is built once on the first lookup,
+    # and the row position of each key
+    keys: pd.Index
+    positions: np.ndarray
+
+@profiled('match')
+def build_key_index(df: pd.DataFrame, key: str) -> KeyIndex:
+    """
+    Build a hash index of the rows of a DataFrame by a key column, a repeated key points to its first row.
+
+    :param df: The indexed DataFrame.
+    :type df: pd.DataFrame
+    :param key: The key column.
+    :type key: str
+    :return: The key index.
+    :rtype: KeyIndex
+    """
+
+    keys = df[key]
+    first_rows = ~keys.duplicated().to_numpy()
+    index = KeyIndex(pd.Index(keys[first_rows], name=key), np.flatnonzero(first_rows))
+
+    # Build the hash table up front, every following lookup reuses it
+    index.keys.get_indexer(index.keys[:0])
+
+    logger.info(f"Built the {key} index of {len(index.keys)} keys")
+
+    return index
+
+def lookup_positions(index: KeyIndex, keys: pd.Series) -> np.ndarray:
+    """
+    Get the row position of each key in the indexed DataFrame.
+
+    :param index: The key index.
+    :type index: KeyIndex
+    :param keys: The keys to look up.
+    :type keys: pd.Series
+    :return: Array of the row positions, -1 where the key is not in the index.
+    :rtype: np.ndarray
+    """
+
+    matches = index.keys.get_indexer(encode_like(keys, index.keys))
+
+    return np.where(matches >= 0, index.positions[matches], -1)
+
+def contains_keys(index: KeyIndex, keys: pd.Series) -> np.ndarray:
+    """
+    Get a mask of the keys that are in the index.
+
+    :param index: The key index.
+    :type index: KeyIndex
+    :param keys: The keys to look up.
+    :type keys: pd.Series
+    :return: Boolean mask, True where the key is in the index.
+    :rtype: np.ndarray
+    """
+
+    return index.keys.get_indexer(encode_like(keys, index.keys)) >= 0
+
+def take_rows(df: pd.DataFrame, positions: np.ndarray, prefix: str = '') -> dict:
+    """
+    Take the rows of a DataFrame at the given positions, column by column, missing rows are filled with nulls.
+
+    :param df: The DataFrame to take the rows from.
+    :type df: pd.DataFrame
+    :param positions: The row positions, -1 for a missing row.
+    :type positions: np.ndarray
+    :param prefix: The prefix of the returned column names.
+    :type prefix: str
+    :return: Dictionary of the prefixed column names to the taken column values.
+    :rtype: dict
+    """
+
+    return {f"{prefix}{column}": df[column].array.take(positions, allow_fill=True) for column in df.columns}
@@ -1,11 +1,21 @@
 import pandas as pd
+from typing import Optional
 from utils.logging_config import logger
-
-def normalize_orders(orders: pd.DataFrame) -> pd.DataFrame:
+from utils.profiling import profiled
+from config.constants import COMPACT_SCHEMA
+from src.extraction import flatten_nested_columns
+from src.transformation.dates import parse_dates
+from src.transformation.schema import compact_frame
+from src.transformation.join_index import KeyIndex, build_key_index, lookup_positions, take_rows
+
+@profiled('normalize')
+def normalize_orders(orders: pd.DataFrame, compact: bool = COMPACT_SCHEMA) -> pd.DataFrame:
     """
     Normalize the orders data by converting certain columns to the appropriate data types.
     :param orders: The DataFrame containing orders data.
     :type orders: pd.DataFrame
+    :param compact: Whether to convert the columns to the compact schema.
+    :type compact: bool
     :return: The transformed DataFrame with normalized orders data.
     :rtype: pd.DataFrame
     """
@@ -14,7 +24,10 @@ def normalize_orders(orders: pd.DataFrame) -> pd.DataFrame:
 
     try:
         # Format the date column
-        orders['timestamp'] = pd.to_datetime(orders['timestamp'])
+        orders['timestamp'] = parse_dates(orders['timestamp'])
+
+        if compact:
+            orders = compact_frame(orders, 'orders')
 
         logger.info(f"Successfully normalized orders data")
 
@@ -24,12 +37,15 @@ def normalize_orders(orders: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error normalizing orders data: {e}")
         raise
 
-def normalize_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
+@profiled('normalize')
+def normalize_transactions(transactions: pd.DataFrame, compact: bool = COMPACT_SCHEMA) -> pd.DataFrame:
     """
     Normalize the transactions data by converting certain columns to the appropriate data types.
 
     :param transactions: The DataFrame containing transactions data.
     :type transactions: pd.DataFrame
+    :param compact: Whether to convert the columns to the compact schema.
+    :type compact: bool
     :return: The transformed DataFrame with normalized transactions data.
     :rtype: pd.DataFrame
     """
@@ -38,10 +54,13 @@ def normalize_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
 
     try:
         # Format the date column
-        transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+        transactions['timestamp'] = parse_dates(transactions['timestamp'])
 
-        # Normalize payment_method column
-        transactions = pd.json_normalize(transactions.to_dict(orient='records'))
+        # Flatten a nested payment_method column, the extraction already flattens it
+        transactions = flatten_nested_columns(transactions, 'transactions')
+
+        if compact:
+            transactions = compact_frame(transactions, 'transactions')
 
         logger.info(f"Successfully normalized transactions data")
 
@@ -51,12 +70,15 @@ def normalize_transactions(transactions: pd.DataFrame) -> pd.DataFrame:
         logger.error(f"Error normalizing transactions data: {e}")
         raise
 
-def normalize_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
+@profiled('normalize')
+def normalize_chargebacks(chargebacks: pd.DataFrame, compact: bool = COMPACT_SCHEMA) -> pd.DataFrame:
     """
     Normalize the chargebacks data by converting certain columns to the appropriate data types.
 
     :param chargebacks: The DataFrame containing chargebacks data.
     :type chargebacks: pd.DataFrame
+    :param compact: Whether to convert the columns to the compact schema.
+    :type compact: bool
     :return: The transformed DataFrame with normalized chargebacks data.
     :rtype: pd.DataFrame
     """
@@ -65,7 +87,10 @@ def normalize_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
 
     try:
         # Format the dates column
-        chargebacks[['dispute_date', 'resolution_date']] = chargebacks[['dispute_date', 'resolution_date']].apply(pd.to_datetime)
+        chargebacks[['dispute_date', 'resolution_date']] = chargebacks[['dispute_date', 'resolution_date']].apply(parse_dates)
+
+        if compact:
+            chargebacks = compact_frame(chargebacks, 'chargebacks')
 
         logger.info(f"Successfully normalized chargebacks data")
 
@@ -76,9 +101,14 @@ def normalize_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
         raise
 
 # Normalize and match chargebacks with transactions
-def match_dataframes(orders: pd.DataFrame, transactions: pd.DataFrame, chargebacks: pd.DataFrame) -> pd.DataFrame:
+@profiled('match')
+def match_dataframes(orders: pd.DataFrame, transactions: pd.DataFrame, chargebacks: pd.DataFrame,
+                     orders_index: Optional[KeyIndex] = None,
+                     chargebacks_index: Optional[KeyIndex] = None) -> pd.DataFrame:
     """
     Matching the chargebacks, transactions and orders and get the returned merged DataFrame.
+    Each transaction is matched to its chargeback and its order through the key indexes,
+    and the matched rows are taken column by column into the merged DataFrame.
 
     :param orders: The DataFrame containing orders data.
     :type orders: pd.DataFrame
@@ -86,6 +116,10 @@ def match_dataframes(orders: pd.DataFrame, transactions: pd.DataFrame, chargebac
     :type transactions: pd.DataFrame
     :param chargebacks_df: The DataFrame containing chargebacks data.
     :type chargebacks_df: pd.DataFrame
+    :param orders_index: The order_id index of the orders, built if not given.
+    :type orders_index: Optional[KeyIndex]
+    :param chargebacks_index: The transaction_id index of the chargebacks, built if not given.
+    :type chargebacks_index: Optional[KeyIndex]
     :return: A DataFrame containing merged transaction and chargeback data.
     :rtype: pd.DataFrame
     """
@@ -93,15 +127,21 @@ def match_dataframes(orders: pd.DataFrame, transactions: pd.DataFrame, chargebac
     logger.info("Matching the datasources data")
 
     try:
-        # Rename columns to include the original DataFrame name as a prefix
-        transactions_df = transactions.add_prefix('transaction_')
-        chargebacks_df = chargebacks.add_prefix('chargeback_')
-        orders_df = orders.add_prefix('order_')
-
-        # Merge the dataframes
-        merged_df = pd.merge(transactions_df, chargebacks_df, left_on="transaction_transaction_id", right_on="chargeback_transaction_id", how="left")
-        merged_df = pd.merge(merged_df, orders_df, left_on="transaction_order_id", right_on="order_order_id", how="left")
-        
+        if orders_index is None:
+            orders_index = build_key_index(orders, 'order_id')
+        if chargebacks_index is None:
+            chargebacks_index = build_key_index(chargebacks, 'transaction_id')
+
+        chargeback_positions = lookup_positions(chargebacks_index, transactions['transaction_id'])
+        order_positions = lookup_positions(orders_index, transactions['order_id'])
+
+        # Prefix the column names with the original DataFrame name
+        merged_df = pd.DataFrame({
+            **{f"transaction_{column}": transactions[column].array for column in transactions.columns},
+            **take_rows(chargebacks, chargeback_positions, prefix='chargeback_'),
+            **take_rows(orders, order_positions, prefix='order_')
+        })
+
         logger.info(f"Successfully matched the datasources data")
 
         return merged_df
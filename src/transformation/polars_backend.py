@@ -0,0 +1,210 @@
+import pandas as pd
+from utils.logging_config import log_indent, logger
+from utils.profiling import profiled
+from config.constants import TIMESTAMP_FORMAT
+from src.transformation.dates import parse_dates
+from src.transformation.aggregates import AGGREGATE_KEYS, AMOUNT_SCALE, metrics_from_aggregates
+from src.transformation.breakdowns import aggregate_breakdowns, calculate_breakdown_metrics
+
+try:
+    import polars as pl
+except ImportError:
+    # Polars is only needed by the polars DataFrame backend
+    pl = None
+
+# The columns of each dataset the analysis uses, converted to Polars
+ANALYSIS_COLUMNS = {
+    'orders': ['order_id', 'timestamp', 'total_amount'],
+    'transactions': ['transaction_id', 'order_id', 'timestamp', 'amount', 'currency', 'status', 'payment_method.type',
+                     'payment_method.provider', 'error_code'],
+    'chargebacks': ['transaction_id', 'dispute_date', 'resolution_date']
+}
+
+# The date columns of each dataset parsed by the normalize stage
+DATE_COLUMNS = {
+    'orders': ['timestamp'],
+    'transactions': ['timestamp'],
+    'chargebacks': ['dispute_date', 'resolution_date']
+}
+
+def to_polars(df: pd.DataFrame, dataset: str) -> 'pl.DataFrame':
+    """
+    Convert the analysis columns of a validated dataset to a Polars DataFrame.
+    Arrow backed columns are converted without copying.
+
+    :param df: The validated DataFrame.
+    :type df: pd.DataFrame
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :return: The Polars DataFrame.
+    :rtype: pl.DataFrame
+    :raises ImportError: If Polars is not installed.
+    """
+
+    if pl is None:
+        logger.error("The polars DataFrame backend requires Polars, install it with pip install polars")
+        raise ImportError("Polars is not installed")
+
+    return pl.from_pandas(df[ANALYSIS_COLUMNS[dataset]])
+
+def parse_timestamps(dates: 'pl.Series', timestamp_format: str = TIMESTAMP_FORMAT) -> 'pl.Series':
+    """
+    Parse a column of date strings with the known format first, then as ISO 8601,
+    and the leftovers with the pandas parser of the reference backend, so both backends parse the same dates.
+
+    :param dates: The date strings.
+    :type dates: pl.Series
+    :param timestamp_format: The expected format of the date strings.
+    :type timestamp_format: str
+    :return: The parsed timestamps, null where a value is missing or can't be parsed.
+    :rtype: pl.Series
+    """
+
+    if dates.dtype != pl.String:
+        return dates.cast(pl.Datetime('ns'))
+
+    parsed = dates.str.strptime(pl.Datetime('ns'), timestamp_format, strict=False)
+    parsed = parsed.fill_null(dates.str.to_datetime(time_unit='ns', strict=False))
+
+    unparsed = parsed.is_null() & dates.is_not_null()
+    if unparsed.any():
+        leftovers = dates.filter(unparsed).unique()
+        leftover_dates = pl.from_pandas(parse_dates(leftovers.to_pandas())).cast(pl.Datetime('ns'))
+        parsed = parsed.fill_null(dates.replace_strict(leftovers, leftover_dates, default=None))
+
+    return parsed
+
+@profiled('normalize')
+def normalize_frame(frame: 'pl.DataFrame', dataset: str) -> 'pl.DataFrame':
+    """
+    Normalize a dataset on the polars backend by parsing its date columns.
+
+    :param frame: The validated dataset.
+    :type frame: pl.DataFrame
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :return: The normalized dataset.
+    :rtype: pl.DataFrame
+    """
+
+    logger.info(f"Starting normalizing {dataset} data")
+
+    try:
+        frame = frame.with_columns(parse_timestamps(frame[column]) for column in DATE_COLUMNS[dataset])
+
+        logger.info(f"Successfully normalized {dataset} data")
+
+        return frame
+
+    except Exception as e:
+        logger.error(f"Error normalizing {dataset} data: {e}")
+        raise
+
+def match_frames(orders: 'pl.DataFrame', transactions: 'pl.DataFrame',
+                 chargebacks: 'pl.DataFrame') -> 'pl.LazyFrame':
+    """
+    Match the chargebacks, transactions and orders in a lazy query, with the column names
+    prefixed by the dataset name like match_dataframes.
+
+    :param orders: The normalized orders.
+    :type orders: pl.DataFrame
+    :param transactions: The normalized transactions.
+    :type transactions: pl.DataFrame
+    :param chargebacks: The normalized chargebacks.
+    :type chargebacks: pl.DataFrame
+    :return: The lazy query of the merged data.
+    :rtype: pl.LazyFrame
+    """
+
+    transactions = transactions.lazy().select(pl.all().name.prefix('transaction_'))
+    chargebacks = chargebacks.lazy().select(pl.all().name.prefix('chargeback_'))
+    orders = orders.lazy().select(pl.all().name.prefix('order_'))
+
+    # The right keys are kept, so a transaction without a chargeback or an order has a null key
+    return (transactions
+            .join(chargebacks, left_on='transaction_transaction_id', right_on='chargeback_transaction_id',
+                  how='left', coalesce=False)
+            .join(orders, left_on='transaction_order_id', right_on='order_order_id', how='left', coalesce=False))
+
+def aggregate_query(merged: 'pl.LazyFrame') -> 'pl.LazyFrame':
+    """
+    Aggregate the merged data to the counts and amounts of each key combination, like aggregate_transactions.
+
+    :param merged: The lazy query of the merged data.
+    :type merged: pl.LazyFrame
+    :return: The lazy query of the count and amount of each key combination.
+    :rtype: pl.LazyFrame
+    """
+
+    return merged.group_by(
+        pl.col('transaction_timestamp').dt.truncate('1d').alias('day'),
+        pl.col('transaction_payment_method.type').alias('payment_method.type'),
+        pl.col('transaction_currency').alias('currency'),
+        pl.col('transaction_status').alias('status'),
+        pl.col('chargeback_transaction_id').is_not_null().alias('disputed')
+    ).agg(
+        pl.len().cast(pl.Int64).alias('count'),
+        # Amounts are summed as integers in the minor currency unit, rounded the way the pandas backend rounds them
+        (pl.col('transaction_amount') * AMOUNT_SCALE).round(0).cast(pl.Int64).sum().alias('amount')
+    ).select(AGGREGATE_KEYS + ['count', 'amount'])
+
+def breakdown_entries_query(merged: 'pl.LazyFrame') -> 'pl.LazyFrame':
+    """
+    Get the transaction entries of the breakdowns from the merged data, like transaction_entries.
+
+    :param merged: The lazy query of the merged data.
+    :type merged: pl.LazyFrame
+    :return: The lazy query of the aggregate keys and values, the provider and the error code of each transaction.
+    :rtype: pl.LazyFrame
+    """
+
+    return merged.select(
+        pl.col('transaction_timestamp').dt.truncate('1d').alias('day'),
+        pl.col('transaction_currency').alias('currency'),
+        pl.col('transaction_status').alias('status'),
+        pl.col('chargeback_transaction_id').is_not_null().alias('disputed'),
+        pl.lit(1, dtype=pl.Int64).alias('count'),
+        (pl.col('transaction_amount') * AMOUNT_SCALE).round(0).cast(pl.Int64).alias('amount'),
+        pl.col('transaction_payment_method.provider').alias('payment_method.provider'),
+        pl.col('transaction_error_code').alias('error_code')
+    )
+
+@profiled('analysis')
+def calculate_polars_metrics(orders: pd.DataFrame, transactions: pd.DataFrame, chargebacks: pd.DataFrame) -> dict:
+    """
+    Calculate the key business metrics on the polars backend. The validated datasets are normalized,
+    matched and aggregated by a multithreaded lazy query, and the metrics are calculated from the aggregate
+    the way the pandas backend calculates them.
+
+    :param orders: The DataFrame containing validated orders data.
+    :type orders: pd.DataFrame
+    :param transactions: The DataFrame containing validated transactions data.
+    :type transactions: pd.DataFrame
+    :param chargebacks: The DataFrame containing validated chargebacks data.
+    :type chargebacks: pd.DataFrame
+    :return: Dictionary with key business metrics.
+    :rtype: dict
+    """
+
+    logger.info("Starting calculating the business metrics on the polars backend")
+
+    try:
+        with log_indent():
+            orders = normalize_frame(to_polars(orders, 'orders'), 'orders')
+            transactions = normalize_frame(to_polars(transactions, 'transactions'), 'transactions')
+            chargebacks = normalize_frame(to_polars(chargebacks, 'chargebacks'), 'chargebacks')
+
+            # Both queries are collected together, so the joins they share run once
+            merged = match_frames(orders, transactions, chargebacks)
+            aggregates, entries = pl.collect_all([aggregate_query(merged), breakdown_entries_query(merged)])
+
+            metrics = metrics_from_aggregates(aggregates.to_pandas())
+            metrics.update(calculate_breakdown_metrics(aggregate_breakdowns(entries.to_pandas())))
+
+        logger.info("Successfully calculated the business metrics on the polars backend")
+
+        return metrics
+
+    except Exception as e:
+        logger.error(f"Error calculating the business metrics on the polars backend: {e}")
+        raise
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from typing import Union
+from tabulate import tabulate
+from utils.logging_config import logger
+
+# The compact encoding of the columns of each normalized dataset:
+# 'category' for low cardinality enums, 'uuid' for 128-bit encoded UUIDs, 'string' for Arrow strings
+# and 'numeric' for integers downcast to the smallest lossless type (float columns, e.g. the money amounts,
+# are kept float64, the sums over float32 values drift from the float64 sums)
+COMPACT_SCHEMAS = {
+    'orders': {
+        'order_id': 'string',
+        'customer_id': 'uuid',
+        'total_amount': 'numeric',
+        'currency': 'category',
+        'payment_status': 'category'
+    },
+    'transactions': {
+        'transaction_id': 'uuid',
+        'order_id': 'string',
+        'amount': 'numeric',
+        'currency': 'category',
+        'status': 'category',
+        'payment_method.type': 'category',
+        'payment_method.provider': 'category',
+        'error_code': 'category'
+    },
+    'chargebacks': {
+        'transaction_id': 'uuid',
+        'amount': 'numeric',
+        'reason_code': 'category',
+        'status': 'category'
+    }
+}
+
+UUID_DTYPE = pd.ArrowDtype(pa.binary(16))
+UUID_LENGTH = 36
+UUID_HYPHENS = [8, 13, 18, 23]
+UUID_HEX_POSITIONS = [position for position in range(UUID_LENGTH) if position not in UUID_HYPHENS]
+
+# The value of each lowercase hex digit, 255 for any other character
+HEX_VALUES = np.full(128, 255, dtype=np.uint8)
+HEX_VALUES[np.frombuffer(b'0123456789abcdef', dtype=np.uint8)] = np.arange(16)
+HEX_DIGITS = np.frombuffer('0123456789abcdef'.encode('utf-32-le'), dtype=np.uint32)
+
+def uuid_nibbles(values: pd.Series) -> np.ndarray:
+    """
+    Get the 32 hex digit values of each canonical (lowercase, hyphenated) UUID string.
+
+    :param values: The values to parse.
+    :type values: pd.Series
+    :return: Array of the 32 digit values of each value, a row of 255 where the value is not a canonical UUID.
+    :rtype: np.ndarray
+    """
+
+    canonical = (values.map(type) == str).to_numpy() & (values.str.len() == UUID_LENGTH).to_numpy()
+    strings = np.where(canonical, values.to_numpy(dtype=object), '-' * UUID_LENGTH).astype(f'U{UUID_LENGTH}')
+    characters = strings.view(np.uint32).reshape(-1, UUID_LENGTH)
+
+    canonical &= (characters[:, UUID_HYPHENS] == ord('-')).all(axis=1)
+    digits = characters[:, UUID_HEX_POSITIONS]
+    nibbles = np.where(digits < 128, HEX_VALUES[np.minimum(digits, 127)], 255)
+    canonical &= (nibbles != 255).all(axis=1)
+    nibbles[~canonical] = 255
+
+    return nibbles
+
+def encode_uuids(values: pd.Series) -> pd.Series:
+    """
+    Encode canonical UUID strings to 128-bit binary values, anything else is encoded as a missing value.
+
+    :param values: The UUID strings.
+    :type values: pd.Series
+    :return: Series of 16 byte values.
+    :rtype: pd.Series
+    """
+
+    nibbles = uuid_nibbles(values)
+    canonical = (nibbles != 255).all(axis=1)
+    uuid_bytes = (nibbles[:, 0::2] << 4) | nibbles[:, 1::2]
+
+    validity = pa.array(canonical).buffers()[1] if not canonical.all() else None
+    array = pa.FixedSizeBinaryArray.from_buffers(pa.binary(16), len(values),
+                                                 [validity, pa.py_buffer(uuid_bytes.astype(np.uint8).tobytes())])
+
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=values.index, name=values.name)
+
+def decode_uuids(values: pd.Series) -> pd.Series:
+    """
+    Decode 128-bit binary values back to canonical UUID strings.
+
+    :param values: Series of 16 byte values.
+    :type values: pd.Series
+    :return: Series of the UUID strings.
+    :rtype: pd.Series
+    """
+
+    array = pa.array(values.array)
+    uuid_bytes = np.frombuffer(array.buffers()[1], dtype=np.uint8)[array.offset * 16:(array.offset + len(array)) * 16]
+    uuid_bytes = uuid_bytes.reshape(-1, 16)
+
+    characters = np.full((len(values), UUID_LENGTH), ord('-'), dtype=np.uint32)
+    characters[:, UUID_HEX_POSITIONS[0::2]] = HEX_DIGITS[uuid_bytes >> 4]
+    characters[:, UUID_HEX_POSITIONS[1::2]] = HEX_DIGITS[uuid_bytes & 15]
+
+    strings = pd.Series(characters.view(f'U{UUID_LENGTH}').ravel(), index=values.index, name=values.name, dtype=object)
+
+    return strings.where(values.notna().to_numpy(), None)
+
+def encode_like(values: pd.Series, column: Union[pd.Series, pd.Index]) -> pd.Series:
+    """
+    Encode values the way a column is encoded, so they can be compared or joined with it.
+
+    :param values: The values to encode.
+    :type values: pd.Series
+    :param column: The column or index whose encoding is used.
+    :type column: Union[pd.Series, pd.Index]
+    :return: The encoded values.
+    :rtype: pd.Series
+    """
+
+    if values.dtype == column.dtype:
+        return values
+
+    if column.dtype == UUID_DTYPE:
+        return encode_uuids(values.astype(object))
+
+    if values.dtype == UUID_DTYPE:
+        return decode_uuids(values).astype(column.dtype)
+
+    return values
+
+def downcast_number(series: pd.Series) -> pd.Series:
+    """
+    Downcast an integer column to the smallest integer type that keeps all its values.
+    Float columns are not downcast, the values would survive a float32 round trip but their sums would not.
+
+    :param series: The numeric column.
+    :type series: pd.Series
+    :return: The downcast column, the original column if it is not an integer column.
+    :rtype: pd.Series
+    """
+
+    if not pd.api.types.is_integer_dtype(series):
+        return series
+
+    return pd.to_numeric(series, downcast='integer')
+
+def compact_column(series: pd.Series, encoding: str) -> pd.Series:
+    """
+    Convert a column to its compact encoding.
+
+    :param series: The column to convert.
+    :type series: pd.Series
+    :param encoding: 'category', 'uuid', 'string' or 'numeric'.
+    :type encoding: str
+    :return: The converted column.
+    :rtype: pd.Series
+    """
+
+    # Categories save memory only when the values repeat, high cardinality columns are kept as Arrow strings
+    if encoding == 'category':
+        if series.nunique() <= len(series) // 2:
+            return series.astype('category')
+
+        return series.astype('string[pyarrow]')
+
+    if encoding == 'uuid':
+        encoded = encode_uuids(series)
+
+        # A column with a value that is not a canonical UUID is kept as strings so no value is lost
+        if encoded.isna().to_numpy().sum() == series.isna().sum():
+            return encoded
+
+        return series.astype('string[pyarrow]')
+
+    if encoding == 'string':
+        return series.astype('string[pyarrow]')
+
+    if encoding == 'numeric' and pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return downcast_number(series)
+
+    return series
+
+def compact_frame(df: pd.DataFrame, dataset: str) -> pd.DataFrame:
+    """
+    Convert the columns of a normalized dataset to their compact encoding and log the bytes saved per column.
+
+    :param df: The normalized DataFrame.
+    :type df: pd.DataFrame
+    :param dataset: The name of the dataset - 'orders', 'transactions' or 'chargebacks'.
+    :type dataset: str
+    :return: The compact DataFrame.
+    :rtype: pd.DataFrame
+    """
+
+    original_bytes = df.memory_usage(deep=True, index=False)
+
+    compact_df = df.assign(**{column: compact_column(df[column], encoding)
+                              for column, encoding in COMPACT_SCHEMAS[dataset].items() if column in df.columns})
+
+    logger.info(f"Compact {dataset} schema:\n" + tabulate(memory_report(original_bytes, compact_df), headers='keys',
+                                                           tablefmt='simple', showindex=False))
+
+    return compact_df
+
+def memory_report(original_bytes: pd.Series, compact_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Report the bytes saved by the compact encoding of each column.
+
+    :param original_bytes: The memory usage of each column before the conversion.
+    :type original_bytes: pd.Series
+    :param compact_df: The compact DataFrame.
+    :type compact_df: pd.DataFrame
+    :return: DataFrame with the original, compact and saved bytes and the type of each column, and a total row.
+    :rtype: pd.DataFrame
+    """
+
+    compact_bytes = compact_df.memory_usage(deep=True, index=False)
+
+    report = pd.DataFrame({
+        'column': list(compact_df.columns) + ['total'],
+        'dtype': [str(dtype) for dtype in compact_df.dtypes] + [''],
+        'original_bytes': list(original_bytes) + [original_bytes.sum()],
+        'compact_bytes': list(compact_bytes) + [compact_bytes.sum()]
+    })
+    report['saved_bytes'] = report['original_bytes'] - report['compact_bytes']
+
+    return report
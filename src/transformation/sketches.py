@@ -0,0 +1,421 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import (SKETCH_HLL_PRECISION, SKETCH_QUANTILE_ACCURACY, SKETCH_COUNT_MIN_WIDTH,
+                              SKETCH_COUNT_MIN_DEPTH, SKETCH_TOP_K)
+from src.transformation.schema import UUID_DTYPE, decode_uuids
+from src.transformation.timeseries import AMOUNT_SCALE, bucket_keys
+from src.transformation.fx import FxRates, convert_amounts, load_fx_rates
+
+# The sketches are kept for each payment method and day, so the sketches of any range of days can be merged
+SKETCH_KEYS = ['payment_method.type', 'day']
+
+# The quantile sketch counts the amounts in buckets of the logarithm of the amount in base gamma, so the value of
+# each bucket is within the relative accuracy of its amounts. The buckets cover the amounts from the minor currency
+# unit to a billion, the amounts outside of them are counted in the first or the last bucket
+QUANTILE_GAMMA = (1 + SKETCH_QUANTILE_ACCURACY) / (1 - SKETCH_QUANTILE_ACCURACY)
+QUANTILE_FIRST_INDEX = int(np.ceil(np.log(1 / AMOUNT_SCALE) / np.log(QUANTILE_GAMMA)))
+QUANTILE_LAST_INDEX = int(np.ceil(np.log(10 ** 9) / np.log(QUANTILE_GAMMA)))
+QUANTILE_VALUES = 2 * QUANTILE_GAMMA ** np.arange(QUANTILE_FIRST_INDEX, QUANTILE_LAST_INDEX + 1) / (QUANTILE_GAMMA + 1)
+
+# The column counted by each count-min sketch, and the name of its values in the top lists
+COUNTED_COLUMNS = {'providers': 'payment_method.provider', 'error_codes': 'error_code'}
+COUNTED_NAMES = {'providers': 'provider', 'error_codes': 'error_code'}
+
+class Sketches(NamedTuple):
+    # The mergeable sketches of each group of the sketch keys, a row of each array per group:
+    # the HyperLogLog registers of the customers and the orders, the bucket counts of the amount quantiles,
+    # the count-min counters of the providers and the error codes, and the top candidates of each counted column
+    groups: pd.DataFrame
+    customers: np.ndarray
+    orders: np.ndarray
+    amounts: np.ndarray
+    providers: np.ndarray
+    error_codes: np.ndarray
+    candidates: pd.DataFrame
+
+def hash_values(values: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hash values to 64-bit integers, the same value is hashed the same way whatever its encoding,
+    so the sketches of the compact and the original schemas can be merged.
+
+    :param values: The values to hash.
+    :type values: pd.Series
+    :return: The hash of each value, and whether each value is not missing.
+    :rtype: Tuple[np.ndarray, np.ndarray]
+    """
+
+    if values.dtype == UUID_DTYPE:
+        values = decode_uuids(values)
+
+    valid = values.notna().to_numpy()
+    hashes = pd.util.hash_array(values.to_numpy(dtype=object, na_value=''))
+
+    return hashes, valid
+
+def hll_registers(group_rows: np.ndarray, hashes: np.ndarray, group_count: int,
+                  precision: int = SKETCH_HLL_PRECISION) -> np.ndarray:
+    """
+    Build the HyperLogLog registers of each group. The first bits of a hash select its register,
+    which keeps the maximal rank of the remaining bits - the position of their first set bit.
+
+    :param group_rows: The group of each hash.
+    :type group_rows: np.ndarray
+    :param hashes: The hashes of the counted values.
+    :type hashes: np.ndarray
+    :param group_count: The number of groups.
+    :type group_count: int
+    :param precision: The number of bits selecting the register, each group has 2 ** precision registers.
+    :type precision: int
+    :return: The registers of each group.
+    :rtype: np.ndarray
+    """
+
+    registers = np.zeros((group_count, 1 << precision), dtype=np.uint8)
+
+    positions = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    remainders = hashes & np.uint64((1 << (64 - precision)) - 1)
+
+    # The bit length of the remainders is the exponent of their float value, exact below 2 ** 53
+    bit_lengths = np.frexp(remainders.astype(float))[1]
+    ranks = (64 - precision - bit_lengths + 1).astype(np.uint8)
+
+    np.maximum.at(registers, (group_rows, positions), ranks)
+
+    return registers
+
+def hll_estimates(registers: np.ndarray) -> np.ndarray:
+    """
+    Estimate the number of distinct values of each group from its HyperLogLog registers,
+    counting the empty registers instead for the small counts.
+
+    :param registers: The registers of each group.
+    :type registers: np.ndarray
+    :return: The estimated number of distinct values of each group.
+    :rtype: np.ndarray
+    """
+
+    register_count = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / register_count)
+
+    estimates = alpha * register_count ** 2 / np.exp2(-registers.astype(float)).sum(axis=1)
+    empty = (registers == 0).sum(axis=1)
+
+    small = (estimates <= 2.5 * register_count) & (empty > 0)
+    estimates[small] = register_count * np.log(register_count / empty[small])
+
+    return np.round(estimates).astype(np.int64)
+
+def quantile_counts(group_rows: np.ndarray, amounts: np.ndarray, group_count: int) -> np.ndarray:
+    """
+    Count the amounts of each group in the buckets of the quantile sketch.
+
+    :param group_rows: The group of each amount.
+    :type group_rows: np.ndarray
+    :param amounts: The amounts.
+    :type amounts: np.ndarray
+    :param group_count: The number of groups.
+    :type group_count: int
+    :return: The bucket counts of each group.
+    :rtype: np.ndarray
+    """
+
+    bucket_count = len(QUANTILE_VALUES)
+    indexes = np.ceil(np.log(np.maximum(amounts, 1 / AMOUNT_SCALE)) / np.log(QUANTILE_GAMMA)).astype(np.int64)
+    buckets = np.clip(indexes - QUANTILE_FIRST_INDEX, 0, bucket_count - 1)
+
+    counts = np.bincount(group_rows * bucket_count + buckets, minlength=group_count * bucket_count)
+
+    return counts.reshape(group_count, bucket_count)
+
+def quantile_estimates(counts: np.ndarray, quantile: float) -> np.ndarray:
+    """
+    Estimate a quantile of the amounts of each group from its bucket counts.
+
+    :param counts: The bucket counts of each group.
+    :type counts: np.ndarray
+    :param quantile: The quantile, between 0 and 1.
+    :type quantile: float
+    :return: The estimated quantile of each group, NaN for a group without amounts.
+    :rtype: np.ndarray
+    """
+
+    cumulative_counts = np.cumsum(counts, axis=1)
+    totals = cumulative_counts[:, -1]
+
+    # The bucket of the amount of the quantile rank is the first one whose cumulative count is above the rank
+    ranks = quantile * np.maximum(totals - 1, 0)
+    buckets = np.minimum((cumulative_counts <= ranks[:, None]).sum(axis=1), counts.shape[1] - 1)
+
+    return np.where(totals > 0, np.round(QUANTILE_VALUES[buckets], 2), np.nan)
+
+def count_min_columns(hashes: np.ndarray, depth: int = SKETCH_COUNT_MIN_DEPTH,
+                      width: int = SKETCH_COUNT_MIN_WIDTH) -> np.ndarray:
+    """
+    Get the counter column of each hash in each row of a count-min sketch, from the two halves of the hash.
+
+    :param hashes: The hashes of the counted values.
+    :type hashes: np.ndarray
+    :param depth: The number of rows of the sketch.
+    :type depth: int
+    :param width: The number of counters in each row.
+    :type width: int
+    :return: The column of each hash in each row.
+    :rtype: np.ndarray
+    """
+
+    low = (hashes & np.uint64(0xffffffff)).astype(np.int64)
+    high = (hashes >> np.uint64(32)).astype(np.int64) | 1
+
+    return (low[:, None] + np.arange(depth)[None, :] * high[:, None]) % width
+
+def count_min_counters(group_rows: np.ndarray, columns: np.ndarray, group_count: int) -> np.ndarray:
+    """
+    Count the values of each group in a count-min sketch.
+
+    :param group_rows: The group of each value.
+    :type group_rows: np.ndarray
+    :param columns: The counter column of each value in each row of the sketch.
+    :type columns: np.ndarray
+    :param group_count: The number of groups.
+    :type group_count: int
+    :return: The counters of each group, a row of the sketch per hash.
+    :rtype: np.ndarray
+    """
+
+    depth, width = columns.shape[1], SKETCH_COUNT_MIN_WIDTH
+    counters = (group_rows[:, None] * depth + np.arange(depth)[None, :]) * width + columns
+
+    return np.bincount(counters.ravel(), minlength=group_count * depth * width).reshape(group_count, depth, width)
+
+def count_min_estimates(counters: np.ndarray, group_rows: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """
+    Estimate the count of values in their groups, the minimal counter of each value over the rows of the sketch.
+
+    :param counters: The counters of each group.
+    :type counters: np.ndarray
+    :param group_rows: The group of each value.
+    :type group_rows: np.ndarray
+    :param columns: The counter column of each value in each row of the sketch.
+    :type columns: np.ndarray
+    :return: The estimated count of each value, never below its count.
+    :rtype: np.ndarray
+    """
+
+    return counters[group_rows[:, None], np.arange(columns.shape[1])[None, :], columns].min(axis=1)
+
+def top_candidates(candidates: pd.DataFrame, counters: Dict[str, np.ndarray], top_k: int = SKETCH_TOP_K) -> pd.DataFrame:
+    """
+    Keep the top_k candidate values of each group and counted column with the largest estimated counts.
+
+    :param candidates: DataFrame with the group, the counted column ('sketch') and the value of each candidate.
+    :type candidates: pd.DataFrame
+    :param counters: The count-min counters of each counted column.
+    :type counters: Dict[str, np.ndarray]
+    :param top_k: The number of values kept in each group.
+    :type top_k: int
+    :return: The top candidates of each group and counted column with their estimated count.
+    :rtype: pd.DataFrame
+    """
+
+    counts = np.zeros(len(candidates), dtype=np.int64)
+
+    for sketch, sketch_counters in counters.items():
+        rows = (candidates['sketch'] == sketch).to_numpy()
+        hashes, _ = hash_values(candidates['value'][rows])
+        counts[rows] = count_min_estimates(sketch_counters, candidates['group'].to_numpy()[rows],
+                                           count_min_columns(hashes))
+
+    candidates = candidates.assign(count=counts).sort_values(['group', 'sketch', 'count', 'value'],
+                                                             ascending=[True, True, False, True])
+
+    return candidates.groupby(['group', 'sketch'], sort=False).head(top_k).reset_index(drop=True)
+
+@profiled('analysis')
+def sketch_transactions(transactions: pd.DataFrame, customer_ids: pd.Series,
+                        fx_rates: Optional[FxRates] = None) -> Sketches:
+    """
+    Build the sketches of each payment method and day in a single pass over the transactions:
+    the distinct customers and orders, the quantiles of the amounts in the reporting currency,
+    and the counts of the providers and of the error codes of the failed transactions.
+
+    :param transactions: The DataFrame containing normalized transaction data.
+    :type transactions: pd.DataFrame
+    :param customer_ids: The customer id of the order of each transaction.
+    :type customer_ids: pd.Series
+    :param fx_rates: The FX rates of each day, loaded if not given.
+    :type fx_rates: Optional[FxRates]
+    :return: The sketches of each payment method and day.
+    :rtype: Sketches
+    """
+
+    logger.info(f"Starting sketching {len(transactions)} transactions")
+
+    try:
+        if fx_rates is None:
+            fx_rates = load_fx_rates()
+
+        valid = transactions['timestamp'].notna().to_numpy()
+        transactions = transactions[valid]
+        customer_ids = customer_ids[valid]
+
+        keys = pd.DataFrame({
+            'payment_method.type': transactions['payment_method.type'].to_numpy(dtype=object),
+            'day': bucket_keys(transactions['timestamp'], 'day')
+        })
+        group_rows = keys.groupby(SKETCH_KEYS, sort=False, dropna=False).ngroup().to_numpy()
+        groups = keys.drop_duplicates().reset_index(drop=True)
+
+        def registers(values):
+            hashes, present = hash_values(values)
+            return hll_registers(group_rows[present], hashes[present], len(groups))
+
+        amounts = convert_amounts(fx_rates, transactions['timestamp'], transactions['currency'],
+                                  transactions['amount'].to_numpy())
+
+        # Only the error codes of the failed transactions are counted
+        counted = {
+            'providers': transactions['payment_method.provider'],
+            'error_codes': transactions['error_code'].where((transactions['status'] == 'failed').to_numpy())
+        }
+        counters, candidates = {}, []
+
+        for sketch, values in counted.items():
+            hashes, present = hash_values(values)
+            counters[sketch] = count_min_counters(group_rows[present], count_min_columns(hashes[present]), len(groups))
+            candidates.append(pd.DataFrame({'group': group_rows[present], 'sketch': sketch,
+                                            'value': values[present].to_numpy(dtype=object)}).drop_duplicates())
+
+        sketches = Sketches(
+            groups=groups,
+            customers=registers(customer_ids),
+            orders=registers(transactions['order_id']),
+            amounts=quantile_counts(group_rows, amounts, len(groups)),
+            providers=counters['providers'],
+            error_codes=counters['error_codes'],
+            candidates=top_candidates(pd.concat(candidates, ignore_index=True), counters)
+        )
+
+        logger.info(f"Successfully sketched the transactions of {len(groups)} payment methods and days")
+
+        return sketches
+
+    except Exception as e:
+        logger.error(f"Error sketching the transactions: {e}")
+        raise
+
+def combine_groups(sketches: Sketches, keys: pd.DataFrame) -> Sketches:
+    """
+    Combine the sketches of the groups with the same key into a single sketch of each key.
+    The HyperLogLog registers are combined by their maximum, the counts by their sum.
+
+    :param sketches: The sketches.
+    :type sketches: Sketches
+    :param keys: The key of each group of the sketches.
+    :type keys: pd.DataFrame
+    :return: The sketches of each key.
+    :rtype: Sketches
+    """
+
+    group_rows = keys.groupby(list(keys.columns), sort=False, dropna=False).ngroup().to_numpy()
+    groups = keys.drop_duplicates().reset_index(drop=True)
+
+    def combine(values, ufunc):
+        combined = np.zeros((len(groups),) + values.shape[1:], dtype=values.dtype)
+        ufunc.at(combined, group_rows, values)
+        return combined
+
+    counters = {'providers': combine(sketches.providers, np.add), 'error_codes': combine(sketches.error_codes, np.add)}
+
+    # The candidates of the combined groups compete on their counts in the combined counters
+    candidates = sketches.candidates.assign(group=group_rows[sketches.candidates['group'].to_numpy()])
+    candidates = candidates.drop_duplicates(subset=['group', 'sketch', 'value'])
+
+    return Sketches(
+        groups=groups,
+        customers=combine(sketches.customers, np.maximum),
+        orders=combine(sketches.orders, np.maximum),
+        amounts=combine(sketches.amounts, np.add),
+        providers=counters['providers'],
+        error_codes=counters['error_codes'],
+        candidates=top_candidates(candidates, counters)
+    )
+
+@profiled('analysis')
+def merge_sketches(sketches: Iterable[Sketches]) -> Sketches:
+    """
+    Merge partial sketches, e.g. of the chunks of the transactions, to a single sketch of each payment method and day.
+
+    :param sketches: The partial sketches to merge.
+    :type sketches: Iterable[Sketches]
+    :return: The merged sketches.
+    :rtype: Sketches
+    """
+
+    sketches = list(sketches)
+    offsets = np.cumsum([0] + [len(partial.groups) for partial in sketches[:-1]])
+
+    stacked = Sketches(
+        groups=pd.concat([partial.groups for partial in sketches], ignore_index=True),
+        **{field: np.concatenate([getattr(partial, field) for partial in sketches])
+           for field in ['customers', 'orders', 'amounts', 'providers', 'error_codes']},
+        candidates=pd.concat([partial.candidates.assign(group=partial.candidates['group'] + offset)
+                              for partial, offset in zip(sketches, offsets)], ignore_index=True)
+    )
+
+    return combine_groups(stacked, stacked.groups)
+
+@profiled('analysis')
+def calculate_approximate_metrics(sketches: Sketches) -> pd.DataFrame:
+    """
+    Calculate the approximate metrics of each payment method from the sketches of its days, with their error bounds:
+    the standard error of the distinct counts, the relative accuracy of the amount quantiles,
+    and the maximal overestimate of the top counts with a probability of 1 - e ** -SKETCH_COUNT_MIN_DEPTH.
+
+    :param sketches: The sketches of each payment method and day.
+    :type sketches: Sketches
+    :return: DataFrame with the approximate metrics of each payment method.
+    :rtype: pd.DataFrame
+    """
+
+    logger.info("Starting calculating the approximate metrics")
+
+    try:
+        combined = combine_groups(sketches, sketches.groups[['payment_method.type']])
+
+        def top_values(sketch):
+            candidates = combined.candidates[combined.candidates['sketch'] == sketch]
+            top = {group: [{COUNTED_NAMES[sketch]: value, 'count': int(count)}
+                           for value, count in zip(rows['value'], rows['count'])]
+                   for group, rows in candidates.groupby('group')}
+            return [top.get(group, []) for group in range(len(combined.groups))]
+
+        def count_error(counters):
+            # Each counter overestimates a count by at most e / width of the counted values
+            return np.ceil(np.e / SKETCH_COUNT_MIN_WIDTH * counters[:, 0, :].sum(axis=1)).astype(np.int64)
+
+        approximate_metrics = pd.DataFrame({
+            'payment_method.type': combined.groups['payment_method.type'],
+            'transactions': combined.amounts.sum(axis=1),
+            'distinct_customers': hll_estimates(combined.customers),
+            'distinct_orders': hll_estimates(combined.orders),
+            'median_amount': quantile_estimates(combined.amounts, 0.5),
+            'p95_amount': quantile_estimates(combined.amounts, 0.95),
+            'top_providers': top_values('providers'),
+            'top_error_codes': top_values('error_codes'),
+            'distinct_error_pct': round(104 / np.sqrt(combined.customers.shape[1]), 2),
+            'quantile_error_pct': round(SKETCH_QUANTILE_ACCURACY * 100, 2),
+            'provider_count_error': count_error(combined.providers),
+            'error_code_count_error': count_error(combined.error_codes)
+        })
+        approximate_metrics = approximate_metrics.sort_values('payment_method.type').reset_index(drop=True)
+
+        logger.info(f"Successfully calculated the approximate metrics of {len(approximate_metrics)} payment methods")
+
+        return approximate_metrics
+
+    except Exception as e:
+        logger.error(f"Error calculating the approximate metrics: {e}")
+        raise
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import PRECISION_LIMIT, TIME_SERIES_GRANULARITY, ROLLING_WINDOWS
+
+# Amounts are summed as integers in hundredths of the currency unit, so merging partial sums is exact.
+# The scale is fixed, PRECISION_LIMIT only rounds the formatted metrics
+AMOUNT_DECIMALS = 2
+AMOUNT_SCALE = 10 ** AMOUNT_DECIMALS
+
+NANOSECONDS_PER_DAY = 24 * 3600 * 10 ** 9
+
+# The length of the buckets of each granularity, and their offset from the epoch - the weeks start on Monday
+BUCKET_NANOSECONDS = {'hour': 3600 * 10 ** 9, 'day': NANOSECONDS_PER_DAY, 'week': 7 * NANOSECONDS_PER_DAY}
+BUCKET_OFFSETS = {'hour': 0, 'day': 0, 'week': 4 * NANOSECONDS_PER_DAY}
+BUCKET_FORMATS = {'hour': '%Y-%m-%d %H:00', 'day': '%Y-%m-%d', 'week': '%Y-%m-%d'}
+
+def rolling_windows(granularity: str = TIME_SERIES_GRANULARITY, windows: List[int] = ROLLING_WINDOWS) -> Dict[int, int]:
+    """
+    Get the number of buckets of each rolling window, keyed by the days the buckets actually cover.
+    A window is rounded down to whole buckets and to at least one bucket, e.g. 30 days are 4 weeks, named 28 days.
+
+    :param granularity: 'hour', 'day' or 'week'.
+    :type granularity: str
+    :param windows: The lengths of the rolling windows in days.
+    :type windows: List[int]
+    :return: Dictionary of the covered days of each window to its number of buckets, in the order of the windows.
+    :rtype: Dict[int, int]
+    :raises ValueError: If the granularity is not supported, or two windows cover the same buckets.
+    """
+
+    if granularity not in BUCKET_NANOSECONDS:
+        raise ValueError(f"Unsupported time series granularity: {granularity}")
+
+    buckets = {}
+    for days in windows:
+        window = max(days * NANOSECONDS_PER_DAY // BUCKET_NANOSECONDS[granularity], 1)
+        covered_days = window * BUCKET_NANOSECONDS[granularity] // NANOSECONDS_PER_DAY
+
+        if covered_days in buckets:
+            raise ValueError(f"The rolling windows {windows} cover the same {covered_days} days by {granularity}")
+
+        buckets[covered_days] = window
+
+    return buckets
+
+def check_time_series_settings(aggregated: bool, granularity: str = TIME_SERIES_GRANULARITY,
+                               windows: List[int] = ROLLING_WINDOWS) -> None:
+    """
+    Check the time series settings before any stage runs, so an unsupported setting fails before the work is done.
+
+    :param aggregated: Whether the metrics are calculated from the daily aggregates, as all the engines and
+        execution modes but the in-memory reference engine do.
+    :type aggregated: bool
+    :param granularity: 'hour', 'day' or 'week'.
+    :type granularity: str
+    :param windows: The lengths of the rolling windows in days.
+    :type windows: List[int]
+    :return: None
+    :rtype: None
+    :raises ValueError: If the settings are not supported.
+    """
+
+    try:
+        rolling_windows(granularity, windows)
+
+        # The aggregates are daily, the hourly time series needs the transactions
+        if granularity == 'hour' and aggregated:
+            raise ValueError("The hourly time series needs the in-memory pipeline with METRICS_ENGINE=reference "
+                             "and DATAFRAME_BACKEND=pandas")
+
+    except ValueError as e:
+        logger.error(f"Invalid time series settings: {e}")
+        raise
+
+def bucket_keys(timestamps: pd.Series, granularity: str = 'day') -> np.ndarray:
+    """
+    Get the integer key of the hour, day or week of each timestamp, the number of buckets since the epoch.
+    The keys are calculated from the timestamp integers, without formatting them.
+
+    :param timestamps: The timestamps, without missing values.
+    :type timestamps: pd.Series
+    :param granularity: 'hour', 'day' or 'week'.
+    :type granularity: str
+    :return: The bucket keys.
+    :rtype: np.ndarray
+    """
+
+    nanoseconds = np.asarray(timestamps, dtype='datetime64[ns]').view(np.int64)
+
+    return (nanoseconds - BUCKET_OFFSETS[granularity]) // BUCKET_NANOSECONDS[granularity]
+
+def bucket_starts(keys: np.ndarray, granularity: str = 'day') -> pd.DatetimeIndex:
+    """
+    Get the start time of each bucket key.
+
+    :param keys: The bucket keys.
+    :type keys: np.ndarray
+    :param granularity: 'hour', 'day' or 'week'.
+    :type granularity: str
+    :return: The bucket start times.
+    :rtype: pd.DatetimeIndex
+    """
+
+    nanoseconds = np.asarray(keys, dtype=np.int64) * BUCKET_NANOSECONDS[granularity] + BUCKET_OFFSETS[granularity]
+
+    return pd.DatetimeIndex(nanoseconds.astype('datetime64[ns]'))
+
+def rolling_sums(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Sum the trailing window of each bucket from the prefix sums of the consecutive buckets,
+    so each window is a single subtraction whatever its length.
+
+    :param values: The values of the consecutive buckets.
+    :type values: np.ndarray
+    :param window: The number of buckets in each window.
+    :type window: int
+    :return: The sum of each bucket and the window - 1 buckets before it.
+    :rtype: np.ndarray
+    """
+
+    prefix_sums = np.concatenate([np.zeros(1, dtype=values.dtype), np.cumsum(values)])
+    ends = np.arange(1, len(values) + 1)
+
+    return prefix_sums[ends] - prefix_sums[np.maximum(ends - window, 0)]
+
+@profiled('analysis')
+def calculate_time_series(timestamps: pd.Series, status: pd.Series, disputed: np.ndarray, counts: np.ndarray,
+                          amounts: np.ndarray, granularity: str = TIME_SERIES_GRANULARITY,
+                          windows: List[int] = ROLLING_WINDOWS) -> pd.DataFrame:
+    """
+    Calculate the volume and value of the completed transactions and the chargeback rate of each hour, day or week,
+    and over the rolling windows of days ending in each of them. The rows are transactions or aggregates of them.
+
+    :param timestamps: The timestamp of each row.
+    :type timestamps: pd.Series
+    :param status: The transaction status of each row.
+    :type status: pd.Series
+    :param disputed: Whether the transactions of each row have a chargeback.
+    :type disputed: np.ndarray
+    :param counts: The number of transactions of each row.
+    :type counts: np.ndarray
+    :param amounts: The amount of each row in the minor currency unit, the sums of each bucket are rounded.
+    :type amounts: np.ndarray
+    :param granularity: 'hour', 'day' or 'week'.
+    :type granularity: str
+    :param windows: The lengths of the rolling windows in days, rounded to whole buckets.
+        The window columns are named by the days they cover, see rolling_windows.
+    :type windows: List[int]
+    :return: DataFrame with the metrics of each bucket with transactions, from the earliest.
+    :rtype: pd.DataFrame
+    """
+
+    logger.info(f"Starting calculating the time series metrics by {granularity}")
+
+    try:
+        valid = timestamps.notna().to_numpy()
+        keys = bucket_keys(timestamps[valid], granularity)
+        window_buckets = rolling_windows(granularity, windows)
+        columns = [granularity, 'volume', 'value', 'chargeback_rate']
+        columns += [f"{metric}_{days}d" for days in window_buckets for metric in ['volume', 'value', 'chargeback_rate']]
+
+        if len(keys) == 0:
+            return pd.DataFrame(columns=columns)
+
+        # The buckets are consecutive from the earliest one, the empty buckets are part of the windows
+        first_key = keys.min()
+        positions = keys - first_key
+        bucket_count = int(positions.max()) + 1
+
+        completed = (status[valid] == 'completed').to_numpy()
+        counts = np.asarray(counts, dtype=np.int64)[valid]
+        amounts = np.asarray(amounts, dtype=float)[valid]
+        disputed = np.asarray(disputed, dtype=bool)[valid]
+
+        def bucket_sums(weights):
+            return np.round(np.bincount(positions, weights=weights, minlength=bucket_count)).astype(np.int64)
+
+        sums = {
+            'transactions': bucket_sums(counts),
+            'chargebacks': bucket_sums(np.where(disputed, counts, 0)),
+            'volume': bucket_sums(np.where(completed, counts, 0)),
+            'value': bucket_sums(np.where(completed, amounts, 0))
+        }
+
+        def chargeback_rate(chargebacks, transactions):
+            rate = np.divide(chargebacks * 100, transactions, out=np.zeros(len(transactions)), where=transactions > 0)
+            return np.round(rate, PRECISION_LIMIT)
+
+        series = pd.DataFrame({
+            granularity: bucket_starts(first_key + np.arange(bucket_count), granularity).strftime(
+                BUCKET_FORMATS[granularity]),
+            'volume': sums['volume'],
+            'value': np.round(sums['value'] / AMOUNT_SCALE, PRECISION_LIMIT),
+            'chargeback_rate': chargeback_rate(sums['chargebacks'], sums['transactions'])
+        })
+
+        for days, window in window_buckets.items():
+            window_sums = {name: rolling_sums(values, window) for name, values in sums.items()}
+
+            series[f"volume_{days}d"] = window_sums['volume']
+            series[f"value_{days}d"] = np.round(window_sums['value'] / AMOUNT_SCALE, PRECISION_LIMIT)
+            series[f"chargeback_rate_{days}d"] = chargeback_rate(window_sums['chargebacks'],
+                                                                 window_sums['transactions'])
+
+        # Only the buckets with transactions are returned, the empty ones only count in the windows
+        series = series[sums['transactions'] > 0].reset_index(drop=True)
+
+        logger.info(f"Successfully calculated the time series metrics of {len(series)} buckets")
+
+        return series[columns]
+
+    except Exception as e:
+        logger.error(f"Error calculating the time series metrics: {e}")
+        raise
@@ -1,7 +1,17 @@
 from pydantic import BaseModel, ValidationError, field_validator, model_validator, Field
-from typing import Literal
+from typing import Dict, Literal, Tuple
+import numpy as np
 import pandas as pd
 from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import VALIDATION_ENGINE, VALIDATION_MODE, VALIDATION_WORKERS
+from src.transformation.dates import parse_date
+from src.transformation.validations.parallel import run_partitioned
+from src.transformation.validations.quarantine import quarantine_rejections, rejected_records
+from src.transformation.validations.rules import (apply_violations, column_of, error_rules, invalid_literal,
+                                                  invalid_positive_number, invalid_str_length, invalid_timestamp,
+                                                  length_bounds, literal_values, missing_fields, split_violations,
+                                                  to_number, violated_rows)
 
 class Chargeback(BaseModel):
     transaction_id: str = Field(min_length=36, max_length=36)
@@ -42,7 +52,7 @@ class Chargeback(BaseModel):
         """
 
         try:
-            pd.to_datetime(value)
+            parse_date(value)
             return value
 
         except ValueError:
@@ -62,7 +72,7 @@ class Chargeback(BaseModel):
         """
 
         try:
-            pd.to_datetime(value)
+            parse_date(value)
             return value
 
         except ValueError:
@@ -90,34 +100,125 @@ class Chargeback(BaseModel):
         
         return values
 
-    
-def validate_chargebacks(chargebacks: pd.DataFrame) -> pd.DataFrame:
+
+def find_chargeback_violations(chargebacks: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    Check the chargebacks column-wise against the same rules the Chargeback model enforces.
+
+    :param chargebacks: DataFrame containing chargeback data.
+    :type chargebacks: pd.DataFrame
+    :return: Dictionary of rule name to violation mask, in the order the model checks them.
+    :rtype: Dict[str, pd.Series]
+    """
+
+    violations = missing_fields(chargebacks, Chargeback.model_fields)
+
+    min_length, max_length = length_bounds(Chargeback, 'transaction_id')
+    violations["transaction_id: invalid length"] = invalid_str_length(column_of(chargebacks, 'transaction_id'),
+                                                                      min_length, max_length)
+    violations["dispute_date: invalid dispute date format"] = invalid_timestamp(column_of(chargebacks, 'dispute_date'))
+    violations["amount: must be greater than 0"] = invalid_positive_number(column_of(chargebacks, 'amount'))
+
+    min_length, max_length = length_bounds(Chargeback, 'reason_code')
+    violations["reason_code: invalid length"] = invalid_str_length(column_of(chargebacks, 'reason_code'),
+                                                                   min_length, max_length)
+    violations["status: invalid value"] = invalid_literal(column_of(chargebacks, 'status'),
+                                                          literal_values(Chargeback, 'status'))
+    violations["resolution_date: invalid resolution date format"] = invalid_timestamp(
+        column_of(chargebacks, 'resolution_date'))
+
+    # The model validator only runs on chargebacks with valid fields, where both dates are strings
+    fields_valid = (~violated_rows(violations, chargebacks.index)).to_numpy()
+    dispute_after_resolution = np.zeros(len(chargebacks), dtype=bool)
+    dispute_after_resolution[fields_valid] = (column_of(chargebacks, 'dispute_date').to_numpy()[fields_valid] >
+                                              column_of(chargebacks, 'resolution_date').to_numpy()[fields_valid])
+    violations["dispute_date: must be earlier than or equal to resolution date"] = pd.Series(
+        dispute_after_resolution, index=chargebacks.index)
+
+    return violations
+
+def split_valid_chargebacks(chargebacks: pd.DataFrame, engine: str = VALIDATION_ENGINE,
+                            mode: str = VALIDATION_MODE) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate the chargebacks and split them to the validated chargebacks and the quarantine rows of the rejected chargebacks.
+
+    :param chargebacks: DataFrame containing chargeback data.
+    :type chargebacks: pd.DataFrame
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Chargeback model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid chargeback, 'collect' to reject the invalid chargebacks.
+    :type mode: str
+    :return: DataFrame containing validated chargebacks and the quarantine rows of the rejected chargebacks.
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    :raises ValueError: If any validation fails in 'fail_fast' mode, a ValidationError with the pydantic engine.
+    """
+
+    rejected_rules = pd.Series(dtype=object)
+
+    if engine == 'columnar':
+        violations = find_chargeback_violations(chargebacks)
+
+        if mode == 'collect':
+            validated_chargebacks_df, rejected_rules = split_violations(chargebacks, violations,
+                                                                        list(Chargeback.model_fields))
+        else:
+            validated_chargebacks_df = apply_violations(chargebacks, violations, 'transaction_id',
+                                                        'chargebacks with transaction id',
+                                                        list(Chargeback.model_fields))
+
+        validated_chargebacks_df['amount'] = to_number(validated_chargebacks_df['amount'])
+
+    else:
+        validated_chargebacks = []
+        rejected_chargebacks = {}
+        chargebacks_list = chargebacks.to_dict(orient='records')
+
+        for position, chargeback in enumerate(chargebacks_list):
+            try:
+                validated_chargeback = Chargeback(**chargeback)
+                validated_chargebacks.append(validated_chargeback.model_dump())
+
+            except ValidationError as e:
+                if mode == 'collect':
+                    rejected_chargebacks[position] = error_rules(e)
+                    continue
+
+                logger.error(f"Validation error in chargebacks with transaction id "
+                 f"{chargeback.get('transaction_id')}: {e}")
+                raise e
+
+        validated_chargebacks_df = pd.DataFrame(validated_chargebacks, columns=list(Chargeback.model_fields))
+        rejected_rules = pd.Series(rejected_chargebacks, dtype=object)
+
+    return validated_chargebacks_df, rejected_records(chargebacks, rejected_rules, 'transaction_id')
+
+@profiled('validate')
+def validate_chargebacks(chargebacks: pd.DataFrame, engine: str = VALIDATION_ENGINE, mode: str = VALIDATION_MODE,
+                         workers: int = VALIDATION_WORKERS) -> pd.DataFrame:
     """
     Validate the chargebacks data.
 
     :param chargebacks: DataFrame containing chargeback data.
     :type chargebacks: pd.DataFrame
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Chargeback model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid chargeback, 'collect' to quarantine the invalid chargebacks.
+    :type mode: str
+    :param workers: The number of worker processes validating partitions of the chargebacks.
+    :type workers: int
     :return: DataFrame containing validated chargebacks.
     :rtype: pd.DataFrame
-    :raises ValidationError: If any validation fails.
+    :raises ValueError: If any validation fails in 'fail_fast' mode, or too many rows are rejected in 'collect' mode.
     """
     
     logger.info("Validating chargeback data")
 
-    validated_chargebacks = []
-    chargebacks_list = chargebacks.to_dict(orient='records')
+    validated_chargebacks_df, rejected_chargebacks = run_partitioned(split_valid_chargebacks, [chargebacks], workers,
+                                                                     engine=engine, mode=mode)
 
-    for chargeback in chargebacks_list:
-        try:
-            validated_chargeback = Chargeback(**chargeback)
-            validated_chargebacks.append(validated_chargeback.model_dump())
-            
-        except ValidationError as e:
-            logger.error(f"Validation error in chargebacks with transaction id "
-             f"{chargeback.get('transaction_id')}: {e}")
-            raise e
-
-    logger.info(f"Validated {len(validated_chargebacks)} chargebacks successfully.")
-    validated_chargebacks_df = pd.DataFrame(validated_chargebacks)
-    
-    return validated_chargebacks_df
\ No newline at end of file
+    if mode == 'collect':
+        quarantine_rejections(rejected_chargebacks, 'chargebacks', len(chargebacks))
+
+    logger.info(f"Validated {len(validated_chargebacks_df)} chargebacks successfully.")
+
+    return validated_chargebacks_df
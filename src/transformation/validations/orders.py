@@ -1,7 +1,17 @@
 from pydantic import BaseModel, ValidationError, field_validator, model_validator, Field
-from typing import Literal, List
+from typing import Dict, Literal, List, Tuple
 import pandas as pd
 from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import VALIDATION_ENGINE, VALIDATION_MODE, VALIDATION_WORKERS
+from src.transformation.dates import parse_date
+from src.transformation.validations.parallel import run_partitioned
+from src.transformation.validations.quarantine import quarantine_rejections, rejected_records
+from src.transformation.validations.rules import (apply_violations, column_of, error_rules, field_of,
+                                                  invalid_literal, invalid_positive_int, invalid_positive_number,
+                                                  invalid_str_length, invalid_timestamp, length_bounds,
+                                                  literal_values, missing_fields, split_violations, to_number,
+                                                  violated_rows)
 
 class Item(BaseModel):
     product_id: str = Field(min_length=6, max_length=30)
@@ -30,7 +40,7 @@ class Order(BaseModel):
         """
 
         try:
-            pd.to_datetime(value)
+            parse_date(value)
 
         except ValueError:
             logger.error(f"Invalid timestamp format: {value}")
@@ -100,31 +110,162 @@ class Order(BaseModel):
 
         return values
 
-def validate_orders(orders: pd.DataFrame) -> pd.DataFrame:
+def find_item_violations(items: pd.Series) -> Tuple[Dict[str, pd.Series], pd.Series]:
+    """
+    Check the items of each order column-wise, the same way the Item model and the items validator do.
+
+    :param items: The items column of the orders.
+    :type items: pd.Series
+    :return: Dictionary of rule name to violation mask, and the sum of the item amounts of each order.
+    :rtype: Tuple[Dict[str, pd.Series], pd.Series]
+    """
+
+    items = items.reset_index(drop=True)
+    is_list = items.map(lambda value: isinstance(value, (list, tuple))).astype(bool)
+    counts = items[is_list].map(len).reindex(items.index, fill_value=0)
+
+    # One row per item, indexed by the position of its order
+    exploded = items[counts > 0].explode()
+    product_id = field_of(exploded, 'product_id')
+    quantity = field_of(exploded, 'quantity')
+    unit_price = field_of(exploded, 'unit_price')
+
+    min_length, max_length = length_bounds(Item, 'product_id')
+    item_violations = {
+        "items: invalid product id": invalid_str_length(product_id, min_length, max_length),
+        "items: invalid quantity - must be greater than 0": invalid_positive_int(quantity),
+        "items: invalid unit price - must be greater than 0": invalid_positive_number(unit_price),
+    }
+
+    violations = {"items: must be a list": ~is_list}
+    for rule, violation in item_violations.items():
+        violations[rule] = violation.groupby(level=0).any().reindex(items.index, fill_value=False)
+
+    # Sum the item amounts one item position at a time so the float additions match python's sum
+    amounts = to_number(quantity) * to_number(unit_price)
+    item_positions = amounts.groupby(level=0).cumcount()
+    items_total = pd.Series(0.0, index=items.index)
+
+    for item_position in range(int(counts.max()) if len(counts) else 0):
+        position_amounts = amounts[item_positions == item_position]
+        items_total.loc[position_amounts.index] += position_amounts.to_numpy()
+
+    return violations, items_total
+
+def find_order_violations(orders: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    Check the orders column-wise against the same rules the Order model enforces.
+
+    :param orders: The DataFrame containing orders to validate.
+    :type orders: pd.DataFrame
+    :return: Dictionary of rule name to violation mask, in the order the model checks them.
+    :rtype: Dict[str, pd.Series]
+    """
+
+    violations = missing_fields(orders, Order.model_fields)
+
+    for field in ['order_id', 'customer_id']:
+        min_length, max_length = length_bounds(Order, field)
+        violations[f"{field}: invalid length"] = invalid_str_length(column_of(orders, field), min_length, max_length)
+
+    violations["timestamp: invalid timestamp format"] = invalid_timestamp(column_of(orders, 'timestamp'))
+    violations["total_amount: must be greater than 0"] = invalid_positive_number(column_of(orders, 'total_amount'))
+    violations["currency: invalid value"] = invalid_literal(column_of(orders, 'currency'),
+                                                            literal_values(Order, 'currency'))
+
+    item_violations, items_total = find_item_violations(column_of(orders, 'items'))
+    for rule, violation in item_violations.items():
+        violations[rule] = pd.Series(violation.to_numpy(), index=orders.index)
+
+    violations["payment_status: invalid value"] = invalid_literal(column_of(orders, 'payment_status'),
+                                                                  literal_values(Order, 'payment_status'))
+
+    # The model validator only runs on orders with valid fields
+    fields_valid = ~violated_rows(violations, orders.index)
+    total_amount = to_number(column_of(orders, 'total_amount'))
+    violations["total_amount: does not match sum of item amounts"] = fields_valid & (
+        items_total.round(6).to_numpy() != total_amount.to_numpy())
+
+    return violations
+
+def split_valid_orders(orders: pd.DataFrame, engine: str = VALIDATION_ENGINE,
+                       mode: str = VALIDATION_MODE) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate the orders and split them to the validated orders and the quarantine rows of the rejected orders.
+
+    :param orders: The DataFrame containing orders to validate.
+    :type orders: pd.DataFrame
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Order model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid order, 'collect' to reject the invalid orders.
+    :type mode: str
+    :return: The validated orders dataFrame and the quarantine rows of the rejected orders.
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    :raises ValueError: If any validation fails in 'fail_fast' mode, a ValidationError with the pydantic engine.
+    """
+
+    rejected_rules = pd.Series(dtype=object)
+
+    if engine == 'columnar':
+        violations = find_order_violations(orders)
+
+        if mode == 'collect':
+            validated_orders_df, rejected_rules = split_violations(orders, violations, list(Order.model_fields))
+        else:
+            validated_orders_df = apply_violations(orders, violations, 'order_id', 'order', list(Order.model_fields))
+
+        validated_orders_df['total_amount'] = to_number(validated_orders_df['total_amount'])
+
+    else:
+        validated_orders = []
+        rejected_orders = {}
+        orders_list = orders.to_dict(orient='records')
+
+        for position, order in enumerate(orders_list):
+            try:
+                validated_order = Order(**order)
+                validated_orders.append(validated_order.model_dump())
+
+            except ValidationError as e:
+                if mode == 'collect':
+                    rejected_orders[position] = error_rules(e)
+                    continue
+
+                logger.error(f"Validation error in order {order.get('order_id')}: {e}")
+                raise e
+
+        validated_orders_df = pd.DataFrame(validated_orders, columns=list(Order.model_fields))
+        rejected_rules = pd.Series(rejected_orders, dtype=object)
+
+    return validated_orders_df, rejected_records(orders, rejected_rules, 'order_id')
+
+@profiled('validate')
+def validate_orders(orders: pd.DataFrame, engine: str = VALIDATION_ENGINE, mode: str = VALIDATION_MODE,
+                    workers: int = VALIDATION_WORKERS) -> pd.DataFrame:
     """
     Validate the orders data.
 
     :param orders_df: The DataFrame containing orders to validate.
     :type orders_df: pd.DataFrame
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Order model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid order, 'collect' to quarantine the invalid orders.
+    :type mode: str
+    :param workers: The number of worker processes validating partitions of the orders.
+    :type workers: int
     :return: The validated orders dataFrame.
     :rtype: pd.DataFrame
+    :raises ValueError: If any validation fails in 'fail_fast' mode, or too many rows are rejected in 'collect' mode.
     """
 
     logger.info("Validating orders data")
-    
-    validated_orders = []
-    orders_list = orders.to_dict(orient='records')
 
-    for order in orders_list:
-        try:
-            validated_order = Order(**order)
-            validated_orders.append(validated_order.model_dump())
-            
-        except ValidationError as e:
-            logger.error(f"Validation error in order {order.get('order_id')}: {e}")
-            raise e
-
-    logger.info(f"Validated {len(validated_orders)} orders successfully.")
-    validated_orders_df = pd.DataFrame(validated_orders)
-    
-    return validated_orders_df
\ No newline at end of file
+    validated_orders_df, rejected_orders = run_partitioned(split_valid_orders, [orders], workers,
+                                                           engine=engine, mode=mode)
+
+    if mode == 'collect':
+        quarantine_rejections(rejected_orders, 'orders', len(orders))
+
+    logger.info(f"Validated {len(validated_orders_df)} orders successfully.")
+
+    return validated_orders_df
@@ -0,0 +1,56 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from utils.logging_config import logger
+from config.constants import VALIDATION_WORKERS, VALIDATION_PARTITION_MIN_ROWS
+
+def run_partitioned(validate: Callable[..., Tuple[pd.DataFrame, pd.DataFrame]],
+                    frames: Sequence[Union[pd.DataFrame, pd.Series]], workers: int = VALIDATION_WORKERS,
+                    min_rows: int = VALIDATION_PARTITION_MIN_ROWS, **kwargs) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Run a validation function on contiguous row partitions of the data across a pool of worker processes,
+    and combine the validated and rejected rows of the partitions in the original row order.
+
+    :param validate: The validation function, returning the validated rows and the rejected rows.
+    :type validate: Callable[..., Tuple[pd.DataFrame, pd.DataFrame]]
+    :param frames: The row-aligned DataFrames and series to partition and pass to the validation function.
+    :type frames: Sequence[Union[pd.DataFrame, pd.Series]]
+    :param workers: The maximal number of worker processes, 1 to validate in the current process.
+    :type workers: int
+    :param min_rows: The minimal number of rows in each partition.
+    :type min_rows: int
+    :param kwargs: Keyword arguments of the validation function.
+    :return: The validated rows and the rejected rows of all the partitions.
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    :raises Exception: The error of the first failing partition, the same error the serial validation raises.
+    """
+
+    total_rows = len(frames[0])
+    partitions = min(workers, total_rows // max(min_rows, 1))
+
+    if partitions <= 1:
+        return validate(*frames, **kwargs)
+
+    bounds = np.linspace(0, total_rows, partitions + 1).astype(int)
+    partitioned_frames = [[frame.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])] for frame in frames]
+
+    logger.info(f"Validating {total_rows} rows in {partitions} partitions")
+
+    executor = ProcessPoolExecutor(max_workers=partitions)
+
+    try:
+        # map returns the results in the partitions order, and raises the error of the first failing partition
+        results = list(executor.map(partial(validate, **kwargs), *partitioned_frames))
+
+    except Exception:
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+
+    executor.shutdown()
+
+    validated = pd.concat([validated for validated, _ in results], ignore_index=True)
+    rejected = pd.concat([rejected for _, rejected in results], ignore_index=True)
+
+    return validated, rejected
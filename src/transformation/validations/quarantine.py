@@ -0,0 +1,141 @@
+import json
+import os
+from contextlib import contextmanager
+import pandas as pd
+from utils.logging_config import logger
+from src.extraction import MalformedField
+from config.constants import QUARANTINE_DIR, QUARANTINE_FORMAT, MAX_REJECTED_RATIO
+
+# The calls, rejected rows, total rows and allowed ratio of each dataset quarantined so far,
+# while a quarantine session is open
+session_counts = None
+
+@contextmanager
+def quarantine_session():
+    """
+    Open a quarantine session, in which the quarantined rows of each dataset are appended across the calls
+    (e.g. across the chunks of a dataset) and the rejection threshold is enforced on all the rows of each dataset
+    when the session closes.
+
+    :raises ValueError: If the ratio of rejected rows of a dataset exceeds the threshold.
+    """
+
+    global session_counts
+
+    original_counts = session_counts
+    session_counts = {}
+
+    try:
+        yield session_counts
+
+        for dataset, (_, rejected_rows, total_rows, max_rejected_ratio) in session_counts.items():
+            check_rejected_ratio(dataset, rejected_rows, total_rows, max_rejected_ratio)
+
+    finally:
+        session_counts = original_counts
+
+def check_rejected_ratio(dataset: str, rejected_rows: int, total_rows: int, max_rejected_ratio: float) -> None:
+    """
+    Enforce the rejection threshold of a dataset.
+
+    :param dataset: The name of the dataset.
+    :type dataset: str
+    :param rejected_rows: The number of rejected rows.
+    :type rejected_rows: int
+    :param total_rows: The number of validated rows.
+    :type total_rows: int
+    :param max_rejected_ratio: The maximal allowed ratio of rejected rows.
+    :type max_rejected_ratio: float
+    :return: None
+    :rtype: None
+    :raises ValueError: If the ratio of rejected rows exceeds the threshold.
+    """
+
+    rejected_ratio = rejected_rows / total_rows if total_rows > 0 else 0.0
+
+    if rejected_ratio > max_rejected_ratio:
+        logger.error(f"{rejected_ratio:.4%} of the {dataset} were rejected, "
+                     f"more than the allowed {max_rejected_ratio:.4%}")
+        raise ValueError(f"{rejected_ratio:.4%} of the {dataset} were rejected, "
+                         f"more than the allowed {max_rejected_ratio:.4%}")
+
+def record_value(value):
+    """
+    Convert a record value json can't serialize, a malformed nested field is recorded as the original nested value.
+
+    :param value: The value.
+    :return: The serializable value.
+    """
+
+    return value.value if isinstance(value, MalformedField) else str(value)
+
+def rejected_records(df: pd.DataFrame, rules: pd.Series, key: str) -> pd.DataFrame:
+    """
+    Build the quarantine rows of the rejected rows - the row key, the failed rule and the full record.
+
+    :param df: The validated DataFrame.
+    :type df: pd.DataFrame
+    :param rules: The failed rules of each rejected row, indexed by the row position.
+    :type rules: pd.Series
+    :param key: The column identifying a row.
+    :type key: str
+    :return: DataFrame with the key, rule and record columns of the rejected rows.
+    :rtype: pd.DataFrame
+    """
+
+    rejected = df.iloc[rules.index]
+    records = [json.dumps(record, default=record_value) for record in rejected.to_dict(orient='records')]
+
+    return pd.DataFrame({
+        key: rejected[key].to_numpy() if key in rejected.columns else None,
+        'rule': rules.to_numpy(),
+        'record': records
+    })
+
+def quarantine_rejections(rejected: pd.DataFrame, dataset: str, total_rows: int,
+                          quarantine_dir: str = QUARANTINE_DIR, file_format: str = QUARANTINE_FORMAT,
+                          max_rejected_ratio: float = MAX_REJECTED_RATIO) -> None:
+    """
+    Write the rejected rows of a dataset to its quarantine file and enforce the rejection threshold.
+
+    :param rejected: DataFrame with the key, rule and record columns of the rejected rows.
+    :type rejected: pd.DataFrame
+    :param dataset: The name of the dataset, used as the quarantine file name.
+    :type dataset: str
+    :param total_rows: The number of validated rows.
+    :type total_rows: int
+    :param quarantine_dir: The directory of the quarantine files.
+    :type quarantine_dir: str
+    :param file_format: The quarantine file format - 'csv' or 'parquet'.
+    :type file_format: str
+    :param max_rejected_ratio: The maximal allowed ratio of rejected rows.
+    :type max_rejected_ratio: float
+    :return: None
+    :rtype: None
+    :raises ValueError: If the ratio of rejected rows exceeds the threshold, outside of a quarantine session.
+    """
+
+    os.makedirs(quarantine_dir, exist_ok=True)
+    calls = 0
+
+    # Within a session the counts accumulate and the rows of the following calls are appended
+    if session_counts is not None:
+        calls, previous_rejected, previous_total, _ = session_counts.get(dataset, (0, 0, 0, max_rejected_ratio))
+        session_counts[dataset] = (calls + 1, previous_rejected + len(rejected), previous_total + total_rows,
+                                   max_rejected_ratio)
+
+    if file_format == 'parquet':
+        # Parquet files can't be appended to, every following call of a session writes a numbered part file
+        file_name = f"{dataset}.{calls}.{file_format}" if calls else f"{dataset}.{file_format}"
+        file_path = os.path.join(quarantine_dir, file_name)
+        rejected.to_parquet(file_path, index=False)
+    else:
+        file_path = os.path.join(quarantine_dir, f"{dataset}.{file_format}")
+        rejected.to_csv(file_path, index=False, mode='a' if calls else 'w', header=not calls)
+
+    if len(rejected) > 0:
+        logger.warning(f"Quarantined {len(rejected)} invalid {dataset} to {file_path}")
+
+    # Within a session the threshold is enforced on the whole dataset when the session closes
+    if session_counts is None:
+        check_rejected_ratio(dataset, len(rejected), total_rows, max_rejected_ratio)
@@ -0,0 +1,325 @@
+from typing import Dict, Iterable, List, Tuple, Type, get_args
+from pydantic import BaseModel, ValidationError
+import numpy as np
+import pandas as pd
+from utils.logging_config import logger
+from src.extraction import MalformedField
+from src.transformation.dates import NULL_DATE_STRINGS, parse_dates
+
+
+def length_bounds(model: Type[BaseModel], field: str) -> Tuple[int, int]:
+    """
+    Get the length bounds declared on a string field of a pydantic model.
+
+    :param model: The pydantic model.
+    :type model: Type[BaseModel]
+    :param field: The field name.
+    :type field: str
+    :return: The minimal and maximal allowed lengths.
+    :rtype: Tuple[int, int]
+    """
+
+    metadata = model.model_fields[field].metadata
+    min_length = next((rule.min_length for rule in metadata if hasattr(rule, 'min_length')), 0)
+    max_length = next((rule.max_length for rule in metadata if hasattr(rule, 'max_length')), np.inf)
+
+    return min_length, max_length
+
+def literal_values(model: Type[BaseModel], field: str) -> Tuple[str, ...]:
+    """
+    Get the allowed values of a literal field of a pydantic model.
+
+    :param model: The pydantic model.
+    :type model: Type[BaseModel]
+    :param field: The field name.
+    :type field: str
+    :return: The allowed values.
+    :rtype: Tuple[str, ...]
+    """
+
+    return get_args(model.model_fields[field].annotation)
+
+def is_str(series: pd.Series) -> pd.Series:
+    """
+    Get a mask of the values that are python strings.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :return: Boolean mask, True where the value is a string.
+    :rtype: pd.Series
+    """
+
+    # Fast path - a single scan in C when the whole column holds strings
+    if pd.api.types.infer_dtype(series, skipna=False) == 'string':
+        return pd.Series(True, index=series.index)
+
+    return series.map(lambda value: isinstance(value, str)).astype(bool)
+
+def to_number(series: pd.Series) -> pd.Series:
+    """
+    Convert a column to floats the way pydantic coerces numbers, unparseable values become NaN.
+
+    :param series: The series to convert.
+    :type series: pd.Series
+    :return: The converted series.
+    :rtype: pd.Series
+    """
+
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors='coerce')
+
+    return series.astype(float)
+
+def invalid_str_length(series: pd.Series, min_length: int, max_length: int) -> pd.Series:
+    """
+    Get a mask of the values that are not strings within the length bounds.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :param min_length: The minimal allowed length.
+    :type min_length: int
+    :param max_length: The maximal allowed length.
+    :type max_length: int
+    :return: Boolean mask, True where the value is invalid.
+    :rtype: pd.Series
+    """
+
+    strings = is_str(series)
+    lengths = series.where(strings, '').astype(str).str.len()
+
+    return ~(strings & lengths.between(min_length, max_length))
+
+def invalid_literal(series: pd.Series, allowed: Iterable[str]) -> pd.Series:
+    """
+    Get a mask of the values that are not one of the allowed literals.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :param allowed: The allowed values.
+    :type allowed: Iterable[str]
+    :return: Boolean mask, True where the value is invalid.
+    :rtype: pd.Series
+    """
+
+    return ~series.isin(list(allowed))
+
+def invalid_positive_number(series: pd.Series) -> pd.Series:
+    """
+    Get a mask of the values that are not numbers greater than 0.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :return: Boolean mask, True where the value is invalid.
+    :rtype: pd.Series
+    """
+
+    numbers = to_number(series)
+    invalid = numbers <= 0
+
+    # pydantic accepts a NaN float but not a None or an unparseable value
+    if not pd.api.types.is_numeric_dtype(series):
+        is_nan = series.map(lambda value: isinstance(value, float) and value != value).astype(bool)
+        invalid |= numbers.isna() & ~is_nan
+
+    return invalid
+
+def invalid_positive_int(series: pd.Series) -> pd.Series:
+    """
+    Get a mask of the values that are not whole numbers greater than 0.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :return: Boolean mask, True where the value is invalid.
+    :rtype: pd.Series
+    """
+
+    numbers = to_number(series)
+
+    return ~((numbers > 0) & (numbers % 1 == 0))
+
+def invalid_timestamp(series: pd.Series) -> pd.Series:
+    """
+    Get a mask of the values that are not strings pandas can parse as a date.
+
+    :param series: The series to check.
+    :type series: pd.Series
+    :return: Boolean mask, True where the value is invalid.
+    :rtype: pd.Series
+    """
+
+    strings = is_str(series)
+    values = series.where(strings, None)
+
+    # The parsed values are memoized, the normalize stage only looks them up
+    unparsed = parse_dates(values).isna() & strings & ~values.isin(NULL_DATE_STRINGS)
+
+    return ~strings | unparsed
+
+def missing_fields(df: pd.DataFrame, fields: Iterable[str]) -> Dict[str, pd.Series]:
+    """
+    Get a violation for every required field that has no column in the DataFrame.
+
+    :param df: The DataFrame to check.
+    :type df: pd.DataFrame
+    :param fields: The required fields.
+    :type fields: Iterable[str]
+    :return: Dictionary of rule name to violation mask.
+    :rtype: Dict[str, pd.Series]
+    """
+
+    return {f"{field}: field required": pd.Series(True, index=df.index)
+            for field in fields if field not in df.columns}
+
+def column_of(df: pd.DataFrame, column: str) -> pd.Series:
+    """
+    Get a column of the DataFrame, a missing column is returned as a column of None values.
+
+    :param df: The DataFrame.
+    :type df: pd.DataFrame
+    :param column: The column name.
+    :type column: str
+    :return: The column series.
+    :rtype: pd.Series
+    """
+
+    if column in df.columns:
+        return df[column]
+
+    return pd.Series(None, index=df.index, dtype=object)
+
+def field_of(series: pd.Series, key: str) -> pd.Series:
+    """
+    Get a field of a column holding nested dictionaries, missing fields become None.
+
+    :param series: The series of dictionaries.
+    :type series: pd.Series
+    :param key: The field to get.
+    :type key: str
+    :return: The series of the field values.
+    :rtype: pd.Series
+    """
+
+    return series.map(lambda value: value.get(key) if isinstance(value, dict) else None)
+
+def malformed_fields(*series: pd.Series) -> pd.Series:
+    """
+    Get a mask of the rows whose nested value was malformed, i.e. any of its flattened fields is a MalformedField.
+
+    :param series: The flattened field columns.
+    :type series: pd.Series
+    :return: Boolean mask, True where a field of the nested value is malformed.
+    :rtype: pd.Series
+    """
+
+    return pd.concat([column.map(lambda value: isinstance(value, MalformedField)).astype(bool) for column in series],
+                     axis=1).any(axis=1)
+
+def violated_rows(violations: Dict[str, pd.Series], index: pd.Index) -> pd.Series:
+    """
+    Combine the violation masks to a single mask of the invalid rows.
+
+    :param violations: Dictionary of rule name to violation mask.
+    :type violations: Dict[str, pd.Series]
+    :param index: The index of the validated DataFrame.
+    :type index: pd.Index
+    :return: Boolean mask, True where any rule is violated.
+    :rtype: pd.Series
+    """
+
+    invalid = np.zeros(len(index), dtype=bool)
+
+    for violation in violations.values():
+        invalid |= violation.to_numpy(dtype=bool)
+
+    return pd.Series(invalid, index=index)
+
+def violated_rules(violations: Dict[str, pd.Series], invalid: pd.Series) -> pd.Series:
+    """
+    Get the names of the violated rules of each invalid row.
+
+    :param violations: Dictionary of rule name to violation mask.
+    :type violations: Dict[str, pd.Series]
+    :param invalid: Boolean mask of the invalid rows.
+    :type invalid: pd.Series
+    :return: The violated rules of each invalid row, indexed by the row position.
+    :rtype: pd.Series
+    """
+
+    invalid_positions = np.flatnonzero(invalid.to_numpy())
+    rules = [[] for _ in invalid_positions]
+
+    for rule, violation in violations.items():
+        for position in np.flatnonzero(violation.to_numpy(dtype=bool)[invalid_positions]):
+            rules[position].append(rule)
+
+    return pd.Series(['; '.join(row_rules) for row_rules in rules], index=invalid_positions, dtype=object)
+
+def split_violations(df: pd.DataFrame, violations: Dict[str, pd.Series],
+                     fields: List[str]) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Split the DataFrame to the validated model fields of the valid rows and the violated rules of the invalid rows.
+
+    :param df: The validated DataFrame.
+    :type df: pd.DataFrame
+    :param violations: Dictionary of rule name to violation mask.
+    :type violations: Dict[str, pd.Series]
+    :param fields: The model fields to return.
+    :type fields: List[str]
+    :return: DataFrame with the model fields of the valid rows, and the violated rules of the invalid rows.
+    :rtype: Tuple[pd.DataFrame, pd.Series]
+    """
+
+    invalid = violated_rows(violations, df.index)
+    valid_df = df.loc[~invalid.to_numpy()].reindex(columns=fields).reset_index(drop=True)
+
+    return valid_df, violated_rules(violations, invalid)
+
+def error_rules(error: ValidationError) -> str:
+    """
+    Get the failed rules of a pydantic validation error.
+
+    :param error: The validation error.
+    :type error: ValidationError
+    :return: The failed rules, in the same format as the columnar rules.
+    :rtype: str
+    """
+
+    rules = []
+
+    for detail in error.errors():
+        location = '.'.join(str(loc) for loc in detail['loc'])
+        rules.append(f"{location}: {detail['msg']}" if location else detail['msg'])
+
+    return '; '.join(rules)
+
+def apply_violations(df: pd.DataFrame, violations: Dict[str, pd.Series], key: str,
+                     dataset: str, fields: List[str]) -> pd.DataFrame:
+    """
+    Raise on the first row that violates a rule, otherwise return the validated model fields.
+
+    :param df: The validated DataFrame.
+    :type df: pd.DataFrame
+    :param violations: Dictionary of rule name to violation mask, in the order the rules are checked.
+    :type violations: Dict[str, pd.Series]
+    :param key: The column identifying a row.
+    :type key: str
+    :param dataset: The name of the dataset for the error message.
+    :type dataset: str
+    :param fields: The model fields to return.
+    :type fields: List[str]
+    :return: DataFrame with the model fields of the validated rows.
+    :rtype: pd.DataFrame
+    :raises ValueError: If any row violates a rule.
+    """
+
+    invalid = violated_rows(violations, df.index)
+
+    if invalid.any():
+        position = int(np.argmax(invalid.to_numpy()))
+        rules = [rule for rule, violation in violations.items() if violation.iloc[position]]
+        row_key = df[key].iloc[position] if key in df.columns else None
+
+        logger.error(f"Validation error in {dataset} {row_key}: {', '.join(rules)}")
+        raise ValueError(f"Validation error in {dataset} {row_key}: {', '.join(rules)}")
+
+    return df[fields].reset_index(drop=True)
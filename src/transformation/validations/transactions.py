@@ -1,7 +1,18 @@
 from pydantic import BaseModel, ValidationError, field_validator, Field
-from typing import Literal, Optional
+from typing import Dict, List, Literal, Optional, Tuple, Union
 import pandas as pd
 from utils.logging_config import logger
+from utils.profiling import profiled
+from config.constants import VALIDATION_ENGINE, VALIDATION_MODE, VALIDATION_WORKERS
+from src.extraction import MalformedField, flatten_struct_column
+from src.transformation.join_index import KeyIndex, build_key_index, lookup_positions
+from src.transformation.dates import parse_date
+from src.transformation.validations.parallel import run_partitioned
+from src.transformation.validations.quarantine import quarantine_rejections, rejected_records
+from src.transformation.validations.rules import (apply_violations, column_of, error_rules, field_of,
+                                                  invalid_literal, invalid_positive_number, invalid_str_length,
+                                                  invalid_timestamp, length_bounds, literal_values, malformed_fields,
+                                                  missing_fields, split_violations, to_number)
 
 class PaymentMethod(BaseModel):
     type: Literal['credit_card', 'debit_card', 'wallet']  
@@ -31,7 +42,7 @@ class Transaction(BaseModel):
         """
 
         try:
-            pd.to_datetime(value)
+            parse_date(value)
         except ValueError:
             logger.error(f"Invalid timestamp format: {value}")
             raise ValueError(f"Invalid timestamp format: {value}")
@@ -55,63 +66,254 @@ class Transaction(BaseModel):
         
         return value
     
-def validate_transactions(transactions: pd.DataFrame, orders_amount: pd.DataFrame) -> pd.DataFrame:
+def transaction_fields(transactions: pd.DataFrame) -> List[str]:
+    """
+    Get the columns of the Transaction model fields, either with a nested payment_method column
+    or with the flattened payment_method.type and payment_method.provider columns.
+
+    :param transactions: DataFrame containing transactions.
+    :type transactions: pd.DataFrame
+    :return: The column names of the model fields.
+    :rtype: List[str]
+    """
+
+    fields = list(Transaction.model_fields)
+
+    if 'payment_method' in transactions.columns or not any(
+            column.startswith('payment_method.') for column in transactions.columns):
+        return fields
+
+    position = fields.index('payment_method')
+
+    return fields[:position] + [f"payment_method.{field}" for field in PaymentMethod.model_fields] + fields[position + 1:]
+
+def nest_payment_method(transaction: dict) -> dict:
+    """
+    Nest the flattened payment method fields of a transaction record back into a payment_method dictionary.
+    A malformed payment method is restored to its original value.
+
+    :param transaction: The transaction record.
+    :type transaction: dict
+    :return: The transaction record with a nested payment method.
+    :rtype: dict
+    """
+
+    if 'payment_method' not in transaction:
+        transaction['payment_method'] = {field: transaction.pop(f"payment_method.{field}")
+                                         for field in PaymentMethod.model_fields
+                                         if f"payment_method.{field}" in transaction}
+
+        malformed = [value for value in transaction['payment_method'].values() if isinstance(value, MalformedField)]
+        if malformed:
+            transaction['payment_method'] = malformed[0].value
+
+    return transaction
+
+def find_transaction_violations(transactions: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    Check the transactions column-wise against the same rules the Transaction model enforces.
+
+    :param transactions: DataFrame containing transactions to validate.
+    :type transactions: pd.DataFrame
+    :return: Dictionary of rule name to violation mask, in the order the model checks them.
+    :rtype: Dict[str, pd.Series]
+    """
+
+    fields = transaction_fields(transactions)
+    violations = missing_fields(transactions, fields)
+
+    for field in ['transaction_id', 'order_id']:
+        min_length, max_length = length_bounds(Transaction, field)
+        violations[f"{field}: invalid length"] = invalid_str_length(column_of(transactions, field),
+                                                                    min_length, max_length)
+
+    violations["timestamp: invalid timestamp format"] = invalid_timestamp(column_of(transactions, 'timestamp'))
+    violations["amount: must be greater than 0"] = invalid_positive_number(column_of(transactions, 'amount'))
+
+    for field in ['currency', 'status']:
+        violations[f"{field}: invalid value"] = invalid_literal(column_of(transactions, field),
+                                                               literal_values(Transaction, field))
+
+    if 'payment_method' in fields:
+        payment_method = column_of(transactions, 'payment_method')
+        payment_type, provider = field_of(payment_method, 'type'), field_of(payment_method, 'provider')
+    else:
+        payment_type = column_of(transactions, 'payment_method.type')
+        provider = column_of(transactions, 'payment_method.provider')
+        violations["payment_method: must be an object with a type and a provider"] = malformed_fields(payment_type,
+                                                                                                     provider)
+
+    violations["payment_method.type: invalid value"] = invalid_literal(payment_type,
+                                                                       literal_values(PaymentMethod, 'type'))
+    min_length, max_length = length_bounds(PaymentMethod, 'provider')
+    violations["payment_method.provider: invalid length"] = invalid_str_length(provider, min_length, max_length)
+
+    # The error code is optional, only a present code is bound by the length limits
+    error_code = column_of(transactions, 'error_code')
+    min_length, max_length = length_bounds(Transaction, 'error_code')
+    violations["error_code: invalid length"] = (error_code.map(lambda value: value is not None).astype(bool) &
+                                                invalid_str_length(error_code, min_length, max_length))
+
+    return violations
+
+def split_valid_transactions(transactions: pd.DataFrame, amount_mismatches: pd.Series,
+                             engine: str = VALIDATION_ENGINE,
+                             mode: str = VALIDATION_MODE) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Validate the transactions and split them to the validated transactions and the quarantine rows of the rejected transactions.
+
+    :param transactions: DataFrame containing transactions to validate.
+    :type transactions: pd.DataFrame
+    :param amount_mismatches: Boolean mask of the transactions whose amount does not match their order total amount.
+    :type amount_mismatches: pd.Series
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Transaction model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid transaction, 'collect' to reject the invalid transactions.
+    :type mode: str
+    :return: DataFrame with validated transactions and the quarantine rows of the rejected transactions.
+    :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+    :raises ValueError: If any validation fails in 'fail_fast' mode, a ValidationError with the pydantic engine.
+    """
+
+    rejected_rules = pd.Series(dtype=object)
+
+    if engine == 'columnar':
+        violations = {"amount: does not match the order total amount": amount_mismatches}
+        violations.update(find_transaction_violations(transactions))
+
+        if mode == 'collect':
+            validated_transactions_df, rejected_rules = split_violations(transactions, violations,
+                                                                         transaction_fields(transactions))
+        else:
+            validated_transactions_df = apply_violations(transactions, violations, 'transaction_id',
+                                                         'transaction', transaction_fields(transactions))
+
+        validated_transactions_df['amount'] = to_number(validated_transactions_df['amount'])
+
+    else:
+        transactions_list = transactions.to_dict(orient='records')
+        validated_transactions = []
+        rejected_transactions = {}
+
+        for position, (transaction, amount_mismatch) in enumerate(zip(transactions_list, amount_mismatches)):
+            if amount_mismatch:
+                rejected_transactions[position] = "amount: does not match the order total amount"
+                continue
+
+            try:
+                validated_transaction = Transaction(**nest_payment_method(transaction))
+                validated_transactions.append(validated_transaction.model_dump())
+
+            except ValidationError as e:
+                if mode == 'collect':
+                    rejected_transactions[position] = error_rules(e)
+                    continue
+
+                logger.error(f"Validation error in transaction {transaction['transaction_id']}: {e}")
+                raise e
+
+        validated_transactions_df = pd.DataFrame(validated_transactions, columns=list(Transaction.model_fields))
+
+        # Keep the payment method layout of the input
+        if 'payment_method' not in transaction_fields(transactions):
+            validated_transactions_df = flatten_struct_column(validated_transactions_df, 'payment_method',
+                                                              list(PaymentMethod.model_fields))
+        rejected_rules = pd.Series(rejected_transactions, dtype=object)
+
+    return validated_transactions_df, rejected_records(transactions, rejected_rules, 'transaction_id')
+
+@profiled('validate')
+def validate_transactions(transactions: pd.DataFrame, orders_amount: Union[pd.DataFrame, pd.Series],
+                          engine: str = VALIDATION_ENGINE, mode: str = VALIDATION_MODE,
+                          workers: int = VALIDATION_WORKERS, orders_index: Optional[KeyIndex] = None) -> pd.DataFrame:
     """
     Validate the transactions data.
 
     :param transactions: DataFrame containing transactions to validate.
     :type transactions: pd.DataFrame
-    :param orders_amount: DataFrame the orders and the total amounts.
-    :type orders_amount: pd.DataFrame
+    :param orders_amount: DataFrame the orders and the total amounts, or a series of the total amounts indexed by order id.
+    :type orders_amount: Union[pd.DataFrame, pd.Series]
+    :param engine: 'columnar' to check the rules on whole columns, 'pydantic' to validate each row with the Transaction model.
+    :type engine: str
+    :param mode: 'fail_fast' to raise on the first invalid transaction, 'collect' to quarantine the invalid transactions.
+    :type mode: str
+    :param workers: The number of worker processes validating partitions of the transactions.
+    :type workers: int
+    :param orders_index: The order_id index of the orders DataFrame, built if not given.
+    :type orders_index: Optional[KeyIndex]
     :return: DataFrame with validated transactions.
     :rtype: pd.DataFrame
-    :raises ValidationError: If any validation fails.
+    :raises ValueError: If any validation fails in 'fail_fast' mode, or too many rows are rejected in 'collect' mode.
     """
 
     logger.info("Validating transactions data")
 
-    transactions = validate_amounts_match(transactions, orders_amount)
+    # The amounts are checked against the orders before the transactions are partitioned
+    if mode == 'collect':
+        amount_mismatches = find_amount_mismatches(transactions, orders_amount, orders_index)
+    else:
+        transactions = validate_amounts_match(transactions, orders_amount, orders_index)
+        amount_mismatches = pd.Series(False, index=transactions.index)
 
-    transactions_list = transactions.to_dict(orient='records')
-    validated_transactions = []
-    
-    for transaction in transactions_list:
-        try:
-            validated_transaction = Transaction(**transaction)
-            validated_transactions.append(validated_transaction.model_dump())
-            
-        except ValidationError as e:
-            logger.error(f"Validation error in transaction {transaction['transaction_id']}: {e}")
-            raise e  
-        
-    logger.info(f"Validated {len(validated_transactions)} transactions successfully.")
-    validated_transactions_df = pd.DataFrame(validated_transactions)
+    validated_transactions_df, rejected_transactions = run_partitioned(
+        split_valid_transactions, [transactions, amount_mismatches], workers, engine=engine, mode=mode)
+
+    if mode == 'collect':
+        quarantine_rejections(rejected_transactions, 'transactions', len(transactions))
+
+    logger.info(f"Validated {len(validated_transactions_df)} transactions successfully.")
 
     return validated_transactions_df
 
-def validate_amounts_match(transactions: pd.DataFrame, orders_amount: pd.DataFrame) -> pd.DataFrame:
+def find_amount_mismatches(transactions: pd.DataFrame, orders_amount: Union[pd.DataFrame, pd.Series],
+                           orders_index: Optional[KeyIndex] = None) -> pd.Series:
+    """
+    Get a mask of the transactions whose amount does not match the total amount of their order.
+
+    :param transactions: DataFrame containing transactions to validate.
+    :type transactions: pd.DataFrame
+    :param orders_amount: DataFrame the orders and the total amounts, or a series of the total amounts indexed by order id.
+    :type orders_amount: Union[pd.DataFrame, pd.Series]
+    :param orders_index: The order_id index of the orders DataFrame, built if not given.
+    :type orders_index: Optional[KeyIndex]
+    :return: Boolean mask, True where the amount does not match.
+    :rtype: pd.Series
+    """
+
+    if isinstance(orders_amount, pd.Series):
+        total_amount = transactions['order_id'].map(orders_amount)
+    else:
+        if orders_index is None:
+            orders_index = build_key_index(orders_amount, 'order_id')
+
+        positions = lookup_positions(orders_index, transactions['order_id'])
+        total_amount = pd.Series(orders_amount['total_amount'].array.take(positions, allow_fill=True),
+                                 index=transactions.index)
+
+    return transactions['amount'] != total_amount
+
+def validate_amounts_match(transactions: pd.DataFrame, orders_amount: Union[pd.DataFrame, pd.Series],
+                           orders_index: Optional[KeyIndex] = None) -> pd.DataFrame:
     """
     Validate that the amounts in transactions match the total amounts in orders.
 
     :param transactions: DataFrame containing transactions to validate.
     :type transactions: pd.DataFrame
-    :param orders_amount: DataFrame the orders and the total amounts.
-    :type orders_amount: pd.DataFrame
+    :param orders_amount: DataFrame the orders and the total amounts, or a series of the total amounts indexed by order id.
+    :type orders_amount: Union[pd.DataFrame, pd.Series]
+    :param orders_index: The order_id index of the orders DataFrame, built if not given.
+    :type orders_index: Optional[KeyIndex]
     :return: DataFrame with validated transactions.
     :rtype: pd.DataFrame
-    :raises ValidationError: If any transactions amount dont fit their order total amount.
+    :raises ValueError: If any transactions amount dont fit their order total amount.
     """
 
-    merged_amount = pd.merge(transactions, orders_amount, left_on="order_id", right_on="order_id", how="left")
+    amount_mismatches = find_amount_mismatches(transactions, orders_amount, orders_index)
 
-    validated_transactions_amounts = merged_amount[merged_amount['amount'] == merged_amount['total_amount']]
-
-    invalidated_transactions_amounts = len(transactions) - len(validated_transactions_amounts)
+    invalidated_transactions_amounts = int(amount_mismatches.sum())
 
     if invalidated_transactions_amounts > 0:
         logger.error(f"{invalidated_transactions_amounts} transactions amount fields do not match their order total amount")
         raise ValueError(f"{invalidated_transactions_amounts} transactions amount fields do not match their order total amount")
-    
-    validated_transactions_amounts.drop('total_amount', axis=1, inplace=True)
 
-    return validated_transactions_amounts
+    return transactions.reset_index(drop=True)
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.generate import generate_datasets
+from src.extraction import extract_all
+from src.transformation.clean import clean_orders, clean_transactions, clean_chargebacks
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE_PATHS = {'orders': os.path.join(REPO_DIR, 'data', 'orders.json'),
+                     'transactions': os.path.join(REPO_DIR, 'data', 'transactions.json'),
+                     'chargebacks': os.path.join(REPO_DIR, 'data', 'chargebacks.csv')}
+
+@pytest.fixture(scope='session')
+def sample_data():
+    """
+    The cleaned sample orders, transactions and chargebacks.
+    """
+
+    orders, transactions, chargebacks = extract_all(SAMPLE_FILE_PATHS['orders'], SAMPLE_FILE_PATHS['transactions'],
+                                                    SAMPLE_FILE_PATHS['chargebacks'])
+
+    return clean_orders(orders), clean_transactions(transactions), clean_chargebacks(chargebacks)
+
+@pytest.fixture(scope='session')
+def generated_file_paths(tmp_path_factory):
+    """
+    The file paths of generated data sources with enough rows for several chunks and multiple days per bucket.
+    """
+
+    return generate_datasets(str(tmp_path_factory.mktemp('generated')), rows=5000, seed=7)
+
+@pytest.fixture
+def run_pipeline_output(tmp_path):
+    """
+    Run the pipeline script on data sources in a subprocess, so the settings are read from a fresh environment,
+    and return the printed metrics.
+    """
+
+    def run(file_paths, *args, **settings):
+        env = {**os.environ,
+               'ORDERS_FILE_PATH': file_paths['orders'],
+               'TRANSACTIONS_FILE_PATH': file_paths['transactions'],
+               'CHARGEBACKS_FILE_PATH': file_paths['chargebacks'],
+               'STAGE_CACHE': '0',
+               'INCREMENTAL_STATE_DIR': str(tmp_path / 'state'),
+               'QUARANTINE_DIR': str(tmp_path / 'quarantine'),
+               'OUTPUT_MAX_ROWS': '0',
+               **{name: str(value) for name, value in settings.items()}}
+
+        completed = subprocess.run([sys.executable, '-m', 'scripts.pipeline', *args], cwd=REPO_DIR, env=env,
+                                   capture_output=True, text=True)
+        assert completed.returncode == 0, completed.stderr[-2000:]
+
+        return completed.stdout
+
+    return run
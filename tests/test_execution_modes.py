@@ -0,0 +1,76 @@
+import json
+
+import pandas as pd
+import pytest
+
+from src.extraction import extract_all
+
+def write_batch(directory, orders, transactions, chargebacks):
+    """
+    Write a batch of the data sources, with the orders of its transactions, and return the file paths.
+    """
+
+    directory.mkdir()
+    order_ids = {transaction['order_id'] for transaction in transactions}
+    file_paths = {name: str(directory / file_name) for name, file_name in
+                  [('orders', 'orders.json'), ('transactions', 'transactions.json'), ('chargebacks', 'chargebacks.csv')]}
+
+    with open(file_paths['orders'], 'w') as file:
+        json.dump([order for order in orders if order['order_id'] in order_ids], file)
+    with open(file_paths['transactions'], 'w') as file:
+        json.dump(transactions, file)
+    chargebacks.to_csv(file_paths['chargebacks'], index=False)
+
+    return file_paths
+
+@pytest.mark.parametrize('precision_limit', [0, 2])
+def test_chunked_matches_in_memory(generated_file_paths, run_pipeline_output, precision_limit):
+    in_memory = run_pipeline_output(generated_file_paths, PRECISION_LIMIT=precision_limit)
+    chunked = run_pipeline_output(generated_file_paths, '--chunked', '--chunk-size', '1500',
+                                  PRECISION_LIMIT=precision_limit)
+
+    assert chunked == in_memory
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_concurrent_extraction_matches_serial(generated_file_paths, executor):
+    file_paths = [generated_file_paths[name] for name in ['orders', 'transactions', 'chargebacks']]
+
+    for serial, concurrent in zip(extract_all(*file_paths, executor='serial'),
+                                  extract_all(*file_paths, executor=executor)):
+        pd.testing.assert_frame_equal(concurrent, serial)
+
+def test_unsupported_extraction_executor(generated_file_paths):
+    with pytest.raises(ValueError, match='Unsupported extraction executor'):
+        extract_all(generated_file_paths['orders'], generated_file_paths['transactions'],
+                    generated_file_paths['chargebacks'], executor='bogus')
+
+def test_fused_metrics_match_reference(generated_file_paths, run_pipeline_output):
+    fused = run_pipeline_output(generated_file_paths, METRICS_ENGINE='fused')
+    reference = run_pipeline_output(generated_file_paths, METRICS_ENGINE='reference')
+
+    assert fused == reference
+
+def test_polars_backend_matches_pandas(generated_file_paths, run_pipeline_output):
+    pytest.importorskip('polars')
+
+    pandas_output = run_pipeline_output(generated_file_paths, DATAFRAME_BACKEND='pandas')
+    polars_output = run_pipeline_output(generated_file_paths, DATAFRAME_BACKEND='polars')
+
+    assert polars_output == pandas_output
+
+def test_incremental_batches_match_full_run(generated_file_paths, run_pipeline_output, tmp_path):
+    with open(generated_file_paths['orders']) as file:
+        orders = json.load(file)
+    with open(generated_file_paths['transactions']) as file:
+        transactions = json.load(file)
+    chargebacks = pd.read_csv(generated_file_paths['chargebacks'], dtype=str)
+
+    # The second batch sends part of the first one again, and all the chargebacks, some of them late
+    split, overlap = len(transactions) * 6 // 10, len(transactions) * 2 // 10
+    first_batch = write_batch(tmp_path / 'first', orders, transactions[:split], chargebacks.iloc[:len(chargebacks) // 3])
+    second_batch = write_batch(tmp_path / 'second', orders, transactions[split - overlap:], chargebacks)
+
+    run_pipeline_output(first_batch, '--incremental', INCREMENTAL_STATE_PARTITIONS=8)
+    incremental = run_pipeline_output(second_batch, '--incremental', INCREMENTAL_STATE_PARTITIONS=8)
+
+    assert incremental == run_pipeline_output(generated_file_paths)
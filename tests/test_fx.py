@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+
+from src.transformation.fx import FxRates, convert_amounts
+from src.transformation.timeseries import bucket_keys
+
+def test_amounts_outside_the_rate_table_and_without_timestamp():
+    first_day = int(bucket_keys(pd.Series(pd.to_datetime(['2023-01-01'])), 'day')[0])
+    fx_rates = FxRates(first_day, pd.Index(['EUR', 'USD']), np.array([[1.1, 1.0], [1.2, 1.0]]), 'USD')
+    timestamps = pd.Series(pd.to_datetime(['2022-12-31', '2023-01-01', '2023-01-02', '2023-01-05', None]))
+
+    converted = convert_amounts(fx_rates, timestamps, pd.Series(['EUR'] * 5), np.full(5, 10.0))
+
+    np.testing.assert_allclose(converted[:4], [11.0, 11.0, 12.0, 12.0])
+    assert np.isnan(converted[4])
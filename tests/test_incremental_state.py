@@ -0,0 +1,34 @@
+import os
+
+import pandas as pd
+
+from config.constants import INCREMENTAL_STATE_PARTITIONS
+from src.transformation.incremental import STATE_TYPES, current_version, key_partitions, load_state, save_state
+
+def test_only_the_partitions_of_the_batch_are_loaded_and_rewritten(tmp_path):
+    state_dir = str(tmp_path)
+    state = load_state(state_dir)
+    transaction_ids = [f"transaction_{number}" for number in range(200)]
+    state['ledger'] = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in STATE_TYPES['ledger'].items()})
+    state['ledger']['transaction_id'] = transaction_ids
+    state['chargebacks'] = pd.DataFrame({'transaction_id': transaction_ids[:10]})
+    save_state(state, state_dir)
+
+    first_version = current_version(state_dir)
+    partition = key_partitions(['transaction_3'], INCREMENTAL_STATE_PARTITIONS)[0]
+    loaded = load_state(state_dir, transaction_ids=['transaction_3'], order_ids=[])
+
+    assert set(key_partitions(loaded['ledger']['transaction_id'], INCREMENTAL_STATE_PARTITIONS)) == {partition}
+    assert 'transaction_3' in set(loaded['ledger']['transaction_id'])
+    assert loaded['orders'].empty
+
+    save_state(loaded, state_dir)
+    second_version = current_version(state_dir)
+    unchanged_files = [file_name for file_name in os.listdir(os.path.join(second_version, 'ledger'))
+                       if file_name != f"part-{partition:05d}.parquet"]
+
+    assert second_version != first_version
+    assert unchanged_files and all(
+        os.path.samefile(os.path.join(first_version, 'ledger', file_name),
+                         os.path.join(second_version, 'ledger', file_name)) for file_name in unchanged_files)
+    assert sorted(load_state(state_dir)['ledger']['transaction_id']) == sorted(transaction_ids)
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from src.extraction import stream_json_array
+
+ARRAYS = [
+    '[]',
+    '  [ ]\n',
+    '[1, "a,]", {"x": [1,2]}, 3.5e2]',
+    '["]", ",", "[", "\\"]"]',
+    '[10, -2.5E-3, 7e1, 123456, 0.125, true, null]',
+    '\n[\n  {"amount": 1.5, "items": [{"quantity": 2}]},\n  {"amount": 20}\n]\n',
+]
+
+def write_json(tmp_path, text):
+    file_path = tmp_path / 'data.json'
+    file_path.write_text(text)
+
+    return str(file_path)
+
+@pytest.mark.parametrize('text', ARRAYS)
+def test_elements_match_json_loads_at_every_read_size(tmp_path, text):
+    file_path = write_json(tmp_path, text)
+
+    # Every read size cuts the elements at another position, down to a single character per read
+    for read_size in range(1, len(text) + 2):
+        assert list(stream_json_array(file_path, read_size)) == json.loads(text), read_size
+
+@pytest.mark.parametrize('text', ['', '   \n', '{"x": [1, 2]}', '"[1, 2]"'])
+def test_not_an_array(tmp_path, text):
+    file_path = write_json(tmp_path, text)
+
+    with pytest.raises(ValueError, match='does not contain a JSON array'):
+        list(stream_json_array(file_path, 3))
+
+@pytest.mark.parametrize('text', ['[1, 2', '[1, {"x": ]'])
+def test_truncated_array(tmp_path, text):
+    file_path = write_json(tmp_path, text)
+
+    with pytest.raises(json.JSONDecodeError):
+        list(stream_json_array(file_path, 2))
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from src.transformation.validations.quarantine import quarantine_rejections, quarantine_session
+
+def rejected_rows(*keys):
+    return pd.DataFrame({'transaction_id': list(keys), 'rule': 'amount: must be greater than 0',
+                         'record': [f'{{"transaction_id": "{key}"}}' for key in keys]})
+
+def test_threshold_outside_a_session(tmp_path):
+    quarantine_rejections(rejected_rows('a'), 'transactions', 10, str(tmp_path), 'csv', max_rejected_ratio=0.1)
+
+    with pytest.raises(ValueError, match='of the transactions were rejected'):
+        quarantine_rejections(rejected_rows('a', 'b'), 'transactions', 10, str(tmp_path), 'csv',
+                              max_rejected_ratio=0.1)
+
+def test_session_threshold_on_all_the_chunks(tmp_path):
+    # The threshold is enforced on the rows of all the chunks when the session closes, not on each chunk
+    quarantined_chunks = 0
+    with pytest.raises(ValueError, match='of the transactions were rejected'):
+        with quarantine_session():
+            for keys, total_rows in [(('a', 'b'), 10), ((), 4)]:
+                quarantine_rejections(rejected_rows(*keys), 'transactions', total_rows, str(tmp_path), 'csv',
+                                      max_rejected_ratio=0.1)
+                quarantined_chunks += 1
+
+    assert quarantined_chunks == 2
+
+    # A chunk over the threshold on its own is allowed while the whole dataset is within it
+    with quarantine_session():
+        for keys, total_rows in [(('a', 'b'), 10), ((), 10)]:
+            quarantine_rejections(rejected_rows(*keys), 'transactions', total_rows, str(tmp_path), 'csv',
+                                  max_rejected_ratio=0.1)
+
+def test_session_appends_to_the_csv_file(tmp_path):
+    with quarantine_session():
+        quarantine_rejections(rejected_rows('a'), 'transactions', 10, str(tmp_path), 'csv', max_rejected_ratio=1.0)
+        quarantine_rejections(rejected_rows(), 'transactions', 10, str(tmp_path), 'csv', max_rejected_ratio=1.0)
+        quarantine_rejections(rejected_rows('b', 'c'), 'transactions', 10, str(tmp_path), 'csv',
+                              max_rejected_ratio=1.0)
+
+    lines = (tmp_path / 'transactions.csv').read_text().splitlines()
+
+    assert lines[0] == 'transaction_id,rule,record'
+    assert lines.count(lines[0]) == 1
+    assert pd.read_csv(tmp_path / 'transactions.csv')['transaction_id'].tolist() == ['a', 'b', 'c']
+
+def test_session_writes_numbered_parquet_parts(tmp_path):
+    with quarantine_session():
+        for keys in [('a',), ('b', 'c'), ('d',)]:
+            quarantine_rejections(rejected_rows(*keys), 'transactions', 10, str(tmp_path), 'parquet',
+                                  max_rejected_ratio=1.0)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['transactions.1.parquet', 'transactions.2.parquet',
+                                                                 'transactions.parquet']
+    parts = [pd.read_parquet(tmp_path / name) for name in
+             ['transactions.parquet', 'transactions.1.parquet', 'transactions.2.parquet']]
+    assert pd.concat(parts)['transaction_id'].tolist() == ['a', 'b', 'c', 'd']
+
+def test_new_session_overwrites_the_previous_run(tmp_path):
+    for keys in [('a', 'b'), ('c',)]:
+        with quarantine_session():
+            quarantine_rejections(rejected_rows(*keys), 'transactions', 10, str(tmp_path), 'csv',
+                                  max_rejected_ratio=1.0)
+
+    assert pd.read_csv(tmp_path / 'transactions.csv')['transaction_id'].tolist() == ['c']
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+
+from src.transformation.schema import compact_column
+
+def test_money_columns_keep_float64():
+    # Whole amounts survive a float32 round trip, their float32 sum does not match the float64 sum
+    amounts = pd.Series(np.random.default_rng(7).integers(1, 5000, 2_000_000).astype(np.float64))
+
+    compact = compact_column(amounts, 'numeric')
+
+    assert compact.dtype == np.float64
+    assert compact.sum() == amounts.sum()
+
+def test_integer_columns_are_downcast():
+    quantities = pd.Series([1, 2, 300], dtype=np.int64)
+
+    compact = compact_column(quantities, 'numeric')
+
+    assert compact.dtype == np.int16
+    assert compact.tolist() == quantities.tolist()
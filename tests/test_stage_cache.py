@@ -0,0 +1,26 @@
+import pytest
+
+import config.constants
+from src.cache import stage_key
+from src.transformation.clean import clean_transactions
+from src.transformation.normalize import normalize_transactions
+from src.transformation.validations.transactions import validate_transactions
+
+STAGES = [clean_transactions, validate_transactions, normalize_transactions]
+
+@pytest.mark.parametrize('name, value', [('METRICS_ENGINE', 'reference'), ('BREAKDOWN_TOP_K', 5),
+                                         ('ROLLING_WINDOWS', [7]), ('PRECISION_LIMIT', 3),
+                                         ('REPORTING_CURRENCY', 'EUR')])
+def test_analysis_settings_keep_the_stage_keys(monkeypatch, name, value):
+    keys = [stage_key(stage, ['input']) for stage in STAGES]
+
+    monkeypatch.setattr(config.constants, name, value)
+
+    assert [stage_key(stage, ['input']) for stage in STAGES] == keys
+
+def test_stage_settings_change_the_stage_key(monkeypatch):
+    key = stage_key(normalize_transactions, ['input'])
+
+    monkeypatch.setattr(config.constants, 'COMPACT_SCHEMA', not config.constants.COMPACT_SCHEMA)
+
+    assert stage_key(normalize_transactions, ['input']) != key
@@ -0,0 +1,24 @@
+import pytest
+
+from src.transformation.timeseries import check_time_series_settings, rolling_windows
+
+def test_windows_are_named_by_the_covered_days():
+    assert rolling_windows('day', [7, 30]) == {7: 7, 30: 30}
+    assert rolling_windows('week', [7, 30]) == {7: 1, 28: 4}
+    assert rolling_windows('hour', [7]) == {7: 168}
+
+def test_windows_covering_the_same_buckets_are_rejected():
+    with pytest.raises(ValueError):
+        rolling_windows('week', [7, 10])
+
+@pytest.mark.parametrize('aggregated', [True, False])
+def test_hourly_series_needs_the_transactions(aggregated):
+    if aggregated:
+        with pytest.raises(ValueError):
+            check_time_series_settings(aggregated, 'hour', [7, 30])
+    else:
+        check_time_series_settings(aggregated, 'hour', [7, 30])
+
+def test_unsupported_granularity_is_rejected():
+    with pytest.raises(ValueError):
+        check_time_series_settings(False, 'month', [7, 30])
@@ -0,0 +1,140 @@
+import copy
+import json
+
+import pandas as pd
+import pytest
+
+from src.extraction import flatten_struct_column
+from src.transformation.clean import clean_transactions
+from src.transformation.validations.orders import split_valid_orders
+from src.transformation.validations.transactions import nest_payment_method, split_valid_transactions
+from src.transformation.validations.chargeback import split_valid_chargebacks
+
+def with_items(**changes):
+    # Change the fields of the first item of an order
+    def mutate(order):
+        order['items'] = copy.deepcopy(order['items'])
+        order['items'][0].update(changes)
+    return mutate
+
+def with_fields(**changes):
+    return lambda record: record.update(changes)
+
+# One invalid record per rule of each model, crafted from a valid record
+ORDER_MUTATIONS = {
+    'missing customer_id': with_fields(customer_id=None),
+    'order_id length': with_fields(order_id='o_1'),
+    'customer_id length': with_fields(customer_id='not-a-uuid'),
+    'timestamp format': with_fields(timestamp='yesterday'),
+    'total_amount not positive': with_fields(total_amount=0.0),
+    'currency value': with_fields(currency='XYZ'),
+    'item product_id length': with_items(product_id='p1'),
+    'item quantity not positive': with_items(quantity=0),
+    'item unit_price not positive': with_items(unit_price=-1.0),
+    'payment_status value': with_fields(payment_status='unknown'),
+    'total_amount mismatch': lambda order: order.update(total_amount=order['total_amount'] + 1),
+}
+
+TRANSACTION_MUTATIONS = {
+    'missing timestamp': with_fields(timestamp=None),
+    'transaction_id length': with_fields(transaction_id='short-id'),
+    'order_id length': with_fields(order_id='o_1'),
+    'timestamp format': with_fields(timestamp='2023-13-45 99:00:00'),
+    'amount not positive': with_fields(amount=-5.0),
+    'currency value': with_fields(currency='XYZ'),
+    'status value': with_fields(status='refunded'),
+    'payment_method.type value': with_fields(**{'payment_method.type': 'cash'}),
+    'payment_method.provider length': with_fields(**{'payment_method.provider': 'x'}),
+    'error_code length': with_fields(error_code='e' * 21),
+}
+
+CHARGEBACK_MUTATIONS = {
+    'missing status': with_fields(status=None),
+    'transaction_id length': with_fields(transaction_id='short-id'),
+    'dispute_date format': with_fields(dispute_date='soon'),
+    'amount not positive': with_fields(amount=0.0),
+    'reason_code length': with_fields(reason_code=''),
+    'status value': with_fields(status='pending'),
+    'resolution_date format': with_fields(resolution_date='later'),
+    'dispute after resolution': with_fields(dispute_date='2023-12-31 00:00:00', resolution_date='2023-01-01 00:00:00'),
+}
+
+def with_invalid_record(df: pd.DataFrame, mutate) -> pd.DataFrame:
+    """
+    Append a mutated copy of the first record to the first rows of a valid dataset.
+    """
+
+    records = df.head(5).to_dict(orient='records')
+    invalid = copy.deepcopy(records[0])
+    mutate(invalid)
+
+    return pd.DataFrame(records + [invalid], columns=df.columns)
+
+def assert_engines_agree(split, df, *args):
+    """
+    Validate a dataset with both engines and assert they accept and reject the same rows.
+    The rule names of the rejected rows differ, the pydantic engine reports the model error messages.
+    """
+
+    columnar_valid, columnar_rejected = split(df, *args, engine='columnar', mode='collect')
+    pydantic_valid, pydantic_rejected = split(df, *args, engine='pydantic', mode='collect')
+
+    pd.testing.assert_frame_equal(columnar_valid.reset_index(drop=True), pydantic_valid.reset_index(drop=True),
+                                  check_dtype=False)
+    pd.testing.assert_frame_equal(columnar_rejected.drop(columns='rule').reset_index(drop=True),
+                                  pydantic_rejected.drop(columns='rule').reset_index(drop=True))
+
+    return columnar_rejected
+
+def test_engines_accept_the_valid_sample(sample_data):
+    orders, transactions, chargebacks = sample_data
+
+    assert assert_engines_agree(split_valid_orders, orders).empty
+    assert assert_engines_agree(split_valid_transactions, transactions, pd.Series(False, index=transactions.index)).empty
+    assert assert_engines_agree(split_valid_chargebacks, chargebacks).empty
+
+@pytest.mark.parametrize('rule', ORDER_MUTATIONS)
+def test_order_rule_parity(sample_data, rule):
+    orders = with_invalid_record(sample_data[0], ORDER_MUTATIONS[rule])
+
+    rejected = assert_engines_agree(split_valid_orders, orders)
+    assert len(rejected) == 1
+
+@pytest.mark.parametrize('rule', TRANSACTION_MUTATIONS)
+def test_transaction_rule_parity(sample_data, rule):
+    transactions = with_invalid_record(sample_data[1], TRANSACTION_MUTATIONS[rule])
+
+    rejected = assert_engines_agree(split_valid_transactions, transactions, pd.Series(False, index=transactions.index))
+    assert len(rejected) == 1
+
+def test_transaction_amount_mismatch_parity(sample_data):
+    transactions = sample_data[1].head(5).reset_index(drop=True)
+    amount_mismatches = pd.Series([False, True, False, False, False], index=transactions.index)
+
+    rejected = assert_engines_agree(split_valid_transactions, transactions, amount_mismatches)
+    assert rejected['rule'].tolist() == ["amount: does not match the order total amount"]
+
+@pytest.mark.parametrize('payment_method', ['credit_card', {'type': 'credit_card'}])
+def test_malformed_payment_method_parity(sample_data, payment_method):
+    # The malformed payment method is flattened at extraction, it must survive the clean stage to be rejected
+    records = [nest_payment_method(record) for record in sample_data[1].head(5).to_dict(orient='records')]
+    records[-1]['payment_method'] = payment_method
+    transactions = clean_transactions(flatten_struct_column(pd.DataFrame(records), 'payment_method',
+                                                            ['type', 'provider']))
+    assert len(transactions) == 5
+
+    rejected = assert_engines_agree(split_valid_transactions, transactions, pd.Series(False, index=transactions.index))
+    assert len(rejected) == 1
+    assert payment_method == json.loads(rejected['record'].iloc[0])['payment_method.provider']
+
+    for engine in ['columnar', 'pydantic']:
+        with pytest.raises(ValueError):
+            split_valid_transactions(transactions, pd.Series(False, index=transactions.index), engine=engine,
+                                     mode='fail_fast')
+
+@pytest.mark.parametrize('rule', CHARGEBACK_MUTATIONS)
+def test_chargeback_rule_parity(sample_data, rule):
+    chargebacks = with_invalid_record(sample_data[2], CHARGEBACK_MUTATIONS[rule])
+
+    rejected = assert_engines_agree(split_valid_chargebacks, chargebacks)
+    assert len(rejected) == 1
@@ -1,11 +1,63 @@
 from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+import atexit
 import logging
+import os
+import queue
+import threading
 import colorlog
+from config.constants import LOG_MODE, LOG_RATE_LIMIT, LOG_RATE_INTERVAL
 
-class IndentLoggerAdapter(logging.LoggerAdapter):
-    # Override the process method to add indentation to the log message
-    def process(self, msg, kwargs):
-        return '    ' * self.extra['indent_level'] + msg, kwargs
+# The indentation level of the records logged in the current context, each thread starts at level 0
+log_indent_level = ContextVar('log_indent_level', default=0)
+
+class IndentFilter(logging.Filter):
+    # Add the indentation of the logging context to the record message, in the thread that logs it
+    def filter(self, record):
+        level = log_indent_level.get()
+        if level:
+            record.msg = '    ' * level + str(record.msg)
+        return True
+
+class RateLimitFilter(logging.Filter):
+    # Pass at most max_records records of each logging call site in each interval, the records suppressed in an
+    # interval are counted on the next passed record of the call site, or reported by report_suppressed
+    def __init__(self, max_records, interval):
+        super().__init__()
+        self.max_records = max_records
+        self.interval = interval
+        self.call_sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        call_site = (record.pathname, record.lineno)
+
+        with self.lock:
+            window_start, passed, suppressed = self.call_sites.get(call_site, (record.created, 0, 0))
+
+            if record.created - window_start >= self.interval:
+                window_start, passed = record.created, 0
+
+            if passed >= self.max_records:
+                self.call_sites[call_site] = (window_start, passed, suppressed + 1)
+                return False
+
+            self.call_sites[call_site] = (window_start, passed + 1, 0)
+
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+    def report_suppressed(self):
+        with self.lock:
+            suppressed_sites = [(call_site, suppressed) for call_site, (_, _, suppressed) in self.call_sites.items()
+                                if suppressed]
+            self.call_sites.clear()
+
+        for (pathname, lineno), suppressed in suppressed_sites:
+            logger.warning(f"Suppressed {suppressed} similar messages logged at "
+                           f"{os.path.basename(pathname)}:{lineno}")
 
 # Configure colored logging
 stream_handler = colorlog.StreamHandler()
@@ -19,28 +71,44 @@ stream_handler.setFormatter(colorlog.ColoredFormatter(
         'CRITICAL': 'bold_red',
     }
 ))
+# The indentation is added by the handler filters, in the context of the logging thread
+stream_handler.addFilter(IndentFilter())
 logger = colorlog.getLogger()
-logger.addHandler(stream_handler)
 logger.setLevel(logging.INFO)
 
+# In the queue mode the records are put on a queue by the logging thread and written by a background listener,
+# and each call site is rate limited, for high-volume runs where the logging should not block the stages
+if LOG_MODE == 'queue':
+    rate_limit_filter = RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_INTERVAL)
+    log_handler = QueueHandler(queue.SimpleQueue())
+    log_handler.addFilter(rate_limit_filter)
+    log_handler.addFilter(IndentFilter())
+    log_listener = QueueListener(log_handler.queue, stream_handler)
+    log_listener.start()
+
+    # The report of the suppressed records is logged before the listener drains the queue and stops
+    atexit.register(log_listener.stop)
+    atexit.register(rate_limit_filter.report_suppressed)
+
+    # Forked worker processes don't have the listener thread, they write their records directly
+    def use_stream_handler():
+        logger.removeHandler(log_handler)
+        logger.addHandler(stream_handler)
+
+    os.register_at_fork(after_in_child=use_stream_handler)
+else:
+    log_handler = stream_handler
+
+logger.addHandler(log_handler)
+
 # Logging with custom indentation
 @contextmanager
 def log_indent(indent_level=1):
-    
-    # Create an instance of IndentLoggerAdapter with the specified indent level
-    adapter = IndentLoggerAdapter(logger, {'indent_level': indent_level})
-    original_factory = logging.getLogRecordFactory()
-    
-    # Define a new log record factory that adds indentation to the log message
-    def record_factory(*args, **kwargs):
-        record = original_factory(*args, **kwargs)
-        record.msg = '    ' * indent_level + record.msg
-        return record
-    
-     # Set the new log record factory
-    logging.setLogRecordFactory(record_factory)
+
+    # Indent the records logged in the current context only, the other threads keep their own indentation
+    token = log_indent_level.set(log_indent_level.get() + indent_level)
     try:
-        yield adapter
+        yield logger
     finally:
-         # Restore the original log record factory after the context
-        logging.setLogRecordFactory(original_factory)
+        # Restore the indentation of the enclosing context
+        log_indent_level.reset(token)
@@ -0,0 +1,298 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Optional
+from utils.logging_config import logger
+from config.constants import (PROFILE_OUTPUT, PROFILE_FORMAT, PROFILER, PROFILE_STAGES, PROFILE_DIR,
+                              PROFILE_SAMPLE_INTERVAL)
+
+try:
+    import resource
+except ImportError:
+    # The peak RSS is not available on Windows
+    resource = None
+
+# The totals of each profiled function while a profile session is open, keyed by (stage, function)
+session_records = None
+
+# The cProfile profile or the sampled stack counts of each profiled function, and the function being profiled
+session_profiles = None
+active_profile = None
+
+def peak_rss() -> Optional[int]:
+    """
+    Get the peak resident set size of the process so far.
+
+    :return: The peak RSS in bytes, None if it is not available.
+    :rtype: Optional[int]
+    """
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def count_rows(value) -> Optional[int]:
+    """
+    Count the rows of a stage input or output - a DataFrame, Series or a tuple or list of them.
+
+    :param value: The stage input or output.
+    :return: The number of rows, None if the value holds no DataFrame or Series.
+    :rtype: Optional[int]
+    """
+
+    if isinstance(value, (tuple, list)):
+        counts = [count_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+
+        return sum(counts) if counts else None
+
+    if hasattr(value, 'shape') and hasattr(value, 'index'):
+        return len(value)
+
+    return None
+
+@contextmanager
+def sampled_stacks(stacks: Counter, interval: float = PROFILE_SAMPLE_INTERVAL):
+    """
+    Sample the stack of the calling thread at a fixed interval from a background thread,
+    counting each stack in the collapsed format of the flame graph tools.
+
+    :param stacks: The counts of the sampled stacks, updated in place.
+    :type stacks: Counter
+    :param interval: The sampling interval in seconds.
+    :type interval: float
+    """
+
+    thread_id = threading.get_ident()
+    stopped = threading.Event()
+
+    def sample():
+        while not stopped.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}"
+                              f":{frame.f_code.co_firstlineno})")
+                frame = frame.f_back
+            stacks[';'.join(reversed(frames))] += 1
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    try:
+        yield stacks
+    finally:
+        stopped.set()
+        sampler.join()
+
+@contextmanager
+def stage_profiler(function: str):
+    """
+    Profile a function with the configured profiler if it is one of the profiled stages,
+    nested profiled functions are included in the profile of the outermost one.
+
+    :param function: The function name.
+    :type function: str
+    """
+
+    global active_profile
+
+    if active_profile is not None or not (function in PROFILE_STAGES or 'all' in PROFILE_STAGES):
+        yield
+        return
+
+    active_profile = function
+
+    try:
+        if PROFILER == 'sampling':
+            with sampled_stacks(session_profiles.setdefault(function, Counter())):
+                yield
+        else:
+            profile = session_profiles.setdefault(function, cProfile.Profile())
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+    finally:
+        active_profile = None
+
+def profiled(stage: str) -> Callable[[Callable], Callable]:
+    """
+    Decorate a pipeline function to record its wall time, CPU time, peak RSS increase and rows in and out
+    while a profile session is open. The calls of a function are summed, e.g. across the chunks of a dataset.
+
+    :param stage: The pipeline stage of the function - extract, clean, validate, normalize, match or analysis.
+    :type stage: str
+    :return: The decorator.
+    :rtype: Callable[[Callable], Callable]
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            # No overhead beyond this check when profiling is off
+            if session_records is None:
+                return function(*args, **kwargs)
+
+            rows_in = count_rows(list(args) + list(kwargs.values()))
+            rss_before = peak_rss()
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+
+            with stage_profiler(function.__name__):
+                result = function(*args, **kwargs)
+
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            rss_after = peak_rss()
+            rows_out = count_rows(result)
+
+            record = session_records.setdefault((stage, function.__name__), {
+                'stage': stage, 'function': function.__name__, 'calls': 0, 'wall_seconds': 0.0,
+                'cpu_seconds': 0.0, 'peak_rss_delta_bytes': None, 'rows_in': None, 'rows_out': None
+            })
+            record['calls'] += 1
+            record['wall_seconds'] += wall_time
+            record['cpu_seconds'] += cpu_time
+            if rss_before is not None:
+                record['peak_rss_delta_bytes'] = (record['peak_rss_delta_bytes'] or 0) + rss_after - rss_before
+            if rows_in is not None:
+                record['rows_in'] = (record['rows_in'] or 0) + rows_in
+            if rows_out is not None:
+                record['rows_out'] = (record['rows_out'] or 0) + rows_out
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+def prometheus_report(report: dict) -> str:
+    """
+    Format a profile report in the Prometheus text exposition format, for the node exporter text file collector.
+
+    :param report: The profile report.
+    :type report: dict
+    :return: The report metrics.
+    :rtype: str
+    """
+
+    metrics = [
+        ('pipeline_stage_calls_total', 'calls', 'counter', 'Number of calls of the pipeline function.'),
+        ('pipeline_stage_wall_seconds', 'wall_seconds', 'gauge', 'Wall time of the pipeline function.'),
+        ('pipeline_stage_cpu_seconds', 'cpu_seconds', 'gauge', 'CPU time of the process during the function.'),
+        ('pipeline_stage_peak_rss_delta_bytes', 'peak_rss_delta_bytes', 'gauge',
+         'Increase of the peak resident set size during the function.'),
+        ('pipeline_stage_rows_in', 'rows_in', 'gauge', 'Rows of the DataFrame arguments of the function.'),
+        ('pipeline_stage_rows_out', 'rows_out', 'gauge', 'Rows of the DataFrames returned by the function.')
+    ]
+
+    lines = []
+    for name, field, metric_type, description in metrics:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        for record in report['stages']:
+            if record[field] is not None:
+                lines.append(f'{name}{{stage="{record["stage"]}",function="{record["function"]}"}} {record[field]}')
+
+    lines += ["# HELP pipeline_run_wall_seconds Wall time of the whole pipeline run.",
+              "# TYPE pipeline_run_wall_seconds gauge",
+              f"pipeline_run_wall_seconds {report['wall_seconds']}"]
+
+    return '\n'.join(lines) + '\n'
+
+def write_profile(report: dict, output_path: str = PROFILE_OUTPUT, file_format: str = PROFILE_FORMAT) -> None:
+    """
+    Write a profile report as JSON or in the Prometheus text format, replacing the previous report atomically.
+
+    :param report: The profile report.
+    :type report: dict
+    :param output_path: The path of the report file.
+    :type output_path: str
+    :param file_format: 'json' or 'prometheus'.
+    :type file_format: str
+    :return: None
+    :rtype: None
+    """
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+
+    with open(tmp_path, 'w') as file:
+        if file_format == 'prometheus':
+            file.write(prometheus_report(report))
+        else:
+            json.dump(report, file, indent=2)
+
+    os.replace(tmp_path, output_path)
+
+def write_stage_profiles(profiles: dict, profile_dir: str = PROFILE_DIR) -> None:
+    """
+    Write the cProfile stats or the collapsed sampled stacks of each profiled function.
+
+    :param profiles: The cProfile profile or the sampled stack counts of each profiled function.
+    :type profiles: dict
+    :param profile_dir: The directory of the profile files.
+    :type profile_dir: str
+    :return: None
+    :rtype: None
+    """
+
+    os.makedirs(profile_dir, exist_ok=True)
+
+    for function, profile in profiles.items():
+        if isinstance(profile, Counter):
+            file_path = os.path.join(profile_dir, f"{function}.folded")
+            with open(file_path, 'w') as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in profile.items())
+        else:
+            file_path = os.path.join(profile_dir, f"{function}.prof")
+            profile.dump_stats(file_path)
+
+        logger.info(f"Wrote the {function} profile to {file_path}")
+
+@contextmanager
+def profile_session(output_path: str = PROFILE_OUTPUT, file_format: str = PROFILE_FORMAT):
+    """
+    Open a profile session, in which the profiled pipeline functions are recorded,
+    and write the report of the recorded functions when the session closes, also if the run failed.
+
+    :param output_path: The path of the report file.
+    :type output_path: str
+    :param file_format: 'json' or 'prometheus'.
+    :type file_format: str
+    """
+
+    global session_records, session_profiles
+
+    session_records, session_profiles = {}, {}
+    started_at = time.time()
+    wall_start = time.perf_counter()
+
+    try:
+        yield session_records
+
+    finally:
+        report = {
+            'started_at': started_at,
+            'wall_seconds': time.perf_counter() - wall_start,
+            'stages': list(session_records.values())
+        }
+        profiles = session_profiles
+        session_records, session_profiles = None, None
+
+        write_profile(report, output_path, file_format)
+        logger.info(f"Wrote the profile of {len(report['stages'])} pipeline functions to {output_path}")
+
+        if profiles:
+            write_stage_profiles(profiles)